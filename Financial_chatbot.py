@@ -1,95 +1,562 @@
-import requests
-from bs4 import BeautifulSoup
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import sent_tokenize
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import torch
-import nltk
-nltk.download('punkt')
-nltk.download('punkt_tab')
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import os
+import re
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import queue
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
 import streamlit as st
-import transformers
-print(transformers.__version__)
+from financial_articles import (
+    PREPROCESS_VERSION, ArticleStore, CorpusIndex, bound_context, preprocess_documents, preprocess_text,
+    refresh_corpus,
+)
 
+# Model used by the chatbot. Override with environment variables, e.g. a small local
+# checkpoint on CPU-only machines: CHATBOT_MODEL=distilgpt2 CHATBOT_DEVICE_MAP=cpu
+MODEL_NAME = os.environ.get("CHATBOT_MODEL", "meta-llama/Llama-2-13b-chat")
+DEVICE_MAP = os.environ.get("CHATBOT_DEVICE_MAP", "auto")
+TORCH_DTYPE = os.environ.get("CHATBOT_DTYPE", "auto")
+# CPU-only nodes: CHATBOT_CPU_MODE=1 loads CHATBOT_CPU_MODEL (the main model by
+# default) in float32 on the CPU with its linear layers quantized to int8
+CPU_MODE = os.environ.get("CHATBOT_CPU_MODE", "0") == "1"
+if CPU_MODE:
+    MODEL_NAME = os.environ.get("CHATBOT_CPU_MODEL", MODEL_NAME)
+    DEVICE_MAP = ""
+    TORCH_DTYPE = "float32"
+QUANTIZE = os.environ.get("CHATBOT_QUANTIZE", "int8" if CPU_MODE else "")
+# Tokens of context put in a prompt, the best matching passages are kept
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CHATBOT_CONTEXT_TOKENS", "384"))
+# Generation budget of an answer: new tokens (the prompt is not counted) and seconds
+GENERATION_PARAMS = {
+    'max_new_tokens': int(os.environ.get("CHATBOT_MAX_NEW_TOKENS", "128")),
+    'max_time': float(os.environ.get("CHATBOT_MAX_SECONDS", "30")),
+}
+# On-disk tier of the answer cache, set CHATBOT_ANSWER_CACHE to an empty string to
+# keep answers in memory only
+ANSWER_CACHE_PATH = os.environ.get("CHATBOT_ANSWER_CACHE", "./Data/answer_cache.sqlite3")
+# Inference worker: prompts generated together, how long the first prompt of a batch
+# waits for others (seconds) and how many prompts may wait before new ones are refused
+MAX_BATCH_SIZE = int(os.environ.get("CHATBOT_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT = float(os.environ.get("CHATBOT_MAX_BATCH_WAIT", "0.05"))
+MAX_QUEUE_SIZE = int(os.environ.get("CHATBOT_MAX_QUEUE_SIZE", "64"))
+# Contexts whose encoded prompt prefix (KV cache) is kept for follow-up questions
+PREFIX_CACHE_SIZE = int(os.environ.get("CHATBOT_PREFIX_CACHE_SIZE", "4"))
 
-# Load the LLaMA model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained("meta-llama/Llama-2-13b-chat")
-model = AutoModelForCausalLM.from_pretrained("meta-llama/Llama-2-13b-chat", device_map="auto")
+# Loads each model once per process, on the first question or in the background with
+# warm_up, and records how long every startup phase took
+class ModelRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loads = {}
+        self.timings = {}
 
-def answer_question(question, context):
-    # Format the prompt as a conversational input for better results with LLaMA
-    prompt = f"Context: {context}\n\nQuestion: {question}\nAnswer:"
-    inputs = tokenizer(prompt, return_tensors='pt').to(model.device)
-    outputs = model.generate(inputs['input_ids'], max_length=150)
-    answer = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    # Process the model output to get the answer part only
-    return answer.split("Answer:")[-1].strip()
-
-st.title("Financial Chatbot")
-context = st.text_area("Enter the context:")
-question = st.text_input("Ask a question:")
-
-if st.button("Get Answer"):
-    if context and question:
-        answer = answer_question(question, context)
-        st.write("Answer:", answer)
-    else:
-        st.write("Please provide both context and a question.")
-
-# Define functions (same as before)
-def get_yahoo_finance_articles(base_url, count=26):
-    response = requests.get(base_url)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'html.parser')
-        articles = soup.find_all('li', class_='js-stream-content')
-        result = [{"title": article.find('h3').get_text(strip=True), "link": article.find('a')['href']} for article in articles[:count]]
-        return result
-    else:
+    def _record(self, phase, start):
+        self.timings[phase] = round(time.perf_counter() - start, 3)
+
+    def _load(self, name, device_map, torch_dtype, quantize=""):
+        start = time.perf_counter()
+        import torch  # Heavy imports are only paid when a model is needed
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        self._record("import torch/transformers", start)
+
+        start = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        self._record(f"load tokenizer {name}", start)
+
+        start = time.perf_counter()
+        model = AutoModelForCausalLM.from_pretrained(name, device_map=device_map or None, torch_dtype=torch_dtype)
+        model.eval()
+        self._record(f"load model {name}", start)
+
+        if quantize == "int8":
+            start = time.perf_counter()
+            # Dynamic quantization: int8 weights, activations quantized on the fly (CPU only)
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self._record(f"quantize model {name} to int8", start)
+        elif quantize:
+            raise ValueError(f"Unknown quantization: {quantize}")
+        return tokenizer, model
+
+    # The load future of a model and whether the caller is the one who must run it
+    def _claim(self, key):
+        with self._lock:
+            if key in self._loads:
+                return self._loads[key], False
+            future = Future()
+            self._loads[key] = future
+            return future, True
+
+    def _run(self, key, future):
+        try:
+            future.set_result(self._load(*key))
+        except BaseException as e:
+            with self._lock:
+                del self._loads[key]  # Let the next call try again
+            future.set_exception(e)
+
+    # (tokenizer, model), loading them on the first call and waiting for a load in progress
+    def get(self, name=MODEL_NAME, device_map=DEVICE_MAP, torch_dtype=TORCH_DTYPE, quantize=QUANTIZE):
+        key = (name, device_map, torch_dtype, quantize)
+        future, owner = self._claim(key)
+        if owner:
+            self._run(key, future)
+        return future.result()
+
+    # Start loading a model in a background thread
+    def warm_up(self, name=MODEL_NAME, device_map=DEVICE_MAP, torch_dtype=TORCH_DTYPE, quantize=QUANTIZE):
+        key = (name, device_map, torch_dtype, quantize)
+        future, owner = self._claim(key)
+        if owner:
+            threading.Thread(target=self._run, args=(key, future), daemon=True, name="model-warm-up").start()
+        return future
+
+    def is_ready(self, name=MODEL_NAME, device_map=DEVICE_MAP, torch_dtype=TORCH_DTYPE, quantize=QUANTIZE):
+        future = self._loads.get((name, device_map, torch_dtype, quantize))
+        return future is not None and future.done() and future.exception() is None
+
+# One registry per process, shared by every session and kept across script reruns
+@st.cache_resource
+def get_model_registry():
+    return ModelRegistry()
+
+class WorkerOverloaded(RuntimeError):
+    pass
+
+# Outcome of a prompt: the generated text (None when it was streamed), the number of
+# new tokens and why generation stopped: 'eos', 'max_new_tokens', 'max_time' or
+# 'max_length' (the model's own limit when no budget is given)
+class Generation(namedtuple('Generation', ['text', 'tokens', 'stop_reason'])):
+    __slots__ = ()
+
+    # The model ended the answer or used its whole token budget, it was not cut by the
+    # time budget
+    @property
+    def complete(self):
+        return self.stop_reason != 'max_time'
+
+# Splits the tokens of a batched generate call between the streamers of its rows
+# (None for the rows that are not streamed). A row's streamer is ended as soon as the
+# row produces an EOS, so its reader does not wait for the longest answer of the batch.
+class BatchStreamer:
+    def __init__(self, streamers, eos_token_ids):
+        self.streamers = list(streamers)
+        self.eos_token_ids = eos_token_ids
+        self._prompt = True  # generate gives the prompts first, then one token per row and step
+
+    def put(self, value):
+        rows = value.reshape(len(self.streamers), -1)
+        for row, streamer in enumerate(self.streamers):
+            if streamer is None:
+                continue
+            tokens = rows[row]
+            if not self._prompt:
+                ends = [position for position, token in enumerate(tokens.tolist()) if token in self.eos_token_ids]
+                if ends:
+                    streamer.put(tokens[:ends[0]])
+                    streamer.end()
+                    self.streamers[row] = None
+                    continue
+            streamer.put(tokens)
+        self._prompt = False
+
+    def end(self):
+        for streamer in self.streamers:
+            if streamer is not None:
+                streamer.end()
+        self.streamers = [None] * len(self.streamers)
+
+# Single thread owning the model: prompts from every session go through its queue and
+# are generated in batches, the first prompt waits at most `max_wait` seconds for
+# others to join. Prompts are left padded so a batch shares one generate call, and
+# only prompts with the same generation parameters are batched together. Streamed
+# prompts are batched like the others, a BatchStreamer sends each row its own text.
+# submit() and submit_stream() refuse new prompts with WorkerOverloaded once
+# `max_queue_size` are waiting.
+# A prompt generated alone can give the `prefix` it starts with (the context): the
+# KV cache of the prefix is computed once and reused by the next prompts starting
+# with it, so a follow-up question only encodes the question itself. Under load,
+# batching wins: the prompts of a batch are encoded whole.
+class InferenceWorker:
+    def __init__(self, registry, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT,
+                 max_queue_size=MAX_QUEUE_SIZE, prefix_cache_size=PREFIX_CACHE_SIZE):
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.prefix_cache_size = prefix_cache_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._prefixes = OrderedDict()  # Only used by the worker thread
+        self.stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'batches': 0,
+                      'max_queue_depth': 0, 'max_batch_size': 0, 'prefix_hits': 0, 'prefix_misses': 0}
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def mean_batch_size(self):
+        batches = self.stats['batches']
+        return (self.stats['completed'] + self.stats['failed']) / batches if batches else 0.0
+
+    # Future of the Generation of `prompt`
+    def submit(self, prompt, generation_params=None, prefix=None):
+        return self._enqueue(prompt, generation_params, None, prefix)
+
+    # Iterator over the text of `prompt` as it is generated, and the future of its
+    # Generation (without the text)
+    def submit_stream(self, prompt, generation_params=None, timeout=None, prefix=None):
+        from transformers import TextIteratorStreamer
+        tokenizer, _ = self.registry.get()
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, timeout=timeout, skip_special_tokens=True)
+        return streamer, self._enqueue(prompt, generation_params, streamer, prefix)
+
+    def _enqueue(self, prompt, generation_params, streamer, prefix):
+        future = Future()
+        params = tuple(sorted((generation_params or GENERATION_PARAMS).items()))
+        try:
+            self._queue.put_nowait((prompt, params, future, streamer, prefix))
+        except queue.Full:
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise WorkerOverloaded(f"{self._queue.maxsize} questions are already waiting, try again shortly")
+        with self._lock:
+            self.stats['submitted'] += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self._queue.qsize())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._serve, daemon=True, name="inference-worker")
+                self._thread.start()
+        return future
+
+    # Wait for a prompt, then collect more until the batch is full or max_wait passed
+    def _next_batch(self, pending):
+        if not pending:
+            pending.append(self._queue.get())
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                pending.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        params = pending[0][1]
+        batch = [item for item in pending if item[1] == params][:self.max_batch_size]
+        pending[:] = [item for item in pending if item not in batch]
+        return params, batch
+
+    def _serve(self):
+        pending = []
+        while True:
+            params, batch = self._next_batch(pending)
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            prompt, _, _, streamer, prefix = batch[0]
+            try:
+                if len(batch) == 1 and (prefix or streamer is not None):
+                    results = [self._generate_one(prompt, dict(params), prefix, streamer)]
+                else:
+                    results = self._generate([item[0] for item in batch], dict(params), [item[3] for item in batch])
+            except BaseException as e:
+                for item in batch:
+                    if item[3] is not None:
+                        item[3].on_finalized_text("", stream_end=True)  # Don't leave the reader waiting
+                for item in batch:
+                    item[2].set_exception(e)
+                outcome = 'failed'
+            else:
+                for item, result in zip(batch, results):
+                    item[2].set_result(result)
+                outcome = 'completed'
+            with self._lock:
+                self.stats['batches'] += 1
+                self.stats[outcome] += len(batch)
+                self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+
+    # Generations of a batch of prompts, `streamers` has the streamer of every streamed
+    # prompt and None for the others
+    def _generate(self, prompts, generation_params, streamers=None):
+        tokenizer, model = self.registry.get()
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = 'left'  # Decoder-only models continue from the right end
+        streamers = streamers or [None] * len(prompts)
+        eos_token_ids = self._eos_token_ids(tokenizer, model)
+        streamer = BatchStreamer(streamers, eos_token_ids) if any(streamers) else None
+        inputs = tokenizer(prompts, return_tensors='pt', padding=True).to(model.device)
+        outputs = model.generate(inputs['input_ids'], attention_mask=inputs['attention_mask'],
+                                 pad_token_id=tokenizer.pad_token_id, streamer=streamer, **generation_params)
+        # Only the new tokens, the prompt is the same length for the whole batch
+        new_tokens = outputs[:, inputs['input_ids'].shape[1]:]
+        texts = tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        return [Generation(None if row_streamer is not None else text,
+                           *self._stop(row, generation_params, eos_token_ids))
+                for text, row, row_streamer in zip(texts, new_tokens, streamers)]
+
+    @staticmethod
+    def _eos_token_ids(tokenizer, model):
+        eos = model.generation_config.eos_token_id
+        return (set(eos if isinstance(eos, (list, tuple)) else [eos]) | {tokenizer.eos_token_id}) - {None}
+
+    # (tokens, stop reason) of the new tokens of one prompt. A finished prompt of a
+    # batch is padded after its EOS; all the prompts of a batch stop at the same step
+    # when the time budget runs out, before reaching max_new_tokens.
+    @staticmethod
+    def _stop(new_tokens, generation_params, eos_token_ids):
+        new_tokens = new_tokens.tolist()
+        for position, token in enumerate(new_tokens):
+            if token in eos_token_ids:
+                return position + 1, 'eos'
+        if len(new_tokens) >= generation_params.get('max_new_tokens', float('inf')):
+            return len(new_tokens), 'max_new_tokens'
+        if generation_params.get('max_time') is not None:
+            return len(new_tokens), 'max_time'
+        return len(new_tokens), 'max_length'
+
+    # Input ids of a single prompt and, when it starts with `prefix`, a copy of the
+    # prefix KV cache so generate only runs the model over the rest of the prompt
+    def _encode(self, prompt, prefix, tokenizer, model):
+        import torch
+        if not (prefix and self.prefix_cache_size and prompt.startswith(prefix) and len(prompt) > len(prefix)):
+            return tokenizer(prompt, return_tensors='pt')['input_ids'].to(model.device), {}
+
+        entry = self._prefixes.get(prefix)
+        if entry is None:
+            prefix_ids = tokenizer(prefix, return_tensors='pt')['input_ids'].to(model.device)
+            with torch.no_grad():
+                # The forward pass creates the cache type of the installed transformers version
+                cache = model(prefix_ids, use_cache=True).past_key_values
+            entry = self._prefixes[prefix] = (prefix_ids, cache)
+            while len(self._prefixes) > self.prefix_cache_size:
+                self._prefixes.popitem(last=False)
+            self.stats['prefix_misses'] += 1
+        else:
+            self._prefixes.move_to_end(prefix)
+            self.stats['prefix_hits'] += 1
+
+        prefix_ids, cache = entry
+        rest = tokenizer(prompt[len(prefix):], return_tensors='pt', add_special_tokens=False)['input_ids']
+        # generate extends the cache it is given, the stored one must stay the prefix only
+        return torch.cat([prefix_ids, rest.to(model.device)], dim=1), {'past_key_values': copy.deepcopy(cache)}
+
+    def _generate_one(self, prompt, generation_params, prefix, streamer=None):
+        import torch
+        tokenizer, model = self.registry.get()
+        input_ids, cached = self._encode(prompt, prefix, tokenizer, model)
+        outputs = model.generate(input_ids, attention_mask=torch.ones_like(input_ids),
+                                 pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+                                 streamer=streamer, **cached, **generation_params)
+        new_tokens = outputs[0, input_ids.shape[1]:]
+        tokens, stop_reason = self._stop(new_tokens, generation_params, self._eos_token_ids(tokenizer, model))
+        text = None if streamer is not None else tokenizer.decode(new_tokens, skip_special_tokens=True)
+        return Generation(text, tokens, stop_reason)
+
+# One inference worker per process, shared by every session
+@st.cache_resource
+def get_inference_worker():
+    return InferenceWorker(get_model_registry())
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?!. ")
+
+# Cache of generated answers keyed by the normalized question, a hash of the context,
+# the model and the generation parameters. Answers live in an in-memory LRU and,
+# when a path is given, in SQLite so they survive restarts; both expire after `ttl`
+# seconds. Hits, misses and the hit rate are kept in `stats`.
+class AnswerCache:
+    def __init__(self, max_entries=1024, ttl=24 * 3600, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.stats = {'hits': 0, 'misses': 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS answers (
+                        key TEXT PRIMARY KEY,
+                        answer TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    )""")
+                conn.execute("CREATE INDEX IF NOT EXISTS answers_accessed_at ON answers (accessed_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def key(question, context, model_name, generation_params):
+        return hashlib.sha256(json.dumps([
+            normalize_question(question),
+            hashlib.sha256(context.encode('utf-8')).hexdigest(),
+            model_name,
+            sorted(generation_params.items()),
+        ]).encode('utf-8')).hexdigest()
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] > self.ttl:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+
+        if self.path:
+            conn = self._connect()
+            try:
+                with conn:
+                    row = conn.execute("SELECT answer, created_at FROM answers WHERE key = ? AND created_at >= ?",
+                                       (key, now - self.ttl)).fetchone()
+                    if row is not None:
+                        conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+            finally:
+                conn.close()
+            if row is not None:
+                with self._lock:
+                    self._remember(key, row[0], row[1])
+                    self.stats['hits'] += 1
+                return row[0]
+
+        with self._lock:
+            self.stats['misses'] += 1
         return None
 
-def get_links(articles):
-    return [
-        article['link'] if article['link'].startswith('http') else f"https://finance.yahoo.com{article['link']}"
-        for article in articles
-    ]
+    def put(self, key, answer):
+        now = time.time()
+        with self._lock:
+            self._remember(key, answer, now)
+        if self.path:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)", (key, answer, now, now))
+                    conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+                    conn.execute("""
+                        DELETE FROM answers WHERE key IN (
+                            SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                        )""", (self.max_disk_entries,))
+            finally:
+                conn.close()
+
+    def _remember(self, key, answer, created_at):
+        self._memory[key] = (answer, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+# One answer cache per process, shared by every session
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache(path=ANSWER_CACHE_PATH or None)
+
+def token_counter(tokenizer):
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+# The prompt and its context part. A long context is cut down to the passages that
+# best match the question, so questions selecting the same passages (a follow-up on
+# the same topic, or a context that fits whole) start with the same prefix and the
+# inference worker reuses its KV cache; a question on another part of the context
+# gets its own passages.
+def build_prompt(question, context, tokenizer, token_budget=CONTEXT_TOKEN_BUDGET):
+    # Keep the prompt size bounded: a long context is cut down to its best passages
+    context = bound_context(question, context, token_budget, token_counter(tokenizer))
+    # Format the prompt as a conversational input for better results with LLaMA
+    prefix = f"Context: {context}\n\n"
+    return prefix + f"Question: {question}\nAnswer:", prefix
+
+def answer_question(question, context, registry=None, token_budget=CONTEXT_TOKEN_BUDGET, cache=None,
+                    generation_params=None, worker=None):
+    generation_params = dict(GENERATION_PARAMS, **(generation_params or {}))
+    # A cached answer skips the model entirely, no tokenization and no generation
+    cache = cache or get_answer_cache()
+    key = AnswerCache.key(question, context, MODEL_NAME, dict(generation_params, token_budget=token_budget))
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
 
-def get_paragraphs_text(soup):
-    paragraphs = soup.find_all('p')
-    return [paragraph.text.lower() for paragraph in paragraphs]
+    worker = worker or get_inference_worker()
+    tokenizer, _ = (registry or worker.registry).get()
+    prompt, prefix = build_prompt(question, context, tokenizer, token_budget)
+    # Generated by the shared worker, batched with the questions of other sessions
+    generation = worker.submit(prompt, generation_params, prefix=prefix).result()
+    answer = generation.text.strip()
+    # An empty answer or one cut by the time budget is not kept
+    if answer and generation.complete:
+        cache.put(key, answer)
+    return answer
 
-def extract_text_from_article(link):
-    response = requests.get(link)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    text = get_paragraphs_text(soup)
-    return text
+# Same as answer_question but yields the answer text as it is generated. `metrics` is
+# filled with the time to the first token (None when no text was generated), the
+# number of generated tokens, the tokens per second and why generation stopped once
+# the answer is complete.
+def stream_answer(question, context, registry=None, token_budget=CONTEXT_TOKEN_BUDGET, cache=None,
+                  generation_params=None, worker=None, metrics=None):
+    metrics = {} if metrics is None else metrics
+    generation_params = dict(GENERATION_PARAMS, **(generation_params or {}))
+    cache = cache or get_answer_cache()
+    key = AnswerCache.key(question, context, MODEL_NAME, dict(generation_params, token_budget=token_budget))
+    cached = cache.get(key)
+    if cached is not None:
+        metrics['cached'] = True
+        yield cached
+        return
 
-def parse_all_articles(links):
-    return ['.'.join(extract_text_from_article(link)) for link in links]
+    worker = worker or get_inference_worker()
+    tokenizer, _ = (registry or worker.registry).get()
+    prompt, prefix = build_prompt(question, context, tokenizer, token_budget)
+    start = time.perf_counter()
+    metrics['time_to_first_token'] = None
+    pieces = []
+    streamer, future = worker.submit_stream(prompt, generation_params, prefix=prefix)
+    for text in streamer:
+        if not text:
+            continue
+        if metrics['time_to_first_token'] is None:
+            metrics['time_to_first_token'] = round(time.perf_counter() - start, 3)
+        pieces.append(text)
+        yield text
+    generation = future.result()
+    elapsed = time.perf_counter() - start
+    metrics['tokens'] = generation.tokens
+    metrics['seconds'] = round(elapsed, 3)
+    metrics['tokens_per_second'] = round(generation.tokens / elapsed, 1) if elapsed > 0 else 0.0
+    metrics['stop_reason'] = generation.stop_reason
+    answer = "".join(pieces).strip()
+    if answer and generation.complete:
+        cache.put(key, answer)
 
+# Tokenize and lemmatize word by word, on every core for large corpora
 def data_preprocessing(bdd):
-    preprocessed_bdd = []
-    lemmatizer = WordNetLemmatizer()
-    for doc in bdd:
-        tokens = sent_tokenize(doc)
-        lemmatized_tokens = [lemmatizer.lemmatize(token) for token in tokens]
-        preprocessed_bdd.append(' '.join(lemmatized_tokens))
+    preprocessed_bdd = preprocess_documents(bdd)
     return preprocessed_bdd
 
-def get_best_article(user_input):
-    preprocessed_bdd.append(user_input)
-    vectorizer = TfidfVectorizer(stop_words='english')
-    tfidf_matrix = vectorizer.fit_transform(preprocessed_bdd)
-    cosine_sim = cosine_similarity(tfidf_matrix[-1], tfidf_matrix[:-1])
-    most_similar_index = np.argmax(cosine_sim)
-    if cosine_sim[0][most_similar_index] < 1 and cosine_sim[0][most_similar_index] > 0.1:
-        return preprocessed_bdd[most_similar_index]
+def get_best_article(user_input, index=None):
+    index = index or get_corpus_index().current()
+    results = index.search(preprocess_text(user_input), k=1)  # The corpus is searched by lemmas
+    if results and 0.1 < results[0][1] < 1:
+        return index.raw_documents[results[0][0]]
     else:
         return "I am sorry, I could not understand you."
 
 def generate_answer_bert(question, context):
+    import torch
+    tokenizer, model = get_model_registry().get()
+    count_tokens = token_counter(tokenizer)
+    context = bound_context(question, context, 512 - count_tokens(question) - 3, count_tokens)
     inputs = tokenizer(question, context, return_tensors='pt', max_length=512, truncation=True)
     outputs = model(**inputs)
     answer_start = torch.argmax(outputs.start_logits)
@@ -98,29 +565,96 @@ def generate_answer_bert(question, context):
     cleaned_answer = answer.replace("[CLS]", "").replace("[SEP]", "").strip()
     return cleaned_answer
 
-def get_final_answer(question, bdd):
-    best_context = get_best_context(question, bdd)
+def get_final_answer(question, index=None):
+    best_context = get_best_context(question, index)
     bert_answer = generate_answer_bert(question, best_context)
     return bert_answer
 
-def get_best_context(question, articles):
-    articles.append(question)
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(articles)
-    similarities = cosine_similarity(tfidf_matrix[-1], tfidf_matrix[:-1])
-    best_index = similarities.argmax()
-    articles.pop()
-    return articles[best_index]
-
-def load_articles():
-    articles = get_yahoo_finance_articles("https://finance.yahoo.com/topic/personal-finance-news/") + \
-               get_yahoo_finance_articles("https://finance.yahoo.com/") + \
-               get_yahoo_finance_articles("https://finance.yahoo.com/calendar/") + \
-               get_yahoo_finance_articles("https://finance.yahoo.com/topic/stock-market-news/")
-    urls = get_links(articles)
-    bdd = parse_all_articles(urls)
-    preprocessed_bdd = data_preprocessing(bdd)
-    return preprocessed_bdd
+# The passages of the articles most relevant to the question, within token_budget,
+# as the articles read (the index matches them to the question by their lemmas)
+def get_best_context(question, index=None, token_budget=CONTEXT_TOKEN_BUDGET, count_tokens=None):
+    index = index or get_corpus_index().current()
+    if count_tokens is None:
+        registry = get_model_registry()
+        count_tokens = token_counter(registry.get()[0]) if registry.is_ready() else None
+    if count_tokens is None:
+        return index.build_context(question, token_budget)
+    return index.build_context(question, token_budget, count_tokens)
+
+# Refresh the on-disk article store (only new or changed articles are downloaded and
+# preprocessed again) and return the preprocessed corpus and the raw articles
+def load_articles(store=None):
+    store = store or ArticleStore()
+    refresh_corpus(store, data_preprocessing, preprocess_version=PREPROCESS_VERSION)
+    articles = store.articles()
+    preprocessed_bdd = [preprocessed for _, preprocessed in articles]
+    raw_bdd = [raw for raw, _ in articles]
+    return preprocessed_bdd, raw_bdd
+
+# Retrieval index over the articles, shared by every session: the saved index is
+# used right away and the articles are refreshed from the news pages every hour
+@st.cache_resource
+def get_corpus_index():
+    def load_documents():
+        start = time.perf_counter()
+        corpus = load_articles()
+        get_model_registry()._record("load articles", start)
+        return corpus
+    return CorpusIndex(load_documents)
+
+def main():
+    registry = get_model_registry()
+    registry.warm_up()  # Load the model in the background while the page renders
+
+    st.title("Financial Chatbot")
+    context = st.text_area("Enter the context (leave empty to search the latest Yahoo Finance articles):")
+    question = st.text_input("Ask a question:")
+    # A follow-up question keeps the articles found for the previous one, and so the
+    # same prompt prefix
+    retrieved = st.session_state.get('retrieved_context')
+    follow_up = bool(retrieved) and not context and st.checkbox("Follow-up on the articles of the previous answer")
+
+    if st.button("Get Answer"):
+        if question:
+            if not context and follow_up:
+                context = retrieved
+            elif not context:
+                with st.spinner("Searching the latest articles..."):
+                    context = get_best_context(question)
+                if not context:
+                    st.write("No article found, please provide a context.")
+                    return
+                st.session_state['retrieved_context'] = context
+            if not registry.is_ready():
+                st.info("The model is still loading, the answer will come as soon as it is ready.")
+            metrics = {}
+            st.write("Answer:")
+            try:
+                st.write_stream(stream_answer(question, context, registry, metrics=metrics))
+            except WorkerOverloaded as e:
+                st.warning(f"The chatbot is busy: {e}")
+                return
+            if metrics.get('cached'):
+                st.caption("Answered from the cache.")
+            elif metrics.get('time_to_first_token') is None:
+                st.caption(f"No answer was generated ({metrics.get('seconds')}s).")
+            else:
+                st.caption(f"First token after {metrics['time_to_first_token']}s, {metrics['tokens']} tokens "
+                           f"in {metrics['seconds']}s ({metrics['tokens_per_second']} tokens/s)")
+                if metrics.get('stop_reason') == 'max_time':
+                    st.caption("The answer was cut at the time limit.")
+        else:
+            st.write("Please provide a question.")
+
+    with st.sidebar.expander("Startup timings (s)"):
+        st.write(registry.timings or "Nothing loaded yet.")
+    answer_cache = get_answer_cache()
+    st.sidebar.caption(f"Answer cache: {answer_cache.stats['hits']} hits, {answer_cache.stats['misses']} misses "
+                       f"({answer_cache.hit_rate():.0%} hit rate)")
+    worker = get_inference_worker()
+    st.sidebar.caption(f"Inference: {worker.queue_depth()} waiting (max {worker.stats['max_queue_depth']}), "
+                       f"{worker.stats['batches']} batches of {worker.mean_batch_size():.1f} questions on average, "
+                       f"{worker.stats['rejected']} refused, {worker.stats['prefix_hits']} reused contexts")
 
-# Load articles on app start
-preprocessed_bdd = load_articles()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import warnings
+
+import numpy as np
+
+# Spending anomalies against the user's own history: every category of a month is
+# compared with the median of the same category over the previous `window` months,
+# in units of the median absolute deviation (robust z-score), so rent is compared
+# with rent and a spike is found even when other categories are larger.
+#
+# Series are arrays of shape (..., months, categories), any leading axes (users)
+# being processed at once. NaN marks months without history (before the first
+# statement of a user), a month without spending in a category is 0.
+
+DEFAULT_WINDOW = 12  # months of history a month is compared with
+Z_THRESHOLD = 3.5  # robust z-score above which a month is an anomaly
+MIN_PERIODS = 3  # months of history needed before anything is flagged
+MIN_SCALE = 10.0  # smallest deviation (currency units) a z-score is measured in
+RELATIVE_SCALE = 0.1  # and at least this fraction of the median
+MAD_TO_STD = 1.4826  # MAD of a normal distribution to its standard deviation
+
+# Median over the months axis, NaN (without a warning) where there is no history
+def nan_median(history):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(history, axis=-2)
+
+# Robust z-scores of `latest` (..., categories) against `history` (..., months,
+# categories), NaN where the history has fewer than min_periods months
+def robust_zscores(history, latest, min_periods=MIN_PERIODS, min_scale=MIN_SCALE):
+    history = np.asarray(history, dtype=np.float64)
+    latest = np.asarray(latest, dtype=np.float64)
+    periods = np.sum(~np.isnan(history), axis=-2)
+    median = nan_median(history)
+    mad = nan_median(np.abs(history - median[..., None, :]))
+    scale = np.maximum(np.maximum(MAD_TO_STD * mad, RELATIVE_SCALE * np.abs(median)), min_scale)
+    z = (latest - median) / scale
+    return np.where(periods >= min_periods, z, np.nan)
+
+# Robust z-score of every month of `series` (..., months, categories) against the
+# `window` months before it, NaN for the first months
+def rolling_zscores(series, window=DEFAULT_WINDOW, min_periods=MIN_PERIODS, min_scale=MIN_SCALE):
+    series = np.asarray(series, dtype=np.float64)
+    months = series.shape[-2]
+    z = np.full(series.shape, np.nan)
+    if months <= 1:
+        return z
+    # Pad the start so every month has `window` previous months, missing ones NaN
+    padding = [(0, 0)] * (series.ndim - 2) + [(window, 0), (0, 0)]
+    padded = np.pad(series, padding, constant_values=np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=-2)  # (..., months + 1, categories, window)
+    history = np.swapaxes(windows[..., :months, :, :], -1, -2)  # Window of month t ends at t - 1
+    z[...] = robust_zscores(history, series, min_periods, min_scale)
+    return z
+
+# Boolean mask of the anomalous (month, category) cells of a series
+def detect_anomalies(series, window=DEFAULT_WINDOW, threshold=Z_THRESHOLD, min_periods=MIN_PERIODS):
+    z = rolling_zscores(series, window, min_periods)
+    return np.nan_to_num(z, nan=-np.inf) > threshold
+
+# Incremental detection: keeps the last `window` months of every category (of one or
+# many users, as leading axes) and scores each new month against them in
+# O(window x categories), without looking at older history again
+class AnomalyDetector:
+    def __init__(self, categories, window=DEFAULT_WINDOW, threshold=Z_THRESHOLD, min_periods=MIN_PERIODS,
+                 history=None, batch_shape=()):
+        self.categories = list(categories)
+        self.window = window
+        self.threshold = threshold
+        self.min_periods = min_periods
+        self.history = np.full((*batch_shape, window, len(self.categories)), np.nan)
+        if history is not None:
+            history = np.asarray(history, dtype=np.float64)[..., -window:, :]
+            self.history[..., window - history.shape[-2]:, :] = history
+
+    # z-scores of a new month (..., categories) and whether they are anomalies, then
+    # the month becomes part of the history
+    def update(self, month_totals):
+        month_totals = np.asarray(month_totals, dtype=np.float64)
+        z = robust_zscores(self.history, month_totals, self.min_periods)
+        self.history = np.concatenate([self.history[..., 1:, :], month_totals[..., None, :]], axis=-2)
+        return z, np.nan_to_num(z, nan=-np.inf) > self.threshold
+
+    # (category, amount, usual amount, z) of every anomaly of a new month of one user
+    def explain(self, month_totals):
+        usual = nan_median(self.history)
+        z, flags = self.update(month_totals)
+        return [(category, float(month_totals[i]), float(usual[i]), float(z[i]))
+                for i, category in enumerate(self.categories) if flags[i]]
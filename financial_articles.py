@@ -0,0 +1,621 @@
+import os
+import re
+import time
+import pickle
+import sqlite3
+import hashlib
+import functools
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin, urlsplit
+
+import requests
+import numpy as np
+from bs4 import BeautifulSoup
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, CountVectorizer, TfidfVectorizer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Article corpus of the financial chatbot: scraping of the Yahoo Finance news pages,
+# the on-disk article store refreshed incrementally from them and the retrieval
+# index built over the stored articles.
+
+BASE_URL = "https://finance.yahoo.com"
+NEWS_PAGES = [
+    "/topic/personal-finance-news/",
+    "/",
+    "/calendar/",
+    "/topic/stock-market-news/",
+]
+REQUEST_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+ARTICLE_STORE_PATH = "./Data/articles.sqlite3"
+RETRIEVAL_INDEX_PATH = "./Data/retrieval_index.pkl"
+PASSAGE_WORDS = 120  # words per passage
+PASSAGE_OVERLAP = 30  # words shared by two consecutive passages
+# Version of the preprocessing whose output is kept in the article store, bump it when
+# preprocess_text changes so the stored articles are preprocessed again
+PREPROCESS_VERSION = 2
+PREPROCESS_CHUNK_SIZE = 200  # articles per process pool task
+NLTK_DATA = (('tokenizers/punkt', 'punkt'), ('tokenizers/punkt_tab', 'punkt_tab'), ('corpora/wordnet', 'wordnet'))
+
+# One pooled session shared by every request, retrying transient failures
+def make_session(pool_size=32, retries=3):
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET', 'HEAD']))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = "Mozilla/5.0 (compatible; InvestSmart/1.0)"
+    return session
+
+def get_paragraphs_text(soup):
+    paragraphs = soup.find_all('p')
+    return [paragraph.text.lower() for paragraph in paragraphs]
+
+def parse_article(html):
+    return '.'.join(get_paragraphs_text(BeautifulSoup(html, 'html.parser')))
+
+def parse_news_page(html, count=26):
+    soup = BeautifulSoup(html, 'html.parser')
+    articles = soup.find_all('li', class_='js-stream-content')
+    result = []
+    for article in articles[:count]:
+        title, link = article.find('h3'), article.find('a')
+        if title is not None and link is not None and link.get('href'):
+            result.append({"title": title.get_text(strip=True), "link": link['href']})
+    return result
+
+def get_links(articles, base_url=BASE_URL):
+    return [
+        article['link'] if article['link'].startswith('http') else urljoin(base_url, article['link'])
+        for article in articles
+    ]
+
+# Fetches many pages concurrently over one pooled session: a bounded thread pool,
+# at most `per_host` requests in flight per host, timeouts and retries on every
+# request. Pages are parsed in the worker threads as soon as they arrive.
+class ArticleScraper:
+    def __init__(self, session=None, max_workers=16, per_host=4, timeout=REQUEST_TIMEOUT):
+        self.session = session or make_session(pool_size=max_workers)
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    # Response of `url`, None when the request failed
+    def fetch_response(self, url, headers=None):
+        with self._host_slot(url):
+            try:
+                return self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException:
+                return None
+
+    # Body of `url`, None when it could not be fetched
+    def fetch(self, url):
+        response = self.fetch_response(url)
+        if response is None or response.status_code != 200:
+            return None
+        return response.text
+
+    # Run `function` over `items` on the pool and yield (item, result) in completion
+    # order, skipping the items whose result is None
+    def run(self, function, items):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scrape") as pool:
+            futures = {pool.submit(function, item): item for item in items}
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    yield futures[future], result
+
+    # Yield (url, parsed page) in completion order, skipping pages that failed
+    def scrape(self, urls, parse=parse_article):
+        def fetch_and_parse(url):
+            html = self.fetch(url)
+            return None if html is None else parse(html)
+        return self.run(fetch_and_parse, dict.fromkeys(urls))
+
+    # Parsed pages in the order of `urls`, failed pages left out
+    def scrape_all(self, urls, parse=parse_article):
+        results = dict(self.scrape(urls, parse))
+        return [results[url] for url in dict.fromkeys(urls) if url in results]
+
+def get_yahoo_finance_articles(base_url, count=26, scraper=None):
+    html = (scraper or ArticleScraper()).fetch(base_url)
+    return parse_news_page(html, count) if html is not None else []
+
+def parse_all_articles(links, scraper=None):
+    return (scraper or ArticleScraper()).scrape_all(links)
+
+# Links of every article listed on the news pages
+def scrape_article_links(base_url=BASE_URL, pages=NEWS_PAGES, scraper=None):
+    scraper = scraper or ArticleScraper()
+    news_pages = [urljoin(base_url, page) for page in pages]
+    articles = [article for page in scraper.scrape_all(news_pages, parse=parse_news_page) for article in page]
+    return list(dict.fromkeys(get_links(articles, base_url)))
+
+# Scrape the news pages, then every article they link to, as one concurrent pipeline
+def scrape_articles(base_url=BASE_URL, pages=NEWS_PAGES, scraper=None):
+    scraper = scraper or ArticleScraper()
+    return parse_all_articles(scrape_article_links(base_url, pages, scraper), scraper)
+
+# Download the NLTK data used by the preprocessing, only when it is missing
+@functools.lru_cache(maxsize=None)
+def ensure_nltk_data():
+    import nltk
+    for resource, package in NLTK_DATA:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            nltk.download(package)
+
+@functools.lru_cache(maxsize=None)
+def get_lemmatizer():
+    from nltk.stem import WordNetLemmatizer
+    ensure_nltk_data()
+    return WordNetLemmatizer()
+
+# Lemmas are memoized per process: articles share most of their vocabulary, so
+# WordNet is only looked up once per distinct word
+@functools.lru_cache(maxsize=500000)
+def lemmatize_word(word):
+    lower = word.lower()
+    lemma = get_lemmatizer().lemmatize(lower)
+    return word if lemma == lower else lemma
+
+def preprocess_text(text):
+    from nltk.tokenize import word_tokenize
+    ensure_nltk_data()
+    return ' '.join(lemmatize_word(token) for token in word_tokenize(text))
+
+def preprocess_chunk(texts):
+    return [preprocess_text(text) for text in texts]
+
+# Lemmas of the words of `text`, English stop words left out: how the passages cut
+# from the raw articles, and the questions searched against them, are tokenized
+def lemma_tokens(text):
+    return [lemmatize_word(word) for word in re.findall(r"\b\w\w+\b", text.lower()) if word not in ENGLISH_STOP_WORDS]
+
+# Word-level tokenization and lemmatization of many texts. Large corpora are split in
+# chunks of `chunk_size` texts preprocessed on a process pool (one process per core by
+# default); the output is in input order and only depends on the texts. The workers
+# are spawned, not forked: the app process runs threads (model loading, background
+# index refreshes) whose locks a fork would copy in whatever state they are in.
+# `preprocess` is the module-level function run on each chunk.
+def preprocess_documents(texts, workers=None, chunk_size=PREPROCESS_CHUNK_SIZE, preprocess=preprocess_chunk):
+    texts = list(texts)
+    if preprocess is preprocess_chunk:
+        ensure_nltk_data()  # Once in this process, before the workers need it
+    chunks = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1:
+        return [text for chunk in chunks for text in preprocess(chunk)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return [text for chunk in pool.map(preprocess, chunks) for text in chunk]
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# 64-bit SimHash of the word 3-shingles of a text: near-duplicate texts have
+# fingerprints that differ in only a few bits
+def simhash(text):
+    words = re.findall(r"\w+", text.lower())
+    shingles = [' '.join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+                       for shingle in shingles], dtype='>u8')
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1)
+    weights = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return int(''.join('1' if weight > 0 else '0' for weight in weights), 2)
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+# Articles kept on disk between restarts, keyed by URL, with the content hash, the
+# raw and preprocessed text, the HTTP validators used for conditional requests and
+# a SimHash fingerprint for near-duplicate detection
+class ArticleStore:
+    def __init__(self, path=ARTICLE_STORE_PATH):
+        self.path = path
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._ready and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            if not self._ready:
+                self._create_schema(conn)
+                self._ready = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create_schema(self, conn):
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS articles (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    raw_text TEXT NOT NULL,
+                    preprocessed_text TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    simhash TEXT NOT NULL,
+                    duplicate_of TEXT,
+                    fetched_at REAL NOT NULL,
+                    checked_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def validators(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT url, content_hash, etag, last_modified FROM articles").fetchall()
+        return {row['url']: dict(row) for row in rows}
+
+    def fingerprints(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT url, simhash FROM articles WHERE duplicate_of IS NULL").fetchall()
+        return {row['url']: int(row['simhash'], 16) for row in rows}
+
+    def mark_checked(self, urls):
+        with self._connect() as conn:
+            conn.executemany("UPDATE articles SET checked_at = ? WHERE url = ?", [(time.time(), url) for url in urls])
+
+    def save(self, articles):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(article['url'], article['content_hash'], article['raw_text'], article['preprocessed_text'],
+                  article.get('etag'), article.get('last_modified'), format(article['simhash'], '016x'),
+                  article.get('duplicate_of'), now, now) for article in articles])
+
+    def preprocess_version(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'preprocess_version'").fetchone()
+        return None if row is None else int(row['value'])
+
+    # Preprocess every stored article again, e.g. after the preprocessing changed
+    def reprocess(self, preprocess, version):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT url, raw_text FROM articles ORDER BY url").fetchall()
+        preprocessed = preprocess([row['raw_text'] for row in rows]) if rows else []
+        with self._connect() as conn:
+            conn.executemany("UPDATE articles SET preprocessed_text = ? WHERE url = ?",
+                             [(text, row['url']) for row, text in zip(rows, preprocessed)])
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('preprocess_version', ?)", (str(version),))
+        return len(rows)
+
+    # Preprocessed texts of the stored articles, near-duplicates left out
+    def documents(self):
+        return [preprocessed for _, preprocessed in self.articles()]
+
+    # (raw text, preprocessed text) of the stored articles, near-duplicates left out
+    def articles(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT raw_text, preprocessed_text FROM articles WHERE duplicate_of IS NULL ORDER BY url").fetchall()
+        return [(row['raw_text'], row['preprocessed_text']) for row in rows]
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+# Bring the store up to date with the news pages. Articles already stored are
+# requested with If-None-Match / If-Modified-Since and skipped when the server answers
+# 304 or the text did not change; only new or changed articles go through
+# `preprocess` (a function of a list of texts). Articles within `max_distance` bits
+# of a stored fingerprint are kept as near-duplicates and left out of the corpus.
+# Stored articles preprocessed by another `preprocess_version` are preprocessed again.
+def refresh_corpus(store, preprocess, base_url=BASE_URL, pages=NEWS_PAGES, scraper=None, max_distance=3,
+                   preprocess_version=None):
+    scraper = scraper or ArticleScraper()
+    reprocessed = 0
+    if preprocess_version is not None and store.preprocess_version() != preprocess_version:
+        reprocessed = store.reprocess(preprocess, preprocess_version)
+    known = store.validators()
+    links = scrape_article_links(base_url, pages, scraper)
+
+    def fetch_if_changed(url):
+        headers = {}
+        if url in known:
+            if known[url]['etag']:
+                headers['If-None-Match'] = known[url]['etag']
+            if known[url]['last_modified']:
+                headers['If-Modified-Since'] = known[url]['last_modified']
+        response = scraper.fetch_response(url, headers)
+        if response is None:
+            return 'failed', None
+        if response.status_code == 304:
+            return 'unchanged', None
+        if response.status_code != 200:
+            return 'failed', None
+        text = parse_article(response.text)
+        if url in known and known[url]['content_hash'] == content_hash(text):
+            return 'unchanged', None
+        return 'changed' if url in known else 'new', {
+            'url': url,
+            'raw_text': text,
+            'content_hash': content_hash(text),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+
+    stats = {'new': 0, 'changed': 0, 'unchanged': 0, 'failed': 0, 'duplicates': 0, 'reprocessed': reprocessed}
+    updated, unchanged = [], []
+    for url, (status, article) in scraper.run(fetch_if_changed, links):
+        stats[status] += 1
+        if article is not None:
+            updated.append(article)
+        elif status == 'unchanged':
+            unchanged.append(url)
+    store.mark_checked(unchanged)
+    if not updated:
+        return stats
+
+    updated.sort(key=lambda article: article['url'])
+    for article, preprocessed in zip(updated, preprocess([article['raw_text'] for article in updated])):
+        article['preprocessed_text'] = preprocessed
+
+    fingerprints = store.fingerprints()
+    for article in updated:
+        article['simhash'] = simhash(article['raw_text'])
+        fingerprints.pop(article['url'], None)
+        duplicate_of = next((url for url, fingerprint in fingerprints.items()
+                             if hamming_distance(article['simhash'], fingerprint) <= max_distance), None)
+        if duplicate_of is None:
+            fingerprints[article['url']] = article['simhash']
+        else:
+            article['duplicate_of'] = duplicate_of
+            stats['duplicates'] += 1
+    store.save(updated)
+    return stats
+
+def corpus_fingerprint(documents):
+    digest = hashlib.sha256()
+    for document in documents:
+        digest.update(content_hash(document).encode('ascii'))
+    return digest.hexdigest()
+
+# Overlapping passages of `size` words, consecutive passages sharing `overlap` words
+def split_passages(text, size=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, size - overlap)
+    return [' '.join(words[start:start + size]) for start in range(0, max(len(words) - overlap, 1), step)]
+
+def count_words(text):
+    return len(text.split())
+
+# Longest prefix of `text` (in whole words) that fits in token_budget
+def truncate_to_budget(text, token_budget, count_tokens=count_words):
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(' '.join(words[:middle])) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+    return ' '.join(words[:low])
+
+# Okapi BM25 over a list of passages. The inverted index is a term-major (CSC) sparse
+# matrix holding the BM25 weight of every (passage, term) pair, so scoring a query is
+# one sparse product with its term counts. Passages and queries are split in terms by
+# `tokenizer` (a module-level function, the index is pickled), by default their words
+# without the English stop words.
+class BM25Index:
+    def __init__(self, passages, k1=1.5, b=0.75, tokenizer=None):
+        self.passages = list(passages)
+        self.word_counts = np.fromiter((count_words(passage) for passage in self.passages), dtype=np.int64,
+                                       count=len(self.passages))
+        if tokenizer is None:
+            self.vectorizer = CountVectorizer(stop_words='english')
+        else:
+            self.vectorizer = CountVectorizer(tokenizer=tokenizer, token_pattern=None, lowercase=False)
+        try:
+            counts = self.vectorizer.fit_transform(self.passages).tocsr().astype(np.float64)
+        except ValueError:  # Empty corpus or nothing but stop words
+            self.weights = None
+            return
+
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average_length = lengths.mean() if lengths.size and lengths.mean() > 0 else 1.0
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log1p((len(self.passages) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        tf = counts.data
+        norm = k1 * (1 - b + b * lengths[rows] / average_length)
+        counts.data = idf[counts.indices] * tf * (k1 + 1) / (tf + norm)
+        self.weights = counts.tocsc()
+
+    def __len__(self):
+        return len(self.passages)
+
+    # [(passage position, score)] of the k best passages with a positive score, best first
+    def search(self, query, k=5):
+        if self.weights is None:
+            return []
+        query_terms = self.vectorizer.transform([query])
+        scores = np.asarray((self.weights @ query_terms.T).todense()).ravel()
+        k = min(k, int(np.count_nonzero(scores > 0)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(position), float(scores[position])) for position in top]
+
+    # Best passages for `query` whose total size, separators included and measured with
+    # count_tokens, fits in token_budget, joined best first. Only the passages that may
+    # still fit are measured: a passage has at least as many tokens as words (true of
+    # word and subword tokenizers), so the selection stops once the remaining budget is
+    # smaller than every remaining candidate.
+    def build_context(self, query, token_budget, count_tokens=count_words, separator="\n\n"):
+        results = self.search(query, k=len(self.passages))
+        if not results:
+            return ''
+        positions = np.array([position for position, _ in results])
+        smallest_left = np.minimum.accumulate(self.word_counts[positions][::-1])[::-1]
+        separator_size = count_tokens(separator)
+        selected, used = [], 0
+        for i, position in enumerate(positions):
+            cost = separator_size if selected else 0
+            if token_budget - used - cost < smallest_left[i]:
+                break
+            size = count_tokens(self.passages[position])
+            if used + cost + size > token_budget:
+                continue
+            selected.append(self.passages[position])
+            used += cost + size
+        if not selected:
+            # Even the best passage is too long for the budget: keep its beginning
+            return truncate_to_budget(self.passages[positions[0]], token_budget, count_tokens)
+        return separator.join(selected)
+
+# Keep a user supplied context whole when it fits in the budget, otherwise keep only
+# its passages most relevant to the question
+def bound_context(question, context, token_budget, count_tokens=count_words):
+    if count_tokens(context) <= token_budget:
+        return context
+    passages = split_passages(context)
+    selected = BM25Index(passages).build_context(question, token_budget, count_tokens)
+    # Nothing matched the question: fall back to the start of the context
+    return selected or truncate_to_budget(context, token_budget, count_tokens)
+
+# TF-IDF index fitted once over the corpus: a query only transforms the question and
+# scores it against every document with one sparse dot product (the rows are
+# L2-normalised, so the scores are cosine similarities). The articles are also split
+# into passages indexed with BM25, used to build prompts of a bounded size.
+# `documents` are searched as given, so a query must be preprocessed like them. When
+# the `raw_documents` they were preprocessed from are given, the passages are cut from
+# the raw texts (the prompt reads the article, not its lemmas) and indexed by their
+# lemma_tokens, which lemmatize the query the same way.
+class RetrievalIndex:
+    def __init__(self, documents, vectorizer, matrix, fingerprint, passages, raw_documents):
+        self.documents = documents
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.fingerprint = fingerprint
+        self.passages = passages
+        self.raw_documents = raw_documents
+
+    @classmethod
+    def fit(cls, documents, raw_documents=None):
+        documents = list(documents)
+        vectorizer = TfidfVectorizer(stop_words='english')
+        try:
+            matrix = vectorizer.fit_transform(documents)
+        except ValueError:  # Empty corpus or nothing but stop words
+            matrix = None
+        if raw_documents is None:
+            raw_documents, tokenizer = documents, None
+        else:
+            raw_documents, tokenizer = list(raw_documents), lemma_tokens
+        passages = BM25Index([passage for document in raw_documents for passage in split_passages(document)],
+                             tokenizer=tokenizer)
+        return cls(documents, vectorizer, matrix, corpus_fingerprint(documents), passages, raw_documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+    # [(document position, score)] of the k best documents, best first
+    def search(self, query, k=1):
+        if self.matrix is None:
+            return []
+        scores = (self.matrix @ self.vectorizer.transform([query]).T).toarray().ravel()
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(position), float(scores[position])) for position in top]
+
+    # The passages of the corpus most relevant to `query`, within token_budget
+    def build_context(self, query, token_budget, count_tokens=count_words):
+        return self.passages.build_context(query, token_budget, count_tokens)
+
+    def save(self, path=RETRIEVAL_INDEX_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=RETRIEVAL_INDEX_PATH):
+        try:
+            with open(path, 'rb') as f:
+                index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        # Indexes saved before passages (and their word counts) or the raw documents
+        # were added are refitted
+        if (not isinstance(index, cls) or not hasattr(getattr(index, 'passages', None), 'word_counts')
+                or not hasattr(index, 'raw_documents')):
+            return None
+        return index
+
+# Holds the current retrieval index of a corpus. The last saved index is served
+# right away after a restart; a refresh (at most every max_age seconds, in the
+# background once an index exists) rebuilds the corpus with `load_documents` (which
+# returns the preprocessed documents and the raw documents, see RetrievalIndex), refits
+# only if the documents changed, saves the index and swaps it in with a single
+# assignment, so a search always runs against one complete index.
+class CorpusIndex:
+    def __init__(self, load_documents, path=RETRIEVAL_INDEX_PATH, max_age=3600):
+        self.load_documents = load_documents
+        self.path = path
+        self.max_age = max_age
+        self._index = RetrievalIndex.load(path)
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self):
+        documents, raw_documents = self.load_documents()
+        current = self._index
+        if current is None or current.fingerprint != corpus_fingerprint(documents):
+            index = RetrievalIndex.fit(documents, raw_documents)
+            index.save(self.path)
+            self._index = index
+        self._refreshed_at = time.monotonic()
+        return self._index
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                self._refreshed_at = time.monotonic()  # Keep serving the current index, retry later
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True, name="corpus-refresh").start()
+
+    # The index to search, refreshed if it is missing or out of date
+    def current(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    return self.refresh()
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.max_age:
+            self._refresh_in_background()
+        return self._index
@@ -1,3 +1,24 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Budget, MonthlyCategoryRollup, MonthlyRollup, Transaction
+
+
+@admin.register(Transaction)
+class TransactionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'category', 'description', 'amount')
+    list_filter = ('category',)
+
+
+@admin.register(Budget)
+class BudgetAdmin(admin.ModelAdmin):
+    list_display = ('user', 'category', 'amount')
+
+
+@admin.register(MonthlyRollup)
+class MonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('user', 'month', 'total', 'count')
+
+
+@admin.register(MonthlyCategoryRollup)
+class MonthlyCategoryRollupAdmin(admin.ModelAdmin):
+    list_display = ('user', 'month', 'category', 'total', 'count')
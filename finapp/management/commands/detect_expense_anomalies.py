@@ -0,0 +1,77 @@
+import datetime
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from expense_anomalies import DEFAULT_WINDOW, MIN_PERIODS, Z_THRESHOLD, nan_median, robust_zscores
+from finapp.models import MonthlyCategoryRollup, MonthlyRollup
+
+# Nightly anomaly alerts for every user: the category rollups of the month and of the
+# `window` months before it are loaded for a block of users at a time into one
+# (users, months, categories) array and scored with a single vectorized pass.
+#
+#   python manage.py detect_expense_anomalies --month 2024-06
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = "Flag the categories whose spending in a month is unusual for each user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="month to check (YYYY-MM), the latest month with rollups by default")
+        parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="months of history")
+        parser.add_argument('--threshold', type=float, default=Z_THRESHOLD, help="robust z-score threshold")
+        parser.add_argument('--block-size', type=int, default=10000, help="users scored per block")
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError("--month must be YYYY-MM")
+        else:
+            month = MonthlyRollup.objects.order_by('-month').values_list('month', flat=True).first()
+            if month is None:
+                self.stderr.write("No rollups yet, nothing to check.")
+                return
+        window = options['window']
+        months = [add_months(month, offset) for offset in range(-window, 1)]
+
+        user_ids = list(MonthlyRollup.objects.filter(month=month).values_list('user_id', flat=True).order_by('user_id'))
+        alerts = 0
+        for start in range(0, len(user_ids), options['block_size']):
+            block = user_ids[start:start + options['block_size']]
+            for user_id, category, amount, usual, z in self.score_block(block, months, options['threshold']):
+                self.stdout.write(f"{user_id}\t{month:%Y-%m}\t{category}\t{amount:.2f}\t{usual:.2f}\t{z:.1f}")
+                alerts += 1
+        self.stderr.write(f"{alerts} anomalies for {len(user_ids)} users in {month:%Y-%m}")
+
+    # (user id, category, amount, usual amount, z) of the anomalies of the last month
+    def score_block(self, user_ids, months, threshold):
+        rows = list(MonthlyCategoryRollup.objects.filter(user_id__in=user_ids, month__range=(months[0], months[-1]))
+                    .values_list('user_id', 'month', 'category', 'total'))
+        categories = sorted({row[2] for row in rows})
+        user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+        month_index = {month: i for i, month in enumerate(months)}
+        category_index = {category: i for i, category in enumerate(categories)}
+
+        # Months without any spending of a user are unknown (NaN), a category without
+        # spending in a known month is 0
+        series = np.full((len(user_ids), len(months), len(categories)), np.nan)
+        for user_id, month in MonthlyRollup.objects.filter(
+                user_id__in=user_ids, month__range=(months[0], months[-1])).values_list('user_id', 'month'):
+            series[user_index[user_id], month_index[month]] = 0.0
+        if rows:
+            users, month_positions, category_positions, totals = zip(*rows)
+            series[[user_index[user] for user in users], [month_index[month] for month in month_positions],
+                   [category_index[category] for category in category_positions]] = np.asarray(totals, dtype=np.float64)
+
+        history, latest = series[:, :-1], series[:, -1]
+        z = robust_zscores(history, latest, MIN_PERIODS)
+        usual = nan_median(history)
+        for i, j in zip(*np.nonzero(np.nan_to_num(z, nan=-np.inf) > threshold)):
+            yield user_ids[i], categories[j], latest[i, j], usual[i, j], z[i, j]
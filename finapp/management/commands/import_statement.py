@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from finapp.models import Transaction
+from personal_finance import CategoryMatcher, STATEMENT_BATCH_ROWS, statement_batches
+
+# Import a CSV or OFX bank statement into the expense ledger of a user. The statement
+# is read and categorized batch by batch, as on the personal finance page, and each
+# batch is inserted with one bulk_create that also updates the monthly rollups.
+#
+#   python manage.py import_statement alice@example.com statement.csv --rule netflix=subscriptions
+
+
+class Command(BaseCommand):
+    help = "Import the expenses of a bank statement (CSV, OFX or QFX) into a user's ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--kind', choices=['csv', 'ofx'], help="statement format, from the file name by default")
+        parser.add_argument('--rule', action='append', default=[], metavar='KEYWORD=CATEGORY',
+                            help="category of the expenses whose description has the keyword, can be repeated")
+        parser.add_argument('--all-amounts', action='store_true',
+                            help="every amount is an expense (by default only the negative ones are)")
+        parser.add_argument('--dayfirst', action='store_true', help="ambiguous dates are day first (31/01/2024)")
+        parser.add_argument('--batch-size', type=int, default=STATEMENT_BATCH_ROWS, help="rows inserted per batch")
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user {options['username']}")
+        rules = {}
+        for rule in options['rule']:
+            keyword, separator, category = rule.partition('=')
+            if not separator or not keyword.strip() or not category.strip():
+                raise CommandError(f"--rule must be KEYWORD=CATEGORY, got {rule!r}")
+            rules[keyword.strip()] = category.strip()
+
+        stats = {}
+        imported = 0
+        try:
+            with open(options['path'], 'rb') as file:
+                kind = options['kind'] or ('ofx' if options['path'].lower().endswith(('.ofx', '.qfx')) else 'csv')
+                for batch in statement_batches(file, CategoryMatcher(rules=rules), kind,
+                                               debits_negative=not options['all_amounts'],
+                                               batch_rows=options['batch_size'], dayfirst=options['dayfirst'],
+                                               stats=stats):
+                    Transaction.objects.bulk_create([
+                        Transaction(user=user, date=date.date(), category=category, description=description[:255],
+                                    amount=Decimal(f"{amount:.2f}"))
+                        for date, amount, description, category in zip(
+                            batch['date'], batch['amount'], batch['description'].fillna(""), batch['category'])
+                    ])
+                    imported += len(batch)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read the statement: {e}")
+        self.stderr.write(f"{imported} expenses imported for {user.username} from {stats.get('rows', 0)} rows, "
+                          f"{stats.get('dropped', 0)} rows skipped")
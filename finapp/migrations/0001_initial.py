@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:08
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=64)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='budgets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'category'), name='budget_user_category')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyCategoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('category', models.CharField(max_length=64)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'month', 'category'), name='category_rollup_user_month_cat')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'month'), name='monthly_rollup_user_month')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('month', models.DateField(editable=False)),
+                ('category', models.CharField(max_length=64)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'month', 'category'], name='transaction_user_month_cat'), models.Index(fields=['user', 'date'], name='transaction_user_date')],
+            },
+        ),
+    ]
@@ -1,3 +1,255 @@
-from django.db import models
+from collections import defaultdict
+from decimal import Decimal
 
-# Create your models here.
+from django.conf import settings
+from django.db import models, transaction
+
+# Expense ledger of the personal finance calculator. Raw transactions are kept per
+# user, and the per-month and per-(month, category) totals are kept up to date in
+# rollup tables as transactions are inserted, changed or deleted, so dashboards and
+# budget comparisons read a few precomputed rows instead of scanning the whole history.
+
+
+# Fields whose changes move a transaction between rollup rows or change their totals
+ROLLUP_FIELDS = {'user', 'user_id', 'date', 'month', 'category', 'amount'}
+UPDATE_CHUNK_SIZE = 500  # transactions moved through the rollups at a time by update()
+
+
+def first_of_month(day):
+    return day.replace(day=1)
+
+
+class TransactionQuerySet(models.QuerySet):
+    # Insert the transactions and add them to the rollups, in one database transaction.
+    # Conflicts cannot be ignored or turned into updates: the rollups would count the
+    # objects whether they were inserted or not.
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False, update_conflicts=False, **kwargs):
+        if ignore_conflicts or update_conflicts:
+            raise ValueError("Transactions cannot be bulk created with ignore_conflicts or update_conflicts")
+        objs = list(objs)
+        for obj in objs:
+            obj.month = first_of_month(obj.date)
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, batch_size=batch_size, **kwargs)
+            apply_to_rollups(objs, using=self.db)
+        return created
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            apply_to_rollups(self.only('user_id', 'month', 'category', 'amount'), using=self.db, sign=-1)
+            return super().delete()
+
+    # An update of a rollup field takes the transactions out of the rollups with their
+    # stored values and adds them back with the new ones, a chunk of rows at a time.
+    # The new date must be a value (the month is derived from it), not an expression.
+    def update(self, **kwargs):
+        if not ROLLUP_FIELDS & set(kwargs):
+            return super().update(**kwargs)
+        if self.query.is_sliced:
+            raise TypeError("Cannot update a query once a slice has been taken.")
+        if 'month' in kwargs:
+            raise ValueError("The month of a transaction follows its date, update the date instead")
+        if 'date' in kwargs:
+            if hasattr(kwargs['date'], 'resolve_expression'):
+                raise ValueError("Transaction dates can only be updated to a date, not an expression")
+            kwargs['date'] = self.model._meta.get_field('date').to_python(kwargs['date'])
+            kwargs['month'] = first_of_month(kwargs['date'])
+        manager = self.model.objects.db_manager(self.db)
+        updated = 0
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            for start in range(0, len(pks), UPDATE_CHUNK_SIZE):
+                chunk = manager.filter(pk__in=pks[start:start + UPDATE_CHUNK_SIZE])
+                apply_to_rollups(chunk.only('user_id', 'month', 'category', 'amount'), using=self.db, sign=-1)
+                updated += models.QuerySet.update(chunk, **kwargs)
+                apply_to_rollups(chunk.only('user_id', 'month', 'category', 'amount'), using=self.db)
+        return updated
+
+    # Same for changes saved in bulk: the stored rows are taken out of the rollups
+    # before the update and added back once it is written
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if not ROLLUP_FIELDS & set(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        if 'month' in fields:
+            raise ValueError("The month of a transaction follows its date, update the date instead")
+        fields = list(fields)
+        if 'date' in fields:
+            for obj in objs:
+                obj.month = first_of_month(obj.date)
+            fields.append('month')
+        manager = self.model.objects.db_manager(self.db)
+        chunks = [[obj.pk for obj in objs[start:start + UPDATE_CHUNK_SIZE]]
+                  for start in range(0, len(objs), UPDATE_CHUNK_SIZE)]
+        with transaction.atomic(using=self.db):
+            for pks in chunks:
+                apply_to_rollups(manager.filter(pk__in=pks).only('user_id', 'month', 'category', 'amount'),
+                                 using=self.db, sign=-1)
+            # Django writes bulk updates with update(), which must not move the rollups again
+            updated = models.QuerySet(self.model, using=self.db).bulk_update(objs, fields, *args, **kwargs)
+            for pks in chunks:
+                apply_to_rollups(manager.filter(pk__in=pks).only('user_id', 'month', 'category', 'amount'),
+                                 using=self.db)
+        return updated
+
+
+class Transaction(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='transactions')
+    date = models.DateField()
+    month = models.DateField(editable=False)  # First day of the month of `date`
+    category = models.CharField(max_length=64)
+    description = models.CharField(max_length=255, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'month', 'category'], name='transaction_user_month_cat'),
+            models.Index(fields=['user', 'date'], name='transaction_user_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.category} {self.amount}"
+
+    # A changed transaction is taken out of the rollups with its stored values and
+    # added back with the new ones
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using')
+        self.month = first_of_month(self.date)
+        with transaction.atomic(using=using):
+            if not self._state.adding:
+                apply_to_rollups(Transaction.objects.db_manager(using).filter(pk=self.pk), using=using, sign=-1)
+            super().save(*args, **kwargs)
+            apply_to_rollups([self], using=using)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            apply_to_rollups([self], using=kwargs.get('using'), sign=-1)
+            return super().delete(*args, **kwargs)
+
+
+class BudgetQuerySet(models.QuerySet):
+    # {category: amount} of a user, as used by the budget comparison
+    def as_dict(self, user):
+        return {category: float(amount) for category, amount in
+                self.filter(user=user).values_list('category', 'amount')}
+
+
+class Budget(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='budgets')
+    category = models.CharField(max_length=64)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+    objects = BudgetQuerySet.as_manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'category'], name='budget_user_category')]
+
+    def __str__(self):
+        return f"{self.category} {self.amount}"
+
+
+class MonthlyRollupQuerySet(models.QuerySet):
+    # {month: total} of a user, oldest month first
+    def totals(self, user):
+        return {month: float(total) for month, total in
+                self.filter(user=user).order_by('month').values_list('month', 'total')}
+
+
+class MonthlyRollup(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='monthly_rollups')
+    month = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    count = models.PositiveIntegerField(default=0)
+
+    objects = MonthlyRollupQuerySet.as_manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'month'], name='monthly_rollup_user_month')]
+
+
+class CategoryRollupQuerySet(models.QuerySet):
+    # {category: total} of a user for one month, as used by the personal finance page
+    def totals(self, user, month):
+        return {category: float(total) for category, total in
+                self.filter(user=user, month=first_of_month(month)).values_list('category', 'total')}
+
+
+class MonthlyCategoryRollup(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='category_rollups')
+    month = models.DateField()
+    category = models.CharField(max_length=64)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    count = models.PositiveIntegerField(default=0)
+
+    objects = CategoryRollupQuerySet.as_manager()
+
+    class Meta:
+        # The unique constraint is also the (user, month, category) index of the lookups
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'category'], name='category_rollup_user_month_cat'),
+        ]
+
+
+# Add (sign=1) or remove (sign=-1) transactions to both rollup tables: the deltas are
+# summed in memory, the rollup rows they touch are read once (locked until the end of
+# the transaction) and written back with one bulk_update, and the ones left without
+# transactions deleted. Missing rows are first inserted empty, ignoring the ones a
+# concurrent transaction inserted meanwhile, then locked like the others: a lock
+# cannot be taken on a row that does not exist yet.
+def apply_to_rollups(transactions, using=None, sign=1):
+    monthly = defaultdict(lambda: [Decimal('0'), 0])
+    by_category = defaultdict(lambda: [Decimal('0'), 0])
+    for obj in transactions:
+        amount = Decimal(str(obj.amount)) * sign
+        for delta in (monthly[obj.user_id, obj.month], by_category[obj.user_id, obj.month, obj.category]):
+            delta[0] += amount
+            delta[1] += sign
+    _merge_rollups(MonthlyRollup, ('user_id', 'month'), monthly, using)
+    _merge_rollups(MonthlyCategoryRollup, ('user_id', 'month', 'category'), by_category, using)
+
+
+# {key: row} of the rollup rows of `keys`, locked until the end of the transaction
+def _lock_rollups(manager, key_fields, keys):
+    rows = manager.select_for_update().filter(user_id__in={key[0] for key in keys}, month__in={key[1] for key in keys})
+    if 'category' in key_fields:
+        rows = rows.filter(category__in={key[2] for key in keys})
+    rows = {tuple(getattr(row, field) for field in key_fields): row for row in rows}
+    return {key: row for key, row in rows.items() if key in keys}
+
+
+def _merge_rollups(model, key_fields, deltas, using):
+    if not deltas:
+        return
+    manager = model.objects.db_manager(using)
+    rows = _lock_rollups(manager, key_fields, deltas)
+    missing = [key for key in deltas if key not in rows]
+    if missing:
+        manager.bulk_create([model(**dict(zip(key_fields, key))) for key in missing], batch_size=500,
+                            ignore_conflicts=True)
+        rows.update(_lock_rollups(manager, key_fields, set(missing)))
+
+    updated, emptied = [], []
+    for key, (total, count) in deltas.items():
+        row = rows[key]
+        if row.count + count == 0:
+            emptied.append(row.pk)  # Every transaction of the row was removed
+        else:
+            row.total += total
+            row.count += count
+            updated.append(row)
+    manager.filter(pk__in=emptied).delete()
+    manager.bulk_update(updated, ['total', 'count'], batch_size=500)
+
+
+# Recompute the rollups of a user from the raw transactions, e.g. after changes made
+# outside the model and queryset methods (raw SQL, migrations)
+def rebuild_rollups(user, using=None):
+    with transaction.atomic(using=using):
+        MonthlyRollup.objects.db_manager(using).filter(user=user).delete()
+        MonthlyCategoryRollup.objects.db_manager(using).filter(user=user).delete()
+        transactions = Transaction.objects.db_manager(using).filter(user=user).only(
+            'user_id', 'month', 'category', 'amount')
+        apply_to_rollups(transactions.iterator(chunk_size=2000), using=using)
@@ -1,3 +1,238 @@
+import os
+import datetime
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import models
+from django.db.models import Count, F, Sum
 from django.test import TestCase
 
-# Create your tests here.
+from expense_anomalies import detect_anomalies
+from finapp import models as finapp_models
+from finapp.models import Budget, MonthlyCategoryRollup, MonthlyRollup, Transaction, rebuild_rollups
+
+CATEGORIES = ['fixed', 'outing', 'shopping', 'groceries', 'other']
+
+
+def cents(amount):
+    return Decimal(amount).quantize(Decimal('0.01'))
+
+
+class RollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice@example.com', password='secret')
+        self.other = User.objects.create_user('bob@example.com', password='secret')
+
+    def make_transactions(self, count, user=None, start=datetime.date(2023, 1, 1)):
+        return [Transaction(user=user or self.user, date=start + datetime.timedelta(days=i % 730),
+                            category=CATEGORIES[i % len(CATEGORIES)], description=f"expense {i}",
+                            amount=Decimal(i % 1000) / 10 + Decimal('0.05'))
+                for i in range(count)]
+
+    # The rollups must hold exactly what aggregating the raw transactions gives (SQLite
+    # sums decimals as floats, hence the rounding to cents)
+    def assertRollupsMatch(self):
+        expected = {(row['user'], row['month']): (cents(row['total']), row['count']) for row in
+                    Transaction.objects.values('user', 'month').annotate(total=Sum('amount'), count=Count('id'))}
+        actual = {(row.user_id, row.month): (row.total, row.count) for row in MonthlyRollup.objects.all()}
+        self.assertEqual(actual, expected)
+
+        expected = {(row['user'], row['month'], row['category']): (cents(row['total']), row['count']) for row in
+                    Transaction.objects.values('user', 'month', 'category').annotate(total=Sum('amount'),
+                                                                                     count=Count('id'))}
+        actual = {(row.user_id, row.month, row.category): (row.total, row.count)
+                  for row in MonthlyCategoryRollup.objects.all()}
+        self.assertEqual(actual, expected)
+
+
+class TransactionRollupTests(RollupTestCase):
+    def test_bulk_inserts_match_sum_and_count(self):
+        objs = self.make_transactions(50000)
+        for start in range(0, len(objs), 5000):
+            Transaction.objects.bulk_create(objs[start:start + 5000], batch_size=1000)
+        Transaction.objects.bulk_create(self.make_transactions(500, user=self.other))
+        self.assertEqual(Transaction.objects.count(), 50500)
+        self.assertEqual(MonthlyRollup.objects.filter(user=self.user).count(), 24)
+        self.assertRollupsMatch()
+
+    def test_save_and_delete(self):
+        expense = Transaction.objects.create(user=self.user, date=datetime.date(2024, 1, 31), category='fixed',
+                                             amount=Decimal('700.00'))
+        Transaction.objects.create(user=self.user, date=datetime.date(2024, 1, 5), category='outing',
+                                   amount=Decimal('20.00'))
+        expense.date = datetime.date(2024, 2, 1)
+        expense.amount = Decimal('750.00')
+        expense.save()
+        self.assertRollupsMatch()
+        self.assertEqual(MonthlyCategoryRollup.objects.totals(self.user, datetime.date(2024, 2, 14)),
+                         {'fixed': 750.0})
+
+        expense.delete()
+        self.assertRollupsMatch()
+        self.assertFalse(MonthlyRollup.objects.filter(month=datetime.date(2024, 2, 1)).exists())
+
+    def test_queryset_update_moves_the_rollups(self):
+        Transaction.objects.bulk_create(self.make_transactions(2000))
+        Transaction.objects.filter(category='outing').update(amount=Decimal('1.00'))
+        self.assertRollupsMatch()
+        Transaction.objects.filter(category='shopping', amount__gt=50).update(category='groceries')
+        self.assertRollupsMatch()
+        Transaction.objects.filter(date__lt=datetime.date(2023, 3, 1)).update(date=datetime.date(2025, 6, 15))
+        self.assertRollupsMatch()
+        Transaction.objects.filter(description__endswith='7').update(user=self.other, description="moved")
+        self.assertRollupsMatch()
+        # Fields outside the rollups are updated directly
+        self.assertEqual(Transaction.objects.update(description="same"), 2000)
+        self.assertRollupsMatch()
+
+    def test_update_rejects_what_the_rollups_cannot_follow(self):
+        Transaction.objects.bulk_create(self.make_transactions(10))
+        with self.assertRaises(ValueError):
+            Transaction.objects.update(date=F('created_at'))
+        with self.assertRaises(ValueError):
+            Transaction.objects.update(month=datetime.date(2024, 1, 1))
+        with self.assertRaises(TypeError):
+            Transaction.objects.all()[:2].update(amount=Decimal('1.00'))
+
+    def test_bulk_update_and_queryset_delete(self):
+        Transaction.objects.bulk_create(self.make_transactions(1500))
+        objs = list(Transaction.objects.filter(category='fixed'))
+        for obj in objs:
+            obj.amount += 1
+            obj.date = obj.date.replace(day=1)
+            obj.category = 'rent'
+        Transaction.objects.bulk_update(objs, ['amount', 'date', 'category'])
+        self.assertRollupsMatch()
+
+        Transaction.objects.filter(category='rent', amount__lt=30).delete()
+        self.assertRollupsMatch()
+
+    # Another transaction inserts the first expense of the same month (and category)
+    # right after the rollups were read: the rows it created are merged into, not
+    # inserted a second time
+    def test_concurrent_first_insert_of_a_month(self):
+        lock_rollups = finapp_models._lock_rollups
+        concurrent = []
+
+        def lock_then_insert(manager, key_fields, keys):
+            rows = lock_rollups(manager, key_fields, keys)
+            if not concurrent:
+                concurrent.append(Transaction(user=self.user, date=datetime.date(2024, 3, 2),
+                                              month=datetime.date(2024, 3, 1), category='fixed', amount=Decimal('40.00')))
+                models.QuerySet(Transaction).bulk_create(concurrent)
+                MonthlyRollup.objects.create(user=self.user, month=datetime.date(2024, 3, 1), total=40, count=1)
+                MonthlyCategoryRollup.objects.create(user=self.user, month=datetime.date(2024, 3, 1), category='fixed',
+                                                     total=40, count=1)
+            return rows
+
+        with mock.patch('finapp.models._lock_rollups', side_effect=lock_then_insert):
+            Transaction.objects.create(user=self.user, date=datetime.date(2024, 3, 9), category='fixed',
+                                       amount=Decimal('700.00'))
+        self.assertEqual(MonthlyRollup.objects.get(user=self.user).count, 2)
+        self.assertRollupsMatch()
+
+    def test_conflicting_bulk_inserts_are_rejected(self):
+        for option in ('ignore_conflicts', 'update_conflicts'):
+            with self.assertRaises(ValueError):
+                Transaction.objects.bulk_create(self.make_transactions(3), **{option: True})
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(MonthlyRollup.objects.exists())
+
+    def test_rebuild_matches_incremental_rollups(self):
+        Transaction.objects.bulk_create(self.make_transactions(3000))
+        before = sorted(MonthlyCategoryRollup.objects.values_list('user', 'month', 'category', 'total', 'count'))
+        rebuild_rollups(self.user)
+        after = sorted(MonthlyCategoryRollup.objects.values_list('user', 'month', 'category', 'total', 'count'))
+        self.assertEqual(before, after)
+
+
+class ImportStatementCommandTests(RollupTestCase):
+    def test_statement_is_imported_into_the_ledger(self):
+        rows = ["Date,Amount,Description"] + [
+            f"2024-{month:02d}-{day:02d},-{day}.50,{description}" for month in (1, 2)
+            for day, description in ((3, "RENT MARCH"), (9, "Food market"), (15, "Netflix"))
+        ] + ["2024-02-20,1500.00,Salary", "someday,-1.00,Rent"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'statement.csv')
+            with open(path, 'w') as f:
+                f.write("\n".join(rows) + "\n")
+            errors = StringIO()
+            call_command('import_statement', self.user.username, path, '--rule', 'netflix=subscriptions',
+                         '--batch-size', '2', stderr=errors)
+
+        self.assertIn("6 expenses imported", errors.getvalue())
+        self.assertIn("1 rows skipped", errors.getvalue())
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 6)
+        self.assertEqual(MonthlyCategoryRollup.objects.totals(self.user, datetime.date(2024, 2, 1)),
+                         {'fixed': 3.5, 'groceries': 9.5, 'subscriptions': 15.5})
+        self.assertRollupsMatch()
+
+
+class DetectExpenseAnomaliesCommandTests(RollupTestCase):
+    # Monthly outing spending of alice (6 months of history) and bob (2 months), both
+    # with a spike in July 2024, and the same rent every month
+    OUTINGS = {'alice': [100, 110, 90, 105, 95, 100, 900], 'bob': [None, None, None, None, 100, 100, 900]}
+
+    def setUp(self):
+        super().setUp()
+        users = {'alice': self.user, 'bob': self.other}
+        Transaction.objects.bulk_create([
+            Transaction(user=users[name], date=datetime.date(2024, month, 10), category=category,
+                        amount=Decimal(amount))
+            for name, outings in self.OUTINGS.items() for month, outing in enumerate(outings, 1) if outing is not None
+            for category, amount in (('fixed', 700), ('outing', outing))])
+
+    def test_spike_is_flagged_like_detect_anomalies(self):
+        output, errors = StringIO(), StringIO()
+        call_command('detect_expense_anomalies', '--month', '2024-07', stdout=output, stderr=errors)
+        self.assertEqual(output.getvalue().splitlines(), [f"{self.user.id}\t2024-07\touting\t900.00\t100.00\t80.0"])
+        self.assertIn("1 anomalies for 2 users in 2024-07", errors.getvalue())
+
+        series = np.array([[[700, np.nan if outing is None else outing] for outing in outings]
+                           for outings in self.OUTINGS.values()], dtype=np.float64)
+        series[np.isnan(series[..., 1])] = np.nan  # No statement yet that month
+        flags = detect_anomalies(series)
+        self.assertEqual([(int(user), int(category)) for user, category in zip(*np.nonzero(flags[:, -1]))], [(0, 1)])
+
+    def test_latest_month_by_default(self):
+        output = StringIO()
+        call_command('detect_expense_anomalies', stdout=output, stderr=StringIO())
+        self.assertEqual(len(output.getvalue().splitlines()), 1)
+
+    def test_user_without_enough_history_is_not_flagged(self):
+        output = StringIO()
+        call_command('detect_expense_anomalies', '--month', '2024-07', stdout=output, stderr=StringIO())
+        self.assertNotIn(f"{self.other.id}\t", output.getvalue())
+
+
+class ExpenseSummaryViewTests(RollupTestCase):
+    def test_summary_reads_the_rollups_and_budgets(self):
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, date=datetime.date(2024, 1, 3), category='fixed', amount=Decimal('700')),
+            Transaction(user=self.user, date=datetime.date(2024, 2, 3), category='fixed', amount=Decimal('700')),
+            Transaction(user=self.user, date=datetime.date(2024, 2, 9), category='outing', amount=Decimal('120.5')),
+            Transaction(user=self.other, date=datetime.date(2024, 3, 1), category='fixed', amount=Decimal('9')),
+        ])
+        Budget.objects.create(user=self.user, category='outing', amount=Decimal('100'))
+        Budget.objects.create(user=self.user, category='fixed', amount=Decimal('800'))
+        self.client.force_login(self.user)
+
+        summary = self.client.get('/expenses/summary/').json()
+        self.assertEqual(summary['months'], {'2024-01': 700.0, '2024-02': 820.5})
+        self.assertEqual(summary['month'], '2024-02')
+        self.assertEqual(summary['categories'], {'fixed': 700.0, 'outing': 120.5})
+        self.assertEqual(summary['budget']['outing'], {'spent': 120.5, 'budget': 100.0, 'over': True})
+        self.assertFalse(summary['budget']['fixed']['over'])
+
+        self.assertEqual(self.client.get('/expenses/summary/?month=2024-01').json()['categories'], {'fixed': 700.0})
+        self.assertEqual(self.client.get('/expenses/summary/?month=January').status_code, 400)
+
+    def test_summary_needs_a_signed_in_user(self):
+        response = self.client.get('/expenses/summary/')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith('/finauth/login/'))
@@ -3,5 +3,6 @@ from finapp import views
 from django.contrib import admin
 
 urlpatterns = [
-  path('',views.index,name='index')
+  path('',views.index,name='index'),
+  path('expenses/summary/',views.expense_summary,name='expense_summary'),
 ]
\ No newline at end of file
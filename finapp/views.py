@@ -1,4 +1,36 @@
+import datetime
+
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.shortcuts import render
 
+from finapp.models import Budget, MonthlyCategoryRollup, MonthlyRollup
+
 def index(request):
     return render(request, 'index.html')  # Replace 'index.html' with the correct template name if different
+
+# Expenses of the signed in user read from the ledger rollups: the total of every
+# month, the categories of one month (?month=YYYY-MM, the latest by default) and how
+# they compare with the user's budgets
+@login_required(login_url='/finauth/login/')
+def expense_summary(request):
+    monthly = MonthlyRollup.objects.totals(request.user)
+    if request.GET.get('month'):
+        try:
+            month = datetime.datetime.strptime(request.GET['month'], '%Y-%m').date()
+        except ValueError:
+            return JsonResponse({'error': "month must be YYYY-MM"}, status=400)
+    else:
+        month = max(monthly, default=None)
+    categories = MonthlyCategoryRollup.objects.totals(request.user, month) if month else {}
+    budgets = Budget.objects.as_dict(request.user)
+    return JsonResponse({
+        'months': {f"{key:%Y-%m}": total for key, total in monthly.items()},
+        'month': f"{month:%Y-%m}" if month else None,
+        'categories': categories,
+        'budget': {
+            category: {'spent': categories.get(category, 0.0), 'budget': budget,
+                       'over': categories.get(category, 0.0) > budget}
+            for category, budget in budgets.items()
+        },
+    })
@@ -1,7 +1,49 @@
 import streamlit as st
 import re
-import matplotlib.pyplot as plt
+import io
+import csv
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
+import pandas as pd
+
+from expense_anomalies import MIN_PERIODS, AnomalyDetector
+
+# Expense categories in display order and the keywords that put an expense in them.
+# An expense goes to the category of the first keyword found in its description,
+# "other" when there is none. Keywords match whole words, a keyword ending with "*"
+# also matches the words starting with it ("rent*" matches "rental" but not "current").
+DEFAULT_TAXONOMY = {
+    "fixed": ["rent*", "utility", "utilities"],
+    "outing": ["outing*", "dining"],
+    "shopping": ["shopping", "clothing"],
+    "groceries": ["groceries", "food*"],
+}
+OTHER_CATEGORY = "other"
+# "amount description" expense line, matched over the whole input at once
+EXPENSE_LINE = re.compile(r"^[ \t]*(\d+(?:\.\d+)?)[ \t]*(\S.*?)[ \t\r]*$", re.MULTILINE)
+
+# Statement import: rows parsed per batch, so memory is bounded by the batch size and
+# the (month, category) totals whatever the size of the file. On the page, Streamlit
+# keeps the whole upload in memory first, so uploads are limited by server.maxUploadSize
+# (.streamlit/config.toml) and larger statements go through `manage.py import_statement`.
+STATEMENT_BATCH_ROWS = 50000
+OFX_READ_SIZE = 1 << 20  # bytes read at a time from an OFX file
+# Date formats of CSV exports, tried on the first batch of a statement; the one that
+# parses the most dates is used for the whole file. "ISO8601" covers YYYY-MM-DD with
+# or without a time.
+STATEMENT_DATE_FORMATS = ['ISO8601', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d', '%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y',
+                          '%d.%m.%Y', '%m/%d/%y', '%d/%m/%y', '%d.%m.%y', '%d %b %Y', '%d-%b-%Y', '%b %d, %Y']
+# Column names used by bank CSV exports, lowercased
+STATEMENT_COLUMNS = {
+    'date': ['date', 'transaction date', 'posted date', 'posting date', 'booking date', 'value date'],
+    'amount': ['amount', 'transaction amount', 'value'],
+    'description': ['description', 'memo', 'payee', 'name', 'details', 'narrative', 'label'],
+}
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.DOTALL | re.IGNORECASE)
+OFX_FIELD = re.compile(r"<(DTPOSTED|TRNAMT|NAME|MEMO)>([^<\r\n]*)", re.IGNORECASE)
+CHART_CACHE_SIZE = 64  # rendered charts kept in memory
 
 def main():
     st.title("Personal Finance Calculator")
@@ -13,14 +55,50 @@ def main():
     # Input for expenses
     st.subheader("Input your expenses")
     expense_input = st.text_area("Enter your expenses (format: amount category, e.g., '50 groceries'):").strip()
+    statement = st.file_uploader("Or import a bank statement export", type=['csv', 'ofx', 'qfx'],
+                                 help=f"Up to {st.get_option('server.maxUploadSize')} MB. Import larger statements into "
+                                      f"your ledger with `python manage.py import_statement <username> <file>`.")
+    debits_negative = st.checkbox("Expenses are negative amounts in the statement", value=True)
+    dayfirst = st.checkbox("Dates are written day first (31/01/2024) when the statement does not tell", value=False)
     
     # Budget input
     st.subheader("Set Your Monthly Budget")
     budget_input = st.text_area("Enter your budget for each category (format: category amount, e.g., 'groceries 300'):").strip()
     budget_dict = set_budget(budget_input)
 
+    # Keywords of the user, on top of the default categories
+    with st.expander("Your own categories"):
+        rules_input = st.text_area("Enter keywords and their category (format: keyword category, e.g., 'netflix subscriptions'; "
+                                   "end a keyword with * to also match the words starting with it):").strip()
+    rules = parse_category_rules(rules_input)
+    matcher = CategoryMatcher(rules=rules)
+
     # Process expenses to categorize
-    categorized_expenses = categorize_expenses(expense_input)
+    categorized_expenses = categorize_expenses(expense_input, matcher)
+    history = None
+
+    # Expenses of the imported statement, one month at a time
+    if statement is not None:
+        try:
+            monthly, import_stats = load_statement(statement.file_id, tuple(sorted(rules.items())), debits_negative,
+                                                   dayfirst, statement)
+        except (ValueError, pd.errors.ParserError) as e:
+            st.error(f"Could not read the statement: {e}")
+            monthly = None
+        if monthly is not None and import_stats['dropped']:
+            st.warning(f"{import_stats['dropped']} of {import_stats['rows']} rows were skipped: "
+                       f"their date or amount could not be read.")
+        if monthly is not None and import_stats.get('date_format'):
+            st.caption(f"Dates read as {import_stats['date_format']}.")
+        if monthly is not None and monthly.empty:
+            st.write("No expenses found in the statement.")
+        elif monthly is not None:
+            st.write("### Expenses by Month:")
+            st.dataframe(monthly.style.format("${:.2f}"))
+            month = st.selectbox("Month to analyse", monthly.index[::-1])
+            history = month_history(monthly, month)
+            for category, amount in monthly.loc[month].items():
+                categorized_expenses[category] = categorized_expenses.get(category, 0.0) + amount
 
     # Calculate total expenses and savings
     total_expenses = sum(categorized_expenses.values())
@@ -43,7 +121,7 @@ def main():
     plot_expense_pie_chart(categorized_expenses)
 
     # Anomaly Detection
-    detect_anomalies(categorized_expenses)
+    detect_anomalies(categorized_expenses, history)
 
     # Call the function to generate insights and recommendations
     generate_recommendations(income, categorized_expenses, savings)
@@ -79,76 +157,325 @@ def compare_budget(categorized_expenses, budget_dict):
         else:
             st.write(f"- ✅ On track in **{category.capitalize()}**: ${amount:.2f} within budget of ${budget_amount:.2f}")
 
-def categorize_expenses(expense_input):
-    # Initialize a dictionary for categorized expenses
-    categories = {
-        "fixed": 0.0,
-        "outing": 0.0,
-        "shopping": 0.0,
-        "groceries": 0.0,
-        "other": 0.0
-    }
-
-    # Process the input text
-    expenses = expense_input.splitlines()
-    
-    for expense in expenses:
-        match = re.match(r"(\d+(\.\d+)?)\s*(\w+)", expense.strip())
+def parse_category_rules(rules_input):
+    rules = {}
+    for rule in rules_input.splitlines():
+        match = re.match(r"(.+?)\s+(\w+)$", rule.strip())
         if match:
-            amount = float(match.group(1))
-            category = match.group(3).lower()
-            # Categorize based on keywords
-            if "rent" in category or "utility" in category:
-                categories["fixed"] += amount
-            elif "outing" in category or "dining" in category:
-                categories["outing"] += amount
-            elif "shopping" in category or "clothing" in category:
-                categories["shopping"] += amount
-            elif "groceries" in category or "food" in category:
-                categories["groceries"] += amount
-            else:
-                categories["other"] += amount
-
-    return categories
+            rules[match.group(1).lower()] = match.group(2).lower()
+    return rules
+
+# Keywords ({keyword: category}) compiled into one case-insensitive alternation of
+# whole words, longest first, and the category of each keyword as it is captured
+# (lowercased, without its "*"). None when there are no keywords.
+def compile_keywords(keywords):
+    stems = {keyword.rstrip("*"): category for keyword, category in keywords.items() if keyword.rstrip("*")}
+    if not stems:
+        return None
+    ordered = sorted((keyword for keyword in keywords if keyword.rstrip("*")), key=lambda keyword: len(keyword.rstrip("*")),
+                     reverse=True)
+    alternatives = [re.escape(keyword.rstrip("*")) + ("" if keyword.endswith("*") else r"(?!\w)") for keyword in ordered]
+    return re.compile(r"(?<!\w)(" + "|".join(alternatives) + ")", re.IGNORECASE), stems
+
+# The user rules ({keyword: category}) and the taxonomy compiled into two patterns:
+# the rules are matched first and the taxonomy only categorizes the descriptions no
+# rule matched, so a rule wins wherever its keyword is in the description. A whole
+# column of descriptions is categorized by vectorized regex passes.
+class CategoryMatcher:
+    def __init__(self, taxonomy=DEFAULT_TAXONOMY, rules=None):
+        rules = {keyword.lower(): category.lower() for keyword, category in (rules or {}).items()}
+        keywords = {keyword.lower(): category for category, keywords in taxonomy.items() for keyword in keywords}
+        self.categories = list(dict.fromkeys([*taxonomy, *rules.values(), OTHER_CATEGORY]))
+        self.matchers = [matcher for matcher in (compile_keywords(rules), compile_keywords(keywords)) if matcher]
+
+    # Category of every description of a string Series. Statements repeat the same
+    # descriptions, so only the distinct ones are matched against the keywords.
+    def categorize(self, descriptions):
+        codes, distinct = pd.factorize(descriptions.fillna(""))
+        distinct = pd.Series(distinct, dtype=object)
+        categories = pd.Series(np.nan, index=distinct.index, dtype=object)
+        for pattern, stems in self.matchers:
+            unmatched = categories.isna()
+            if not unmatched.any():
+                break
+            keywords = distinct[unmatched].str.extract(pattern, expand=False).str.lower()
+            categories[unmatched] = keywords.map(stems)
+        categories = categories.fillna(OTHER_CATEGORY).to_numpy()
+        return pd.Series(categories[codes] if len(codes) else [], index=descriptions.index, dtype=object)
+
+# Amount, description and category of every "amount description" line of a text,
+# lines without an amount left out
+def parse_expenses(expense_input, matcher=None):
+    matcher = matcher or CategoryMatcher()
+    expenses = pd.DataFrame(EXPENSE_LINE.findall(expense_input), columns=['amount', 'description'])
+    expenses['amount'] = expenses['amount'].astype(float)
+    expenses['category'] = matcher.categorize(expenses['description'])
+    return expenses
+
+# Total per category, every category of the matcher included
+def total_by_category(expenses, matcher=None):
+    matcher = matcher or CategoryMatcher()
+    totals = expenses.groupby('category')['amount'].sum()
+    return {category: float(totals.get(category, 0.0)) for category in matcher.categories}
+
+def categorize_expenses(expense_input, matcher=None):
+    matcher = matcher or CategoryMatcher()
+    return total_by_category(parse_expenses(expense_input, matcher), matcher)
+
+# The statement column of each field, from the header of a CSV export
+def find_statement_columns(header):
+    lowered = {column.strip().lower(): column for column in header}
+    columns = {}
+    for field, names in STATEMENT_COLUMNS.items():
+        column = next((lowered[name] for name in names if name in lowered), None)
+        if column is None:
+            raise ValueError(f"No {field} column in the statement, expected one of: {', '.join(names)}")
+        columns[field] = column
+    return columns
+
+def to_amounts(values):
+    if not pd.api.types.is_numeric_dtype(values):  # "1,234.56", "$12.00", "12,50", "(12.00)"...
+        values = values.astype(str).str.strip()
+        parenthesized = values.str.match(r"^\(.*\)$")  # Accounting notation of a negative amount
+        decimal_comma = values.str.contains(r",\d{1,2}\)?$")
+        values = values.where(~decimal_comma, values.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+        values = values.str.replace(r"[^\d.\-]", "", regex=True)
+        values = values.where(~parenthesized, "-" + values)
+    return pd.to_numeric(values, errors='coerce')
+
+# Date format of a column of date strings: the format of STATEMENT_DATE_FORMATS that
+# parses the most of them. When both orders fit (no day above 12), `dayfirst` decides
+# between day/month and month/day.
+def detect_date_format(values, dayfirst=False):
+    sample = values.dropna().astype(str).str.strip()
+    sample = sample[sample != ""].drop_duplicates().head(1000)
+    if sample.empty:
+        return STATEMENT_DATE_FORMATS[0]
+    parsed = {fmt: int(pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+              for fmt in STATEMENT_DATE_FORMATS}
+    best = max(parsed.values())
+    if best == 0:
+        raise ValueError(f"Unrecognized date format, e.g. '{sample.iloc[0]}'")
+    candidates = [fmt for fmt in STATEMENT_DATE_FORMATS if parsed[fmt] == best]
+    return next((fmt for fmt in candidates if is_dayfirst(fmt) == dayfirst), candidates[0])
+
+def is_dayfirst(fmt):
+    return '%d' in fmt and '%m' in fmt and fmt.index('%d') < fmt.index('%m')
+
+# Batches of (date, amount, description) rows of a CSV statement. The date format is
+# detected once, on the first batch, and used for every batch; it is stored in
+# stats['date_format'] when a stats dict is given.
+def read_csv_statement(file, batch_rows=STATEMENT_BATCH_ROWS, dayfirst=False, stats=None):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+        except csv.Error:
+            delimiter = ','
+        header = next(csv.reader([sample.splitlines()[0] if sample else ""], delimiter=delimiter))
+        columns = find_statement_columns(header)
+        reader = pd.read_csv(text, delimiter=delimiter, usecols=list(columns.values()),
+                             dtype={columns['date']: str, columns['description']: str}, chunksize=batch_rows)
+        date_format = None
+        for chunk in reader:
+            if date_format is None:
+                date_format = detect_date_format(chunk[columns['date']], dayfirst)
+                if stats is not None:
+                    stats['date_format'] = date_format
+            yield pd.DataFrame({
+                'date': pd.to_datetime(chunk[columns['date']], format=date_format, errors='coerce'),
+                'amount': to_amounts(chunk[columns['amount']]),
+                'description': chunk[columns['description']],
+            })
+    finally:
+        text.detach()  # Leave the caller's file open
+
+# Batches of (date, amount, description) rows of an OFX/QFX statement, read block by
+# block: only the transactions of the current block are kept in memory
+def read_ofx_statement(file, batch_rows=STATEMENT_BATCH_ROWS, dayfirst=False, stats=None):
+    text = io.TextIOWrapper(file, encoding='utf-8', errors='replace')
+    try:
+        rows, buffer = [], ""
+        while True:
+            block = text.read(OFX_READ_SIZE)
+            buffer += block
+            end = 0
+            for match in OFX_TRANSACTION.finditer(buffer):
+                fields = {name.upper(): value.strip() for name, value in OFX_FIELD.findall(match.group(1))}
+                description = " ".join(filter(None, (fields.get('NAME'), fields.get('MEMO'))))
+                rows.append((fields.get('DTPOSTED', '')[:8], fields.get('TRNAMT'), description))
+                end = match.end()
+            buffer = buffer[end:]
+            if len(rows) >= batch_rows or (not block and rows):
+                batch = pd.DataFrame(rows, columns=['date', 'amount', 'description'])
+                batch['date'] = pd.to_datetime(batch['date'], format='%Y%m%d', errors='coerce')
+                batch['amount'] = to_amounts(batch['amount'])
+                yield batch
+                rows = []
+            if not block:
+                return
+    finally:
+        text.detach()  # Leave the caller's file open
+
+# Batches of the expenses of a CSV or OFX statement as (date, amount, description,
+# category) rows. With `debits_negative` only the negative amounts are expenses (made
+# positive), as in most bank exports, otherwise every amount is. `stats` is filled
+# with the number of rows read, the rows dropped because their date or amount could
+# not be read, and the date format of a CSV statement.
+def statement_batches(file, matcher=None, kind=None, debits_negative=True, batch_rows=STATEMENT_BATCH_ROWS,
+                      dayfirst=False, stats=None):
+    stats = {} if stats is None else stats
+    stats.update(rows=0, dropped=0)
+    matcher = matcher or CategoryMatcher()
+    kind = kind or ('ofx' if getattr(file, 'name', '').lower().endswith(('.ofx', '.qfx')) else 'csv')
+    read_statement = read_ofx_statement if kind == 'ofx' else read_csv_statement
+    for batch in read_statement(file, batch_rows, dayfirst, stats):
+        rows = len(batch)
+        batch = batch.dropna(subset=['date', 'amount'])
+        stats['rows'] += rows
+        stats['dropped'] += rows - len(batch)
+        if debits_negative:
+            batch = batch[batch['amount'] < 0].assign(amount=lambda rows: -rows['amount'])
+        if batch.empty:
+            continue
+        yield batch.assign(category=matcher.categorize(batch['description']))
+
+# Expenses per month (rows, "YYYY-MM") and category (columns) of a CSV or OFX statement,
+# aggregated batch by batch, see statement_batches
+def import_statement(file, matcher=None, kind=None, debits_negative=True, batch_rows=STATEMENT_BATCH_ROWS,
+                     dayfirst=False, stats=None):
+    matcher = matcher or CategoryMatcher()
+    totals = None
+    for batch in statement_batches(file, matcher, kind, debits_negative, batch_rows, dayfirst, stats):
+        months = batch['date'].dt.year * 100 + batch['date'].dt.month  # Formatted once, at the end
+        partial = batch['amount'].groupby([months, batch['category']]).sum()
+        totals = partial if totals is None else totals.add(partial, fill_value=0.0)
+    if totals is None:
+        return pd.DataFrame(columns=matcher.categories, dtype=float)
+    monthly = totals.unstack(fill_value=0.0).reindex(columns=matcher.categories, fill_value=0.0).sort_index()
+    monthly.index = pd.Index([f"{month // 100}-{month % 100:02d}" for month in monthly.index], name='month')
+    return monthly
+
+# Statements are imported again only when the file, the rules or the sign and date
+# conventions change. Returns the monthly expenses and the import stats.
+@st.cache_data(max_entries=4, show_spinner="Importing the statement...")
+def load_statement(file_id, rules, debits_negative, dayfirst, _file):
+    _file.seek(0)
+    stats = {}
+    monthly = import_statement(_file, CategoryMatcher(rules=dict(rules)), debits_negative=debits_negative,
+                               dayfirst=dayfirst, stats=stats)
+    return monthly, stats
+
+# Rendered charts (PNG or SVG bytes) keyed by a hash of the chart kind and its data,
+# the least recently used ones dropped beyond `max_entries`. Shared by every session,
+# so a chart is only drawn again when its numbers change.
+class ChartCache:
+    def __init__(self, max_entries=CHART_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'renders': 0}
+        self._charts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, data, fmt):
+        items = tuple((str(label), round(float(value), 2)) for label, value in data.items())
+        return hashlib.sha256(repr((kind, fmt, items)).encode('utf-8')).hexdigest()
+
+    def get_or_render(self, kind, data, fmt, render):
+        key = self.key(kind, data, fmt)
+        with self._lock:
+            if key in self._charts:
+                self._charts.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._charts[key]
+        chart = render()
+        with self._lock:
+            self._charts[key] = chart
+            self._charts.move_to_end(key)
+            while len(self._charts) > self.max_entries:
+                self._charts.popitem(last=False)
+            self.stats['renders'] += 1
+        return chart
+
+@st.cache_resource
+def get_chart_cache():
+    return ChartCache()
+
+# Draw a chart with `draw(ax)` and return its bytes. matplotlib is only imported on
+# the first render, and the Figure is created outside pyplot so no global figure
+# manager keeps a reference to it; it is cleared as soon as its bytes are written.
+def render_figure(draw, fmt='png'):
+    from matplotlib.figure import Figure
+    fig = Figure()
+    try:
+        draw(fig.subplots())
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, bbox_inches='tight')
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+def bar_chart(categorized_expenses, fmt='png', cache=None):
+    def draw(ax):
+        # Plotting the categorized expenses as a bar chart
+        categories = list(categorized_expenses.keys())
+        amounts = list(categorized_expenses.values())
+        ax.bar(categories, amounts, color=['blue', 'orange', 'green', 'red', 'purple'])
+        ax.set_ylabel('Amount ($)')
+        ax.set_title('Categorized Monthly Expenses')
+        ax.tick_params(axis='x', labelrotation=45)
+    cache = cache or get_chart_cache()
+    return cache.get_or_render('bar', categorized_expenses, fmt, lambda: render_figure(draw, fmt))
+
+def pie_chart(categorized_expenses, fmt='png', cache=None):
+    def draw(ax):
+        ax.pie(list(positive.values()), labels=list(positive.keys()), autopct='%1.1f%%', startangle=90,
+               colors=['#ff9999', '#66b3ff', '#99ff99', '#ffcc99', '#c2c2f0'])
+        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+        ax.set_title('Proportion of Expenses by Category')
+    # Filter out categories with zero amounts
+    positive = {category: amount for category, amount in categorized_expenses.items() if amount > 0}
+    if not positive:
+        return None
+    cache = cache or get_chart_cache()
+    return cache.get_or_render('pie', positive, fmt, lambda: render_figure(draw, fmt))
 
 def plot_expenses(categorized_expenses):
-    # Plotting the categorized expenses as a bar chart
-    categories = list(categorized_expenses.keys())
-    amounts = list(categorized_expenses.values())
-
-    fig, ax = plt.subplots()
-    ax.bar(categories, amounts, color=['blue', 'orange', 'green', 'red', 'purple'])
-    ax.set_ylabel('Amount ($)')
-    ax.set_title('Categorized Monthly Expenses')
-    ax.set_xticklabels(categories, rotation=45)
-
     # Show the plot in Streamlit
-    st.pyplot(fig)
+    st.image(bar_chart(categorized_expenses))
 
 def plot_expense_pie_chart(categorized_expenses):
-    # Plotting the categorized expenses as a pie chart
-    categories = list(categorized_expenses.keys())
-    amounts = list(categorized_expenses.values())
-
-    # Filter out categories with zero amounts
-    filtered_categories = [category for category, amount in zip(categories, amounts) if amount > 0]
-    filtered_amounts = [amount for amount in amounts if amount > 0]
-
-    if not filtered_amounts:  # If all amounts are zero, return early
+    chart = pie_chart(categorized_expenses)
+    if chart is None:  # If all amounts are zero, return early
         st.write("No expenses to display in the pie chart.")
         return
 
-    fig, ax = plt.subplots()
-    ax.pie(filtered_amounts, labels=filtered_categories, autopct='%1.1f%%', startangle=90,
-           colors=['#ff9999', '#66b3ff', '#99ff99', '#ffcc99', '#c2c2f0'])
-    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-    plt.title('Proportion of Expenses by Category')
-
     # Show the plot in Streamlit
-    st.pyplot(fig)
-
+    st.image(chart)
+
+# With the previous months of a statement (months x categories) every category is
+# compared with its own history, otherwise with the average of the categories
+# Months of `monthly` before `month` since the first month of the statement, a month
+# without any expense being 0 in every category
+def month_history(monthly, month):
+    months = pd.period_range(monthly.index[0], month, freq='M')[:-1].strftime('%Y-%m')
+    return monthly.reindex(months, fill_value=0.0)
+
+def detect_anomalies(categorized_expenses, history=None):
+    if history is not None and len(history) >= MIN_PERIODS:
+        categories = list(categorized_expenses)
+        detector = AnomalyDetector(categories, history=history.reindex(columns=categories, fill_value=0.0).to_numpy())
+        anomalies = detector.explain(np.array([categorized_expenses[category] for category in categories]))
+        st.write("### Anomaly Detection:")
+        for category, amount, usual, z in anomalies:
+            st.write(f"- ⚠️ Anomaly detected in **{category.capitalize()}**: ${amount:.2f} against a usual ${usual:.2f} "
+                     f"({z:.1f} deviations above your history)")
+        if not anomalies:
+            st.write("- ✅ No unusual spending compared with your previous months.")
+        return
 
-def detect_anomalies(categorized_expenses):
     # Identify anomalies in expense categories
     avg_expenses = np.mean(list(categorized_expenses.values()))
     threshold = 1.5 * avg_expenses  # 1.5 times the average as a threshold
@@ -0,0 +1,79 @@
+import argparse
+import csv
+import json
+import sys
+import time
+
+import pandas as pd
+
+from stock_recommendation import DEFAULT_FEATURES, build_recommendation_data, recommend_batch
+
+# Command line batch mode of the stock recommendation module: reads a file of
+# (date, ticker) queries, scores them block by block against the feature matrix and
+# streams one result per query as JSONL or CSV.
+#
+#   python stock_batch.py queries.csv --output results.jsonl -k 5
+
+def read_queries(path, delimiter, block_size):
+    # Read the query file in chunks so memory stays bounded for very large watchlists
+    for chunk in pd.read_csv(path, delimiter=delimiter, dtype=str, chunksize=block_size):
+        chunk.columns = [column.strip().lower() for column in chunk.columns]
+        for date, ticker in zip(chunk['date'].str.strip(), chunk['ticker'].str.strip()):
+            yield date, ticker
+
+def write_jsonl(results, out):
+    for result in results:
+        out.write(json.dumps(result) + "\n")
+        yield result
+
+def write_csv(results, out):
+    writer = csv.writer(out)
+    writer.writerow(['query_date', 'ticker', 'rank', 'date', 'score'])
+    for result in results:
+        for rank, recommendation in enumerate(result['recommendations'], start=1):
+            writer.writerow([result['date'], result['ticker'], rank, recommendation['date'], recommendation['score']])
+        yield result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Similar-date recommendations for many (date, ticker) queries.")
+    parser.add_argument('queries', help="CSV file with 'date' (MM/DD/YYYY) and 'ticker' columns")
+    parser.add_argument('--data', default="./Data/ticker_history.csv", help="ticker history CSV")
+    parser.add_argument('--output', '-o', default='-', help="output file, '-' for stdout")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help="output format, guessed from the output file extension by default")
+    parser.add_argument('--delimiter', default=',', help="delimiter of the query file")
+    parser.add_argument('-k', type=int, default=3, help="number of recommended dates per query")
+    parser.add_argument('--block-size', type=int, default=128,
+                        help="queries scored per matrix product, bounds memory to block-size x rows floats")
+    parser.add_argument('--features', default=','.join(DEFAULT_FEATURES), help="comma separated feature set")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+    features = tuple(name.strip() for name in args.features.split(',') if name.strip())
+
+    start = time.perf_counter()
+    df, row_index, similarity_index = build_recommendation_data(args.data, features)
+    load_time = time.perf_counter() - start
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        writer = write_csv if output_format == 'csv' else write_jsonl
+        queries = read_queries(args.queries, args.delimiter, args.block_size)
+        results = recommend_batch(queries, df, row_index, similarity_index, k=args.k, block_size=args.block_size)
+
+        start = time.perf_counter()
+        count = missing = 0
+        for result in writer(results, out):
+            count += 1
+            missing += 'error' in result
+        elapsed = time.perf_counter() - start
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print(f"Loaded {len(df)} rows in {load_time:.2f}s", file=sys.stderr)
+    print(f"Scored {count} queries ({missing} not found) in {elapsed:.2f}s: {rate:.1f} queries/s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
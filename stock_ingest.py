@@ -0,0 +1,47 @@
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from stock_recommendation import DEFAULT_FEATURES, append_ticker_history, rebuild_ticker_history
+
+# Nightly update of the stock recommendation data: appends new price rows to the
+# ticker history and its cached feature matrix without refitting anything.
+# A full rebuild only happens with --rebuild.
+#
+#   python stock_ingest.py new_prices.csv
+#   python stock_ingest.py --rebuild
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append new rows to the ticker history cache.")
+    parser.add_argument('new_rows', nargs='?', help="CSV with the same columns as the ticker history")
+    parser.add_argument('--data', default="./Data/ticker_history.csv", help="ticker history CSV")
+    parser.add_argument('--delimiter', default=';', help="delimiter of the new rows file")
+    parser.add_argument('--features', default=','.join(DEFAULT_FEATURES), help="comma separated feature set")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="refit the feature pipeline on the whole history after appending")
+    args = parser.parse_args(argv)
+
+    if not args.new_rows and not args.rebuild:
+        parser.error("nothing to do, give a file of new rows or --rebuild")
+    features = tuple(name.strip() for name in args.features.split(',') if name.strip())
+
+    if args.new_rows:
+        start = time.perf_counter()
+        new_rows = pd.read_csv(args.new_rows, delimiter=args.delimiter)
+        try:
+            count = append_ticker_history(new_rows, args.data, features=features)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        print(f"Appended {count} rows in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+    if args.rebuild:
+        start = time.perf_counter()
+        rebuild_ticker_history(args.data, features=features)
+        print(f"Rebuilt the ticker history cache in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
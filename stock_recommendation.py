@@ -1,25 +1,540 @@
 import pandas as pd
 import streamlit as st
 import re  # Importing the regular expressions module
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import io
+import os
+import json
+import hashlib
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+DATE_FORMAT = '%m/%d/%Y'
+
+def parse_dates(values):
+    return pd.to_datetime(values, format=DATE_FORMAT)
+
+# Dates as int64 seconds since the epoch, the key type used by RowIndex
+def date_keys(values):
+    return np.asarray(parse_dates(values), dtype='datetime64[s]').view(np.int64)
+
+# Value of `column` on the previous trading day of the same ticker (NaN on a ticker's first day)
+def previous_in_ticker(df, column):
+    codes = pd.factorize(df['ticker'])[0]
+    dates = np.asarray(parse_dates(df['date']))
+    order = np.lexsort((dates, codes))
+    values = df[column].to_numpy(dtype=np.float64)[order]
+    previous = np.full(len(order), np.nan)
+    same_ticker = codes[order][1:] == codes[order][:-1]
+    previous[1:] = np.where(same_ticker, values[:-1], np.nan)
+    result = np.empty_like(previous)
+    result[order] = previous
+    return result
+
+# Open, high and low relative to the close of the day
+def ohlc_features(df):
+    close = df['close'].to_numpy(dtype=np.float64)
+    return [df[column].to_numpy(dtype=np.float64) / close - 1 for column in ('open', 'high', 'low')]
+
+# Intraday range relative to the close
+def range_features(df):
+    close = df['close'].to_numpy(dtype=np.float64)
+    return [(df['high'].to_numpy(dtype=np.float64) - df['low'].to_numpy(dtype=np.float64)) / close]
+
+# Close-to-close return
+def return_features(df):
+    return [df['close'].to_numpy(dtype=np.float64) / previous_in_ticker(df, 'close') - 1]
+
+# Log change of the traded volume, zero when the history has no volume column
+def volume_features(df):
+    if 'volume' not in df.columns:
+        return [np.zeros(len(df))]
+    return [np.log1p(df['volume'].to_numpy(dtype=np.float64)) - np.log1p(previous_in_ticker(df, 'volume'))]
+
+FEATURE_BUILDERS = {
+    'ohlc': ohlc_features,
+    'range': range_features,
+    'return': return_features,
+    'volume': volume_features,
+}
+DEFAULT_FEATURES = ('ohlc', 'range', 'return', 'volume')
+
+# Dense float32 feature matrix, one row per price row: every feature column is
+# standardised with the mean and deviation learnt by fit_transform, so no feature
+# dominates the cosine score and new rows can be transformed the same way later
+class FeaturePipeline:
+    def __init__(self, features=DEFAULT_FEATURES):
+        unknown = [name for name in features if name not in FEATURE_BUILDERS]
+        if unknown:
+            raise ValueError(f"Unknown features: {unknown}")
+        self.features = tuple(features)
+        self.mean_ = None
+        self.std_ = None
+
+    def _raw_matrix(self, df):
+        columns = [column for name in self.features for column in FEATURE_BUILDERS[name](df)]
+        return np.column_stack(columns)
+
+    def fit_transform(self, df):
+        matrix = self._raw_matrix(df)
+        with np.errstate(all='ignore'):
+            matrix[~np.isfinite(matrix)] = np.nan
+            self.mean_ = np.nan_to_num(np.nanmean(matrix, axis=0))
+            std = np.nan_to_num(np.nanstd(matrix, axis=0))
+        # A constant column keeps a rounding-error deviation, scaling by it would blow the noise up
+        self.std_ = np.where(std > 1e-9, std, 1.0)
+        return self._scale(matrix)
+
+    def transform(self, df):
+        if self.mean_ is None:
+            raise ValueError("FeaturePipeline must be fitted before transform")
+        return self._scale(self._raw_matrix(df))
+
+    def _scale(self, matrix):
+        with np.errstate(all='ignore'):
+            matrix = (matrix - self.mean_) / self.std_
+        matrix[~np.isfinite(matrix)] = 0.0
+        return matrix.astype(np.float32)
+
+# Similarity index built once per dataset: rows are L2-normalised so a single
+# row-times-matrix product gives the cosine scores of one row against all the others,
+# without ever materialising the N x N similarity matrix
+class SimilarityIndex:
+    def __init__(self, matrix, ticker_rows, normalized=False):
+        self.matrix = matrix if normalized else normalize(matrix, norm='l2', copy=True)
+        # Row positions of every ticker, used to restrict a query to one company
+        self.ticker_rows = ticker_rows
+        # Ticker number of every row, used to mask other companies in batch queries
+        self.row_codes = np.full(self.matrix.shape[0], -1, dtype=np.int32)
+        for code, rows in enumerate(ticker_rows.values()):
+            self.row_codes[rows] = code
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    # Return the positions and scores of the k rows most similar to row `position`,
+    # best first, optionally only among the rows of `ticker`
+    def top_k(self, position, k=3, ticker=None):
+        rows = None
+        candidates = self.matrix
+        if ticker is not None:
+            rows = self.ticker_rows.get(ticker)
+            if rows is None:
+                return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+            candidates = self.matrix[rows]
+
+        scores = candidates @ self.matrix[position].T
+        scores = scores.toarray().ravel() if sparse.issparse(scores) else np.asarray(scores).ravel()
+
+        k = min(k, scores.size)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), scores[:0]
+        # Partial selection of the k best scores, then sort only those k
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        positions = top if rows is None else rows[top]
+        return positions, scores[top]
+
+    # Batch version of top_k for a block of query rows: one (block x N) matrix product,
+    # so memory is bounded by the size of the block. Returns (positions, scores) arrays
+    # of shape (len(positions), k), best first; rows of other tickers are skipped when
+    # same_ticker is set.
+    def top_k_block(self, positions, k=3, same_ticker=True):
+        positions = np.asarray(positions, dtype=np.intp)
+        scores = np.asarray(self.matrix[positions] @ self.matrix.T, dtype=np.float32)
+        if same_ticker:
+            scores[self.row_codes[positions][:, None] != self.row_codes[None, :]] = -np.inf
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    # Point the index at a grown feature matrix whose new rows have the given ticker codes
+    def extend(self, matrix, codes):
+        self.matrix = matrix
+        self.row_codes = np.concatenate([self.row_codes, np.asarray(codes, dtype=np.int32)])
+
+# Row lookups built once at load time: a (ticker, date) -> row position hash map for
+# point lookups and, per ticker, the row positions sorted by date for range queries
+class RowIndex:
+    def __init__(self, df):
+        codes, uniques = pd.factorize(df['ticker'])
+        dates = date_keys(df['date'])
+        self.ticker_codes = {ticker: code for code, ticker in enumerate(uniques)}
+        # Iterate backwards so the first row of a duplicated (ticker, date) wins
+        positions = np.arange(len(df))
+        self.positions = dict(zip(zip(codes[::-1].tolist(), dates[::-1].tolist()), positions[::-1].tolist()))
+
+        order = np.lexsort((dates, codes))
+        bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+        self.ticker_rows = dict(zip(uniques, np.split(order, bounds)))
+        self.ticker_dates = {ticker: dates[rows] for ticker, rows in self.ticker_rows.items()}
+
+    # Add rows appended at positions offset, offset + 1, ... (newer than the rows
+    # already indexed for their ticker). Returns the ticker code of every new row.
+    def extend(self, tickers, dates, offset):
+        tickers = [str(ticker) for ticker in tickers]
+        codes = np.array([self.ticker_codes.setdefault(ticker, len(self.ticker_codes)) for ticker in tickers], dtype=np.int64)
+        dates = date_keys(dates)
+        positions = np.arange(offset, offset + len(tickers))
+        for key, position in zip(zip(codes.tolist(), dates.tolist()), positions.tolist()):
+            self.positions.setdefault(key, position)
+
+        order = np.lexsort((dates, codes))
+        for ticker, batch in pd.Series(order).groupby(np.asarray(tickers)[order], sort=False):
+            batch = batch.to_numpy()
+            self.ticker_rows[ticker] = np.concatenate([self.ticker_rows.get(ticker, positions[:0]), positions[batch]])
+            self.ticker_dates[ticker] = np.concatenate([self.ticker_dates.get(ticker, dates[:0]), dates[batch]])
+        return codes
+
+    def __len__(self):
+        return len(self.positions)
+
+    # Row position of (ticker, date), None if there is no such row
+    def lookup(self, ticker, date):
+        code = self.ticker_codes.get(ticker)
+        if code is None:
+            return None
+        try:
+            key = int(date_keys([date])[0])
+        except ValueError:
+            return None
+        return self.positions.get((code, key))
+
+    # lookup for many (ticker, date) pairs at once, parsing all the dates in one call
+    def lookup_many(self, tickers, dates):
+        keys = date_keys(pd.Series(dates, dtype=object)).tolist() if len(dates) else []
+        codes = [self.ticker_codes.get(ticker) for ticker in tickers]
+        return [None if code is None else self.positions.get((code, key)) for code, key in zip(codes, keys)]
+
+    # Row positions of `ticker` between start and end (both included), in date order
+    def between(self, ticker, start=None, end=None):
+        rows = self.ticker_rows.get(ticker)
+        if rows is None:
+            return np.empty(0, dtype=np.intp)
+        dates = self.ticker_dates[ticker]
+        lo = 0 if start is None else np.searchsorted(dates, date_keys([start])[0], side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, date_keys([end])[0], side='right')
+        return rows[lo:hi]
+
+# Columnar on-disk copy of the ticker history: one .npy file per column (the ticker
+# as int32 codes into a dictionary, the date parsed to datetime64) plus the
+# normalised feature matrix, all memory-mapped on load. manifest.json is written
+# last and records the source file it was built from.
+CACHE_VERSION = 2
+
+def default_cache_dir(csv_path):
+    root, _ = os.path.splitext(csv_path)
+    return root + "_cache"
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, "manifest.json")
+    with open(path + ".tmp", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+def save_array(cache_dir, name, array):
+    path = os.path.join(cache_dir, name + ".npy")
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+def load_array(cache_dir, name, rows=None):
+    array = np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode='r')
+    return array if rows is None else array[:rows]
+
+# Append `values` after the first `rows` rows of a cached array without rewriting it:
+# anything past `rows` (left by an interrupted append) is cut off, the new rows are
+# written at the end and the .npy header is updated with the new shape. The file is
+# only rewritten when the new header no longer fits in the old one.
+def append_array(cache_dir, name, values, rows):
+    path = os.path.join(cache_dir, name + ".npy")
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        header_size = f.tell()
+        values = np.ascontiguousarray(values, dtype=dtype).reshape((-1,) + shape[1:])
+
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {
+            'descr': np.lib.format.dtype_to_descr(dtype),
+            'fortran_order': fortran_order,
+            'shape': (rows + len(values),) + shape[1:],
+        })
+        if len(header.getvalue()) == header_size:
+            row_size = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+            f.truncate(header_size + rows * row_size)
+            f.seek(0, os.SEEK_END)
+            f.write(values.tobytes())
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+    existing = np.load(path, mmap_mode='r')[:rows]
+    save_array(cache_dir, name, np.concatenate([existing, values]))
+
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+# Return the manifest if the cache still matches csv_path, None when it must be rebuilt.
+# The mtime and size are checked first, the content hash only when they changed.
+def valid_manifest(csv_path, cache_dir, features):
+    manifest = read_manifest(cache_dir)
+    if not manifest or manifest.get('version') != CACHE_VERSION or manifest.get('features') != list(features):
+        return None
+    stat = os.stat(csv_path)
+    source = manifest['source']
+    if source['mtime_ns'] == stat.st_mtime_ns and source['size'] == stat.st_size:
+        return manifest
+    # No recorded hash after an append: only the mtime and size can vouch for the file
+    if source['sha256'] is None or source['sha256'] != file_digest(csv_path):
+        return None
+    # Touched but unchanged: remember the new mtime so the hash is not recomputed next time
+    source.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    write_manifest(cache_dir, manifest)
+    return manifest
+
+def build_columnar_cache(csv_path, cache_dir, features=DEFAULT_FEATURES):
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        os.remove(os.path.join(cache_dir, "manifest.json"))
+    except FileNotFoundError:
+        pass
+    stat = os.stat(csv_path)
+    digest = file_digest(csv_path)
+    df = pd.read_csv(csv_path, delimiter=';')
+
+    columns = {}
+    categories = {}
+    for name in df.columns:
+        values = df[name]
+        if name == 'date':
+            save_array(cache_dir, name, parse_dates(values).to_numpy(dtype='datetime64[s]'))
+        elif pd.api.types.is_numeric_dtype(values):
+            save_array(cache_dir, name, values.to_numpy())
+        else:
+            codes, uniques = pd.factorize(values)
+            save_array(cache_dir, name, codes.astype(np.int32))
+            categories[name] = [str(value) for value in uniques]
+        columns[name] = 'categorical' if name in categories else 'array'
+
+    pipeline = FeaturePipeline(features)
+    save_array(cache_dir, "features", normalize(pipeline.fit_transform(df), norm='l2'))
+    # Most recent row of every ticker, the context needed to append new days later
+    last_rows = parse_dates(df['date']).groupby(df['ticker'].astype(str)).idxmax()
+
+    write_manifest(cache_dir, {
+        'version': CACHE_VERSION,
+        'source': {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest},
+        'rows': len(df),
+        'columns': columns,
+        'categories': categories,
+        'features': list(features),
+        'mean': pipeline.mean_.tolist(),
+        'std': pipeline.std_.tolist(),
+        'last_rows': {ticker: int(position) for ticker, position in last_rows.items()},
+    })
+
+# Load the ticker history from its columnar cache, (re)building the cache first if
+# the CSV changed. Returns the dataframe (backed by the memory-mapped columns), the
+# fitted feature pipeline and the normalised feature matrix.
+def load_ticker_history(csv_path, cache_dir=None, features=DEFAULT_FEATURES):
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    manifest = valid_manifest(csv_path, cache_dir, features)
+    if manifest is None:
+        build_columnar_cache(csv_path, cache_dir, features)
+        manifest = read_manifest(cache_dir)
+
+    rows = manifest['rows']
+    data = {}
+    for name, kind in manifest['columns'].items():
+        values = load_array(cache_dir, name, rows)
+        if kind == 'categorical':
+            values = pd.Categorical.from_codes(values, categories=manifest['categories'][name])
+        data[name] = values
+    df = pd.DataFrame(data, copy=False)
+
+    pipeline = FeaturePipeline(manifest['features'])
+    pipeline.mean_ = np.asarray(manifest['mean'])
+    pipeline.std_ = np.asarray(manifest['std'])
+    return df, pipeline, load_array(cache_dir, "features", rows)
+
+# Append new price rows to the ticker history without refitting anything: the new
+# rows go through the frozen feature pipeline (with the last known day of each
+# ticker as context for returns) and are appended to the CSV, the cached columns and
+# the feature matrix. Cost grows with the number of new rows, not with the history.
+# Rows must be newer than the last cached day of their ticker; anything else (late
+# corrections, backfills) needs an explicit rebuild_ticker_history.
+# Returns the number of rows appended.
+def append_ticker_history(new_rows, csv_path, cache_dir=None, features=DEFAULT_FEATURES):
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    df, pipeline, _ = load_ticker_history(csv_path, cache_dir, features)
+    manifest = read_manifest(cache_dir)
+    rows = manifest['rows']
+
+    new_rows = pd.DataFrame(new_rows).reset_index(drop=True)
+    missing = [name for name in manifest['columns'] if name not in new_rows.columns]
+    if missing:
+        raise ValueError(f"New rows are missing columns: {missing}")
+    new_rows = new_rows[list(manifest['columns'])]
+    new_rows['ticker'] = new_rows['ticker'].astype(str)
+    new_dates = pd.DatetimeIndex(parse_dates(new_rows['date']))
+    keep = ~pd.DataFrame({'ticker': new_rows['ticker'].to_numpy(), 'date': new_dates}).duplicated().to_numpy()
+    new_rows = new_rows[keep].reset_index(drop=True)
+    new_dates = new_dates[keep]
+    if new_rows.empty:
+        return 0
+
+    last_rows = manifest['last_rows']
+    context = [last_rows[ticker] for ticker in new_rows['ticker'].unique() if ticker in last_rows]
+    last_dates = pd.Series(df['date'].to_numpy()[context], index=df['ticker'].to_numpy()[context].astype(str))
+    first_new = pd.Series(new_dates.to_numpy()).groupby(new_rows['ticker'].to_numpy()).min()
+    stale = [ticker for ticker, day in first_new.items() if ticker in last_dates and day <= last_dates[ticker]]
+    if stale:
+        raise ValueError(f"Rows at or before the last cached date of {stale}, a full rebuild is needed")
+
+    # Features of the new rows, computed with the previous day of each ticker in front
+    history = df.iloc[context].copy()
+    history['date'] = history['date'].dt.strftime(DATE_FORMAT)
+    history['ticker'] = history['ticker'].astype(str)
+    batch = pd.concat([history, new_rows.assign(date=new_dates.strftime(DATE_FORMAT))], ignore_index=True)
+    features_matrix = normalize(pipeline.transform(batch)[len(history):], norm='l2')
+
+    for name, kind in manifest['columns'].items():
+        values = new_rows[name]
+        if name == 'date':
+            values = new_dates.to_numpy(dtype='datetime64[s]')
+        elif kind == 'categorical':
+            categories = manifest['categories'][name]
+            codes = {value: code for code, value in enumerate(categories)}
+            for value in values.astype(str):
+                if value not in codes:
+                    codes[value] = len(categories)
+                    categories.append(value)
+            values = values.astype(str).map(codes).to_numpy(dtype=np.int32)
+        else:
+            values = values.to_numpy()
+        append_array(cache_dir, name, values, rows)
+    append_array(cache_dir, "features", features_matrix, rows)
+
+    with open(csv_path, 'a', newline='') as f:
+        if not ends_with_newline(csv_path):
+            f.write('\n')
+        new_rows.assign(date=new_dates.strftime(DATE_FORMAT)).to_csv(f, sep=';', header=False, index=False)
+
+    positions = pd.Series(np.arange(rows, rows + len(new_rows)))
+    for ticker, position in positions.groupby(new_rows['ticker'].to_numpy()).last().items():
+        last_rows[ticker] = int(position)
+    stat = os.stat(csv_path)
+    manifest['source'] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': None}
+    manifest['rows'] = rows + len(new_rows)
+    write_manifest(cache_dir, manifest)
+    return len(new_rows)
+
+# Explicit full rebuild of the cache, refitting the feature pipeline on the whole history
+def rebuild_ticker_history(csv_path, cache_dir=None, features=DEFAULT_FEATURES):
+    build_columnar_cache(csv_path, cache_dir or default_cache_dir(csv_path), features)
+
+def build_recommendation_data(path="./Data/ticker_history.csv", features=DEFAULT_FEATURES):
+    df, pipeline, feature_matrix = load_ticker_history(path, features=features)
+    row_index = RowIndex(df)
+    return df, row_index, SimilarityIndex(feature_matrix, row_index.ticker_rows, normalized=True)
+
+# Append new rows (see append_ticker_history) and extend already loaded
+# recommendation data in place instead of rebuilding its indexes
+def ingest_ticker_rows(new_rows, data, path="./Data/ticker_history.csv", features=DEFAULT_FEATURES):
+    df, row_index, similarity_index = data
+    start = len(df)
+    append_ticker_history(new_rows, path, features=features)
+    df, _, feature_matrix = load_ticker_history(path, features=features)
+    added = df.iloc[start:]
+    codes = row_index.extend(added['ticker'], added['date'], start)
+    similarity_index.extend(feature_matrix, codes)
+    return df, row_index, similarity_index
+
+# Load the ticker history and build its similarity index once per dataset, the result
+# is shared across Streamlit reruns and sessions. The file's mtime is part of the
+# cache key so rows appended by another process are picked up.
+def load_recommendation_data(path="./Data/ticker_history.csv", features=DEFAULT_FEATURES):
+    return _cached_recommendation_data(path, features, os.stat(path).st_mtime_ns)
+
+@st.cache_resource(max_entries=2)
+def _cached_recommendation_data(path, features, mtime_ns):
+    return build_recommendation_data(path, features)
+
+# Recommendations for many (date, ticker) queries at once. Queries are scored
+# block_size at a time with SimilarityIndex.top_k_block and one result dict is
+# yielded per query, in input order, so results can be streamed out as they come.
+def recommend_batch(queries, df, row_index, similarity_index, k=3, block_size=128):
+    block = []
+    for query in queries:
+        block.append(query)
+        if len(block) >= block_size:
+            yield from _recommend_block(block, df, row_index, similarity_index, k)
+            block = []
+    if block:
+        yield from _recommend_block(block, df, row_index, similarity_index, k)
+
+def _recommend_block(block, df, row_index, similarity_index, k):
+    try:
+        positions = row_index.lookup_many([ticker for _, ticker in block], [date for date, _ in block])
+    except ValueError:
+        # At least one malformed date in the block, fall back to one lookup per query
+        positions = [row_index.lookup(ticker, date) for date, ticker in block]
+    found = [position for position in positions if position is not None]
+    if found:
+        top, scores = similarity_index.top_k_block(found, k=k)
+        dates = df['date'].to_numpy()
+        results = iter(zip(top, scores))
+
+    for (date, ticker), position in zip(block, positions):
+        if position is None:
+            yield {'date': date, 'ticker': ticker, 'recommendations': [], 'error': "no data for this date and ticker"}
+            continue
+        indices, row_scores = next(results)
+        keep = np.isfinite(row_scores)
+        recommended = pd.DatetimeIndex(dates[indices[keep]]).strftime(DATE_FORMAT)
+        yield {
+            'date': date,
+            'ticker': ticker,
+            'recommendations': [
+                {'date': day, 'score': round(float(score), 6)}
+                for day, score in zip(recommended, row_scores[keep])
+            ],
+        }
 
 # Function to get item recommendations based on user input (date and ticker)
 def get_recommendations(date, ticker):
-    # Find the index of the first row where the user input date matches in the column Date
-    filtered_df = df[(df['date'] == date) & (df['ticker'] == ticker)]
+    # Find the row of the user input date and ticker
+    index = row_index.lookup(ticker, date)
  
-    if not filtered_df.empty:
-        index = filtered_df.index[0]
-        
-        # Calculate the similarity between items represented by their TF-IDF vectors
-        similarities = cosine_similarity(tfidf_matrix, tfidf_matrix)
-        cosine_scores = similarities[index]
+    if index is not None:
+        # Get the 3 indices of items with the closest feature vectors for this ticker
+        indices, cosine_scores = similarity_index.top_k(index, k=3, ticker=ticker)
         st.write(cosine_scores)
-        # Get the 3 indices of items with the highest similarity scores
-        indices = cosine_scores.argsort()[:-4:-1]
         # Return recommended items
-        recommendations = df['date'].iloc[indices].tolist()
+        recommendations = df['date'].iloc[indices].dt.strftime(DATE_FORMAT).tolist()
         return recommendations
     else:
         st.write(f"No data found for date {date} and ticker {ticker}")
@@ -28,18 +543,16 @@ def get_recommendations(date, ticker):
 def display_recommended_dates(recommendations, ticker):
     if recommendations is not None:
         for i in recommendations:
-            st.write(df[(df['date'] == f"{i}") & (df['ticker'] == ticker)])
+            index = row_index.lookup(ticker, i)
+            if index is not None:
+                st.write(df.iloc[[index]])
     else:
         st.write(f"No data found for recommendations {recommendations}")
 
 # Example usage
 def get_stock_recommendation(): 
-    global df
-    df = pd.read_csv("./Data/ticker_history.csv", delimiter=';')
-    df['Features'] = df[['open', 'high', 'low', 'close', 'ticker']].astype(str).agg(' '.join, axis=1)
-    vectorizer = TfidfVectorizer(stop_words='english')
-    global tfidf_matrix
-    tfidf_matrix = vectorizer.fit_transform(df['Features'])
+    global df, row_index, similarity_index
+    df, row_index, similarity_index = load_recommendation_data("./Data/ticker_history.csv")
 
     st.write("Chatbot: Welcome to the stock recommendation module!")
 
@@ -62,12 +575,15 @@ def get_stock_recommendation():
         else:
             st.write(f"No recommendations found for date {date_input} and ticker {ticker}.")
 
-# Uncomment the following line to run the function when executing the script
-st.title("Stock Recommendation")
-st.write("Welcome to the Stock Recommendation page!")
-st.write("This page consist of having giving you dates of a company where the features are really near ")
+def main():
+    st.title("Stock Recommendation")
+    st.write("Welcome to the Stock Recommendation page!")
+    st.write("This page consist of having giving you dates of a company where the features are really near ")
+
+    st.write("To test this you can set the date to 08/12/2023 with aapl as the ticker\n")
+    st.write("--------------------------------------------------------")
 
-st.write("To test this you can set the date to 08/12/2023 with aapl as the ticker\n")
-st.write("--------------------------------------------------------")
+    get_stock_recommendation()
 
-get_stock_recommendation()
+if __name__ == "__main__":
+    main()
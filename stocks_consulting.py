@@ -1,134 +1,395 @@
 from datetime import *
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
 import pandas as pd
 import streamlit as st
 import warnings
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from yahoofinancials import YahooFinancials
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+STATEMENT_KEYS = {
+    'income': 'incomeStatementHistory',
+    'cash': 'cashflowStatementHistory',
+    'balance': 'balanceSheetHistory',
+}
+
+# Shared, bounded pool used for the network calls of every session
+FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fetch")
+FETCH_TIMEOUT = 15  # seconds request_data waits for all of its calls together
+YAHOO_TIMEOUT = 10  # seconds allowed for each HTTP request to Yahoo
+
 def get_previous_day():
     previous_day = str(date.today() - timedelta(days=1))
     return previous_day
 
-def request_data(ticker):
-    yf = YahooFinancials(ticker)
-    try:
-        data_income = yf.get_financial_stmts('annual', 'income')['incomeStatementHistory'][ticker]
-        data_cash = yf.get_financial_stmts('annual', 'cash')['cashflowStatementHistory'][ticker]
-        data_balance = yf.get_financial_stmts('annual', 'balance')['balanceSheetHistory'][ticker]
-        stock_history = yf.get_historical_price_data(
-            start_date=get_previous_day(), 
-            end_date=str(date.today()), 
+# Fetch layer backed by Yahoo Finance. Every HTTP request has a network timeout, so a
+# call to a server that stops answering fails instead of holding a FETCH_POOL thread
+# forever (request_data stops waiting at its deadline but cannot stop a running call).
+class YahooFetcher:
+    def __init__(self, timeout=YAHOO_TIMEOUT):
+        self.timeout = timeout
+
+    def fetch_statement(self, ticker, statement):
+        data = YahooFinancials(ticker, timeout=self.timeout).get_financial_stmts('annual', statement)
+        return data[STATEMENT_KEYS[statement]][ticker]
+
+    def fetch_prices(self, ticker, start_date, end_date):
+        return YahooFinancials(ticker, timeout=self.timeout).get_historical_price_data(
+            start_date=start_date,
+            end_date=end_date,
             time_interval="daily")[ticker]
-        return data_income, data_cash, data_balance, stock_history
-    except Exception as e:
-        return None, None, None, None  # Return None for all data if there's an error
 
+# Fetch layer reading JSON fixtures (<ticker>_<income|cash|balance|prices>.json) from a
+# directory, a stand-in for Yahoo in tests and benchmarks. `delay` simulates latency.
+class FixtureFetcher:
+    def __init__(self, directory, delay=0.0):
+        self.directory = directory
+        self.delay = delay
+
+    def _load(self, ticker, kind):
+        if self.delay:
+            time.sleep(self.delay)
+        with open(os.path.join(self.directory, f"{ticker}_{kind}.json")) as f:
+            return json.load(f)
+
+    def fetch_statement(self, ticker, statement):
+        return self._load(ticker, statement)
+
+    def fetch_prices(self, ticker, start_date, end_date):
+        return self._load(ticker, 'prices')
+
+# Seconds before cached data is considered out of date. Statements only change a few
+# times a year, prices are refreshed often.
+DEFAULT_TTLS = {
+    'income': 30 * 24 * 3600,
+    'cash': 30 * 24 * 3600,
+    'balance': 30 * 24 * 3600,
+    'prices': 15 * 60,
+}
+CACHE_PATH = "./Data/fundamentals_cache.sqlite3"
+
+# Persistent cache in front of another fetcher, stored in SQLite and keyed by ticker,
+# data type and period. Fresh entries are served locally; entries past their TTL but
+# younger than twice the TTL are served stale while a background refresh runs; older
+# ones are fetched again (falling back to the stale copy if that fails). The least
+# recently used entries are evicted past max_entries.
+class CachedFetcher:
+    def __init__(self, fetcher, path=CACHE_PATH, ttls=None, max_entries=50000):
+        self.fetcher = fetcher
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._ready = False
+
+    # One short-lived connection per operation, run as a single transaction. The
+    # database is created on first use, not when the module is imported.
+    @contextmanager
+    def _connect(self):
+        if not self._ready:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            if not self._ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                self._create_schema(conn)
+                self._ready = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create_schema(self, conn):
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    ticker TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (ticker, kind, period)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def cache_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    # Every cached annual statement of the given kinds in one query, as
+    # {(ticker, kind): statement}, without going to the network or counting hits
+    def cached_statements(self, kinds=tuple(STATEMENT_KEYS)):
+        kinds = list(kinds)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT ticker, kind, value FROM cache WHERE period = 'annual' AND kind IN ({', '.join('?' * len(kinds))})",
+                kinds).fetchall()
+        return {(ticker, kind): json.loads(value) for ticker, kind, value in rows}
+
+    def fetch_statement(self, ticker, statement):
+        return self._get(ticker, statement, 'annual', lambda: self.fetcher.fetch_statement(ticker, statement))
+
+    def fetch_prices(self, ticker, start_date, end_date):
+        return self._get(ticker, 'prices', f"{start_date}:{end_date}",
+                         lambda: self.fetcher.fetch_prices(ticker, start_date, end_date))
+
+    def _get(self, ticker, kind, period, fetch):
+        key = (ticker.upper(), kind, period)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, fetched_at FROM cache WHERE ticker = ? AND kind = ? AND period = ?", key).fetchone()
+            if row is not None:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE ticker = ? AND kind = ? AND period = ?",
+                             (time.time(),) + key)
+
+        if row is not None:
+            value, fetched_at = json.loads(row[0]), row[1]
+            age = time.time() - fetched_at
+            ttl = self.ttls[kind]
+            if age <= ttl:
+                self._count('hits')
+                return value
+            if age <= 2 * ttl:
+                self._count('stale_hits')
+                self._refresh_in_background(key, fetch)
+                return value
+
+        self._count('misses')
+        try:
+            return self._store(key, fetch())
+        except Exception:
+            if row is not None:
+                return value  # Better out of date than nothing
+            raise
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._store(key, fetch())
+            except Exception:
+                pass  # Keep serving the stale copy, the next request will try again
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        FETCH_POOL.submit(refresh)
+
+    def _store(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                         key + (json.dumps(value), now, now))
+            conn.execute("""
+                DELETE FROM cache WHERE rowid IN (
+                    SELECT rowid FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+        return value
+
+default_fetcher = CachedFetcher(YahooFetcher())
+
+# Fetch the three annual statements and the latest prices concurrently. The calls share
+# one deadline, `timeout` seconds from the start: a call that failed or is still running
+# at the deadline only returns None for its own piece of data. A call that is already
+# running is left to finish in the background; YahooFetcher's network timeout bounds it.
+def request_data(ticker, fetcher=None, timeout=FETCH_TIMEOUT):
+    fetcher = fetcher or default_fetcher
+    futures = [
+        FETCH_POOL.submit(fetcher.fetch_statement, ticker, 'income'),
+        FETCH_POOL.submit(fetcher.fetch_statement, ticker, 'cash'),
+        FETCH_POOL.submit(fetcher.fetch_statement, ticker, 'balance'),
+        FETCH_POOL.submit(fetcher.fetch_prices, ticker, get_previous_day(), str(date.today())),
+    ]
+    deadline = time.monotonic() + timeout
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+        except FutureTimeoutError:
+            future.cancel()  # Only stops a call that has not started yet
+            results.append(None)
+        except Exception:
+            results.append(None)  # Only this piece of data is missing
+    data_income, data_cash, data_balance, stock_history = results
+    return data_income, data_cash, data_balance, stock_history
+
+# Latest report of a statement list, in a single pass over it
 def get_most_recent_report(data):
-    all_dates = [key for dico in data if dico for key in dico.keys()]
-    if not all_dates:  # Check if there are no dates
-        return {}
-    max_date = max(all_dates)
-    report_last_date = next((entry for entry in data if max_date in entry), None)
-    return report_last_date[max_date] if report_last_date else {}
+    latest_date, latest_report = None, {}
+    for entry in data or []:
+        for report_date, report in (entry or {}).items():
+            if latest_date is None or report_date > latest_date:
+                latest_date, latest_report = report_date, report
+    return latest_report
+
+# Latest report of every statement and the latest price of one ticker, resolved once
+# when the data is fetched. Indicators are pure functions of a snapshot, so sessions
+# never share state. A statement that could not be fetched is None.
+class FundamentalsSnapshot:
+    __slots__ = ('income', 'cash', 'balance', 'price')
 
+    def __init__(self, income, cash, balance, price):
+        self.income = income
+        self.cash = cash
+        self.balance = balance
+        self.price = price
 
-def get_turnover():
-    turnover = get_most_recent_report(data_income)['totalRevenue']
+    @classmethod
+    def from_data(cls, data_income, data_cash, data_balance, stock_history):
+        try:
+            price = stock_history['prices'][0]['close']
+        except (KeyError, IndexError, TypeError):
+            price = None
+        return cls(
+            get_most_recent_report(data_income) if data_income is not None else None,
+            get_most_recent_report(data_cash) if data_cash is not None else None,
+            get_most_recent_report(data_balance) if data_balance is not None else None,
+            price,
+        )
+
+    def is_complete(self):
+        return None not in (self.income, self.cash, self.balance, self.price)
+
+    def is_empty(self):
+        return self.income is None and self.cash is None and self.balance is None and self.price is None
+
+
+def get_turnover(snapshot):
+    turnover = snapshot.income['totalRevenue']
     return str(round(turnover, 2)) + " $"
 
-def get_free_cash_flow():
-    free_cash_flow = get_most_recent_report(data_cash)['freeCashFlow']
+def get_free_cash_flow(snapshot):
+    free_cash_flow = snapshot.cash['freeCashFlow']
     return str(round(free_cash_flow, 2)) + " $"
 
-def get_gross_margin():
-    turnover = get_most_recent_report(data_income)['totalRevenue']
-    gross_profit = get_most_recent_report(data_income)['grossProfit']
+def get_gross_margin(snapshot):
+    turnover = snapshot.income['totalRevenue']
+    gross_profit = snapshot.income['grossProfit']
     gross_margin = gross_profit / turnover * 100
     return str(round(gross_margin, 2)) + " %"
 
-def get_net_turnover():
-    net_turnover = get_most_recent_report(data_income)['netIncome']
+def get_net_turnover(snapshot):
+    net_turnover = snapshot.income['netIncome']
     return str(round(net_turnover, 2)) + " $"
 
-def get_net_margin():
-    net_turnover = get_most_recent_report(data_income)['netIncome']
-    turnover = get_most_recent_report(data_income)['totalRevenue']
+def get_net_margin(snapshot):
+    net_turnover = snapshot.income['netIncome']
+    turnover = snapshot.income['totalRevenue']
     net_margin = net_turnover / turnover * 100
     return str(round(net_margin, 2)) + " %"
 
-def get_roe():
-    stockholders_equity = get_most_recent_report(data_balance)['stockholdersEquity']
-    net_turnover = get_most_recent_report(data_income)['netIncome']
+def get_roe(snapshot):
+    stockholders_equity = snapshot.balance['stockholdersEquity']
+    net_turnover = snapshot.income['netIncome']
     roe = net_turnover / stockholders_equity * 100
     return str(round(roe, 2)) + " %"
 
-def get_operating_margin():
-    ebit = get_most_recent_report(data_income)['ebit']
-    turnover = get_most_recent_report(data_income)['totalRevenue']
+def get_operating_margin(snapshot):
+    ebit = snapshot.income['ebit']
+    turnover = snapshot.income['totalRevenue']
     operating_margin = ebit / turnover * 100
     return str(round(operating_margin, 2)) + " %"
 
-def get_roa():
-    total_assets = get_most_recent_report(data_balance)['totalAssets']
-    net_turnover = get_most_recent_report(data_income)['netIncome']
+def get_roa(snapshot):
+    total_assets = snapshot.balance['totalAssets']
+    net_turnover = snapshot.income['netIncome']
     roa = net_turnover / total_assets * 100
     return str(round(roa, 2)) + " %"
 
-def get_payout_ratio():
-    total_dividend_paid = get_most_recent_report(data_cash).get('cashDividendsPaid', 0)  # Default to 0 if not found
-    net_turnover = get_most_recent_report(data_income)['netIncome']
+def get_payout_ratio(snapshot):
+    total_dividend_paid = snapshot.cash.get('cashDividendsPaid', 0)  # Default to 0 if not found
+    net_turnover = snapshot.income['netIncome']
     if net_turnover == 0:  # Avoid division by zero
         return "N/A"  # Or some suitable default value
     payout_ratio = - total_dividend_paid / net_turnover * 100
     return str(round(payout_ratio, 2)) + " %"
 
 
-def get_ratio_equity_debt():
-    stockholders_equity = get_most_recent_report(data_balance)['stockholdersEquity']
-    debt = get_most_recent_report(data_balance)['longTermDebt']
+def get_ratio_equity_debt(snapshot):
+    stockholders_equity = snapshot.balance['stockholdersEquity']
+    debt = snapshot.balance['longTermDebt']
     ratio_debt_equity = debt / stockholders_equity * 100
     return str(round(ratio_debt_equity, 2)) + " %"
 
-def get_per():
-    total_cap = get_most_recent_report(data_balance)['totalCapitalization']
-    net_turnover = get_most_recent_report(data_income)['netIncome']
+def get_per(snapshot):
+    total_cap = snapshot.balance['totalCapitalization']
+    net_turnover = snapshot.income['netIncome']
     per = total_cap / net_turnover * 100
     return str(round(per, 2)) + " %"
 
-def get_today_stock():
-    return str(round(stock_history['prices'][0]['close'], 2)) + " $"
-
-# Streamlit App Layout
-st.title("Stocks Consulting")
-st.write("Welcome to the Stocks Consulting page!")
-st.write("This page consists of indicators and information about company stocks.")
-st.write("--------------------------------------------------------")
-
-ticker = st.text_input('Enter your ticker please:', '')
-
-if st.button('Get Stock Data'):
-    data_income, data_cash, data_balance, stock_history = request_data(ticker.strip())
-    
-    if data_income is None or data_cash is None or data_balance is None or stock_history is None:
-        st.error("Failed to retrieve data for the provided ticker.")
-    else:
-        indicators = {
-            "Today Stock Price": get_today_stock(),
-            "Turnover": get_turnover(),
-            "Net Turnover": get_net_turnover(),
-            "Gross Margin": get_gross_margin(),
-            "Net Margin": get_net_margin(),
-            "Operating Margin": get_operating_margin(),
-            "ROE (Return on Equity)": get_roe(),
-            "ROA (Return on Assets)": get_roa(),
-            "Payout Ratio": get_payout_ratio(),
-            "PER (Price Earnings Ratio)": get_per(),
-            "Free Cash Flow": get_free_cash_flow(),
-            "Ratio Debt/Equity": get_ratio_equity_debt(),
-        }
-        
-        for indicator, value in indicators.items():
-            st.write(f"{indicator}: {value}")
-
-st.write("--------------------------------------------------------")
+def get_today_stock(snapshot):
+    return str(round(snapshot.price, 2)) + " $"
+
+INDICATORS = {
+    "Today Stock Price": get_today_stock,
+    "Turnover": get_turnover,
+    "Net Turnover": get_net_turnover,
+    "Gross Margin": get_gross_margin,
+    "Net Margin": get_net_margin,
+    "Operating Margin": get_operating_margin,
+    "ROE (Return on Equity)": get_roe,
+    "ROA (Return on Assets)": get_roa,
+    "Payout Ratio": get_payout_ratio,
+    "PER (Price Earnings Ratio)": get_per,
+    "Free Cash Flow": get_free_cash_flow,
+    "Ratio Debt/Equity": get_ratio_equity_debt,
+}
+
+# Compute one indicator, "N/A" when the data it needs could not be fetched
+def safe_indicator(indicator, snapshot):
+    try:
+        return indicator(snapshot)
+    except (KeyError, TypeError, AttributeError, IndexError, ZeroDivisionError):
+        return "N/A"
+
+# All the indicators of one snapshot, by display name
+def compute_indicators(snapshot):
+    return {name: safe_indicator(indicator, snapshot) for name, indicator in INDICATORS.items()}
+
+def main():
+    # Streamlit App Layout
+    st.title("Stocks Consulting")
+    st.write("Welcome to the Stocks Consulting page!")
+    st.write("This page consists of indicators and information about company stocks.")
+    st.write("--------------------------------------------------------")
+
+    ticker = st.text_input('Enter your ticker please:', '')
+
+    if st.button('Get Stock Data'):
+        snapshot = FundamentalsSnapshot.from_data(*request_data(ticker.strip()))
+
+        if snapshot.is_empty():
+            st.error("Failed to retrieve data for the provided ticker.")
+        else:
+            if not snapshot.is_complete():
+                st.warning("Some data could not be retrieved, the related indicators are not available.")
+            indicators = compute_indicators(snapshot)
+
+            for indicator, value in indicators.items():
+                st.write(f"{indicator}: {value}")
+
+            stats = default_fetcher.cache_stats()
+            st.caption(f"Cache: {stats['hits']} hits, {stats['stale_hits']} stale hits, {stats['misses']} misses")
+
+    st.write("--------------------------------------------------------")
+
+if __name__ == "__main__":
+    main()
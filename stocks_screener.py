@@ -0,0 +1,146 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from stocks_consulting import FETCH_POOL, STATEMENT_KEYS, default_fetcher, get_most_recent_report
+
+# Fundamentals screener: loads the cached annual statements of many tickers into one
+# table and computes the ratios of the Stocks Consulting page as vectorized column
+# operations, then filters, sorts and keeps the top N.
+#
+#   python stocks_screener.py --filter "roe > 15 and debt_equity < 80" --sort -roe --top 20
+
+# Fields of the latest report of each statement used by the ratios
+STATEMENT_FIELDS = {
+    'income': ['totalRevenue', 'grossProfit', 'netIncome', 'ebit'],
+    'cash': ['freeCashFlow', 'cashDividendsPaid'],
+    'balance': ['stockholdersEquity', 'totalAssets', 'longTermDebt', 'totalCapitalization'],
+}
+
+RATIO_COLUMNS = [
+    'turnover', 'net_income', 'free_cash_flow', 'gross_margin', 'net_margin', 'operating_margin',
+    'roe', 'roa', 'payout_ratio', 'per', 'debt_equity',
+]
+
+# Fetch the statements of the tickers that are not cached yet, on the shared fetch pool
+def warm_cache(tickers, fetcher=None):
+    fetcher = fetcher or default_fetcher
+    cached = fetcher.cached_statements()
+    futures = [
+        FETCH_POOL.submit(fetcher.fetch_statement, ticker, kind)
+        for ticker in tickers for kind in STATEMENT_KEYS
+        if (ticker.upper(), kind) not in cached
+    ]
+    failed = 0
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            failed += 1
+    return len(futures) - failed, failed
+
+# One row per ticker with the raw fields of its latest statements (NaN when missing)
+def load_statements_table(tickers=None, fetcher=None):
+    fetcher = fetcher or default_fetcher
+    wanted = None if tickers is None else {ticker.upper() for ticker in tickers}
+    records = {}
+    for (ticker, kind), statement in fetcher.cached_statements().items():
+        if wanted is not None and ticker not in wanted:
+            continue
+        report = get_most_recent_report(statement)
+        record = records.setdefault(ticker, {})
+        for field in STATEMENT_FIELDS[kind]:
+            record[field] = report.get(field)
+
+    columns = [field for fields in STATEMENT_FIELDS.values() for field in fields]
+    table = pd.DataFrame.from_dict(records, orient='index', columns=columns)
+    table.index.name = 'ticker'
+    return table.apply(pd.to_numeric, errors='coerce').astype(np.float64)
+
+# a / b * 100, NaN wherever b is zero or missing
+def percent(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return np.divide(a * 100, b, out=np.full(a.shape, np.nan), where=(b != 0) & ~np.isnan(b))
+
+# Every ratio of stocks_consulting for every ticker at once
+def compute_ratios(table):
+    revenue = table['totalRevenue']
+    net_income = table['netIncome']
+    equity = table['stockholdersEquity']
+    dividends = table['cashDividendsPaid'].fillna(0)  # Default to 0 if not found, as on the page
+    ratios = pd.DataFrame({
+        'turnover': revenue,
+        'net_income': net_income,
+        'free_cash_flow': table['freeCashFlow'],
+        'gross_margin': percent(table['grossProfit'], revenue),
+        'net_margin': percent(net_income, revenue),
+        'operating_margin': percent(table['ebit'], revenue),
+        'roe': percent(net_income, equity),
+        'roa': percent(net_income, table['totalAssets']),
+        'payout_ratio': percent(-dividends, net_income),
+        'per': percent(table['totalCapitalization'], net_income),
+        'debt_equity': percent(table['longTermDebt'], equity),
+    }, index=table.index)
+    return ratios
+
+# Filter with a DataFrame.query expression, sort by comma separated columns ('-' for
+# descending, e.g. "-roe,debt_equity") and keep the first `top` rows
+def screen(ratios, filter_expression=None, sort=None, top=None):
+    if filter_expression:
+        ratios = ratios.query(filter_expression)
+    if sort:
+        keys = [key.strip() for key in sort.split(',') if key.strip()]
+        columns = [key.lstrip('-') for key in keys]
+        unknown = [column for column in columns if column not in ratios.columns]
+        if unknown:
+            raise ValueError(f"Unknown sort columns: {unknown}")
+        ratios = ratios.sort_values(columns, ascending=[not key.startswith('-') for key in keys], na_position='last')
+    if top:
+        ratios = ratios.head(top)
+    return ratios
+
+def read_tickers(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank and filter tickers by fundamentals ratios.")
+    parser.add_argument('--tickers', help="file with one ticker per line, all cached tickers by default")
+    parser.add_argument('--fetch', action='store_true', help="fetch the statements of tickers missing from the cache")
+    parser.add_argument('--filter', help="filter expression, e.g. \"roe > 15 and payout_ratio < 60\"")
+    parser.add_argument('--sort', help="sort columns, '-' prefix for descending, e.g. \"-roe\"")
+    parser.add_argument('--top', type=int, help="number of tickers to keep")
+    parser.add_argument('--csv', action='store_true', help="print CSV instead of a table")
+    args = parser.parse_args(argv)
+
+    tickers = read_tickers(args.tickers) if args.tickers else None
+    if args.fetch:
+        if tickers is None:
+            parser.error("--fetch needs --tickers")
+        fetched, failed = warm_cache(tickers)
+        print(f"Fetched {fetched} statements ({failed} failed)", file=sys.stderr)
+
+    start = time.perf_counter()
+    table = load_statements_table(tickers)
+    loaded = time.perf_counter()
+    try:
+        result = screen(compute_ratios(table), args.filter, args.sort, args.top)
+    except (ValueError, KeyError, SyntaxError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    done = time.perf_counter()
+
+    if args.csv:
+        result.to_csv(sys.stdout, float_format='%.4f')
+    else:
+        print(result.round(2).to_string())
+    print(f"Screened {len(table)} tickers: loaded in {loaded - start:.3f}s, "
+          f"ratios and screen in {done - loaded:.3f}s, {len(result)} kept", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
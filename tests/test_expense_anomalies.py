@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from expense_anomalies import (MIN_PERIODS, AnomalyDetector, detect_anomalies, robust_zscores,
+                               rolling_zscores)
+from personal_finance import month_history
+
+CATEGORIES = ['fixed', 'outing', 'groceries']
+
+
+# Spending of `users` over `months` months around a usual amount per category, the
+# first `missing[user]` months of each user being before their first statement (NaN)
+def make_series(users=4, months=20, missing=(0, 3, 10, 17), seed=0):
+    rng = np.random.default_rng(seed)
+    usual = np.array([800.0, 120.0, 300.0])
+    series = usual * rng.uniform(0.8, 1.2, size=(users, months, len(CATEGORIES)))
+    series[rng.random(series.shape) < 0.1] = 0.0  # Some months without spending in a category
+    for user, count in enumerate(missing):
+        series[user, :count] = np.nan
+    return series
+
+
+class RollingZscoreTests(unittest.TestCase):
+    def test_detector_matches_rolling_zscores(self):
+        series = make_series()
+        expected = rolling_zscores(series, window=6)
+        detector = AnomalyDetector(CATEGORIES, window=6, batch_shape=(series.shape[0],))
+        for month in range(series.shape[1]):
+            z, flags = detector.update(series[:, month])
+            np.testing.assert_allclose(z, expected[:, month], equal_nan=True)
+            np.testing.assert_array_equal(flags, detect_anomalies(series, window=6)[:, month])
+
+    def test_detector_started_from_a_history(self):
+        series = make_series(users=1, missing=(0,))[0]
+        detector = AnomalyDetector(CATEGORIES, history=series[:-1])
+        z, _ = detector.update(series[-1])
+        np.testing.assert_allclose(z, rolling_zscores(series)[-1])
+
+    def test_planted_spike_is_flagged(self):
+        series = make_series()
+        series[0, 15, 1] = 2000.0
+        flags = detect_anomalies(series)
+        self.assertEqual(list(zip(*np.nonzero(flags))), [(0, 15, 1)])
+        detector = AnomalyDetector(CATEGORIES, history=series[0, :15])
+        self.assertEqual([category for category, *_ in detector.explain(series[0, 15])], ['outing'])
+
+    def test_short_history_is_not_flagged(self):
+        series = make_series()
+        series[3, 17 + MIN_PERIODS - 1, 1] = 5000.0  # Only MIN_PERIODS - 1 months of history before it
+        self.assertFalse(detect_anomalies(series)[3].any())
+        z = robust_zscores(series[3, 17:17 + MIN_PERIODS - 1], series[3, 17 + MIN_PERIODS - 1])
+        self.assertTrue(np.isnan(z).all())
+
+    def test_months_without_spending_count_as_zero(self):
+        monthly = pd.DataFrame({'outing': [100.0, 110.0, 90.0]}, index=['2024-01', '2024-03', '2024-06'])
+        history = month_history(monthly, '2024-06')
+        self.assertEqual(list(history.index), ['2024-01', '2024-02', '2024-03', '2024-04', '2024-05'])
+        self.assertEqual(history['outing'].tolist(), [100.0, 0.0, 110.0, 0.0, 0.0])
+        self.assertTrue(month_history(monthly, '2024-01').empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,370 @@
+import os
+import re
+import time
+import tempfile
+import threading
+import unittest
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from financial_articles import (NLTK_DATA, ArticleScraper, ArticleStore, BM25Index, RetrievalIndex, count_words,
+                                lemma_tokens, lemmatize_word, make_session, preprocess_chunk, preprocess_documents,
+                                preprocess_text, refresh_corpus, scrape_article_links, scrape_articles)
+
+
+def news_page(*links):
+    items = ''.join(f'<li class="js-stream-content"><h3>{link}</h3><a href="{link}">read</a></li>' for link in links)
+    return f'<html><body><ul>{items}</ul></body></html>'
+
+
+def article_page(*paragraphs):
+    return '<html><body>' + ''.join(f'<p>{paragraph}</p>' for paragraph in paragraphs) + '</body></html>'
+
+
+# Serves `pages` ({path: html}) from 127.0.0.1, answering 404 for other paths, after
+# `delays` ({path: seconds}), and records the requests and the peak concurrency.
+# Pages with an entry in `etags` answer 304 to a matching If-None-Match.
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, pages, delays=None, etags=None):
+        super().__init__(('127.0.0.1', 0), FixtureHandler)
+        self.pages = dict(pages)
+        self.delays = dict(delays or {})
+        self.etags = dict(etags or {})
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        pass  # Clients that timed out hang up before the page is written
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delays.get(self.path, 0))
+            page, etag = server.pages.get(self.path), server.etags.get(self.path)
+            if page is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            if etag is not None and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = page.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            if etag is not None:
+                self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+# Scraper without retries or proxies, so failures show up at once
+def make_scraper(**kwargs):
+    session = make_session(retries=0)
+    session.trust_env = False
+    return ArticleScraper(session=session, **kwargs)
+
+
+class ArticleScraperTests(unittest.TestCase):
+    def test_scrape_articles_from_news_pages(self):
+        pages = {
+            '/news/': news_page('/a1', '/a2', '/missing'),
+            '/markets/': news_page('/a2', '/a3'),
+            '/a1': article_page('Rates', 'Bonds'),
+            '/a2': article_page('Stocks'),
+            '/a3': article_page('Gold'),
+        }
+        with FixtureServer(pages) as server:
+            scraper = make_scraper()
+            links = scrape_article_links(server.url, ['/news/', '/markets/', '/gone/'], scraper)
+            self.assertEqual(links, [server.url + path for path in ('/a1', '/a2', '/missing', '/a3')])
+            articles = scrape_articles(server.url, ['/news/', '/markets/'], scraper)
+        self.assertEqual(articles, ['rates.bonds', 'stocks', 'gold'])
+
+    def test_requests_per_host_are_bounded(self):
+        paths = [f'/a{i}' for i in range(12)]
+        pages = {path: article_page(path) for path in paths}
+        with FixtureServer(pages, delays=dict.fromkeys(paths, 0.05)) as server:
+            scraper = make_scraper(max_workers=8, per_host=3)
+            results = scraper.scrape_all([server.url + path for path in paths])
+        self.assertEqual(results, paths)
+        self.assertLessEqual(server.max_in_flight, 3)
+        self.assertGreater(server.max_in_flight, 1)
+
+    def test_slow_page_times_out_without_blocking_the_others(self):
+        pages = {'/slow': article_page('late'), '/fast': article_page('early')}
+        with FixtureServer(pages, delays={'/slow': 2.0}) as server:
+            scraper = make_scraper(timeout=(1, 0.3))
+            start = time.monotonic()
+            results = scraper.scrape_all([server.url + '/slow', server.url + '/fast'])
+            elapsed = time.monotonic() - start
+        self.assertEqual(results, ['early'])
+        self.assertLess(elapsed, 1.5)
+
+    def test_unreachable_host_is_skipped(self):
+        scraper = make_scraper(timeout=(0.5, 0.5))
+        self.assertIsNone(scraper.fetch('http://127.0.0.1:9/'))
+        self.assertEqual(scraper.scrape_all(['http://127.0.0.1:9/']), [])
+
+
+# Preprocessing stand-in that records the texts it is given
+class RecordingPreprocess:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [text.upper() for text in texts]
+
+
+class RefreshCorpusTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ArticleStore(os.path.join(directory.name, 'data', 'articles.sqlite3'))
+        self.preprocess = RecordingPreprocess()
+        self.server = FixtureServer({
+            '/news/': news_page('/a1', '/a2', '/a3'),
+            '/a1': article_page('The central bank kept its rates unchanged this month'),
+            '/a2': article_page('Tech stocks rallied after strong quarterly earnings'),
+            '/a3': article_page('Gold prices climbed as the dollar weakened'),
+        }, etags={'/a1': '"v1"', '/a2': '"v1"'})
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def refresh(self, **kwargs):
+        return refresh_corpus(self.store, self.preprocess, self.server.url, ['/news/'], make_scraper(), **kwargs)
+
+    def requests_of(self, path):
+        return [headers for request_path, headers in self.server.requests if request_path == path]
+
+    def test_first_refresh_stores_every_article(self):
+        stats = self.refresh()
+        self.assertEqual((stats['new'], stats['changed'], stats['unchanged'], stats['failed']), (3, 0, 0, 0))
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(len(self.preprocess.calls), 1)
+        self.assertIn('THE CENTRAL BANK KEPT ITS RATES UNCHANGED THIS MONTH', self.store.documents())
+        self.assertIn(('the central bank kept its rates unchanged this month',
+                       'THE CENTRAL BANK KEPT ITS RATES UNCHANGED THIS MONTH'), self.store.articles())
+
+    def test_unchanged_articles_are_not_downloaded_or_preprocessed_again(self):
+        self.refresh()
+        stats = self.refresh()
+        self.assertEqual((stats['new'], stats['changed'], stats['unchanged']), (0, 0, 3))
+        self.assertEqual(len(self.preprocess.calls), 1)
+        # Conditional request answered 304 for the pages with an ETag, content hash
+        # comparison for the page without
+        self.assertEqual(self.requests_of('/a1')[-1].get('If-None-Match'), '"v1"')
+        self.assertNotIn('If-None-Match', self.requests_of('/a3')[-1])
+
+    def test_changed_article_is_preprocessed_alone(self):
+        self.refresh()
+        self.server.pages['/a2'] = article_page('Tech stocks fell after weak guidance from chip makers')
+        self.server.etags['/a2'] = '"v2"'
+        stats = self.refresh()
+        self.assertEqual((stats['new'], stats['changed'], stats['unchanged']), (0, 1, 2))
+        self.assertEqual(self.preprocess.calls[-1], ['tech stocks fell after weak guidance from chip makers'])
+        self.assertIn('TECH STOCKS FELL AFTER WEAK GUIDANCE FROM CHIP MAKERS', self.store.documents())
+        self.assertEqual(self.store.validators()[self.server.url + '/a2']['etag'], '"v2"')
+
+    def test_near_duplicate_is_left_out_of_the_corpus(self):
+        self.refresh()
+        self.server.pages['/news/'] = news_page('/a1', '/a2', '/a3', '/a4')
+        self.server.pages['/a4'] = article_page('Gold prices climbed as the dollar weakened')
+        stats = self.refresh()
+        self.assertEqual((stats['new'], stats['duplicates']), (1, 1))
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(len(self.store.documents()), 3)
+
+    def test_new_preprocess_version_reprocesses_the_store(self):
+        self.refresh(preprocess_version=1)
+        self.assertEqual(self.refresh(preprocess_version=1)['reprocessed'], 0)
+        stats = self.refresh(preprocess_version=2)
+        self.assertEqual(stats['reprocessed'], 3)
+        self.assertEqual(self.store.preprocess_version(), 2)
+
+
+# Word counter that also counts a line break as a token and records what it measured
+class CountingTokens:
+    def __init__(self):
+        self.measured = []
+
+    def __call__(self, text):
+        self.measured.append(text)
+        return count_words(text) + text.count('\n')
+
+
+class BM25IndexTests(unittest.TestCase):
+    def test_best_passages_first(self):
+        index = BM25Index(['bond yields rose', 'gold prices fell', 'gold and bond markets'])
+        self.assertEqual([position for position, _ in index.search('gold prices', k=3)], [1, 2])
+        self.assertEqual(index.build_context('gold prices', 100), 'gold prices fell\n\ngold and bond markets')
+
+    def test_separators_count_against_the_budget(self):
+        index = BM25Index(['gold prices fell today', 'gold prices rose later'])
+        self.assertEqual(index.build_context('gold', 10, CountingTokens()),
+                         'gold prices fell today\n\ngold prices rose later')
+        # Two passages of 4 words fit in 9 tokens, but not with the 2 line breaks between them
+        self.assertEqual(index.build_context('gold', 9, CountingTokens()), 'gold prices fell today')
+
+    def test_stops_measuring_once_nothing_else_fits(self):
+        passages = [f'gold market update number {i} ' + 'filler ' * 20 for i in range(500)]
+        index = BM25Index(passages)
+        count_tokens = CountingTokens()
+        context = index.build_context('gold market', 60, count_tokens)
+        self.assertEqual(len(context.split('\n\n')), 2)
+        self.assertLess(len(count_tokens.measured), 5)
+
+    def test_best_passage_too_long_is_truncated(self):
+        index = BM25Index(['gold ' + 'word ' * 50, 'silver'])
+        self.assertEqual(index.build_context('gold', 3), 'gold word word')
+
+
+class RetrievalIndexTests(unittest.TestCase):
+    def test_search_finds_the_most_similar_document(self):
+        index = RetrievalIndex.fit(['central bank interest rates', 'tech stocks earnings', 'gold prices dollar'])
+        self.assertEqual(index.search('why did gold prices rise', k=1)[0][0], 2)
+        self.assertEqual([position for position, _ in index.search('stocks earnings', k=3)][0], 1)
+
+    def test_corpus_without_vocabulary_has_no_results(self):
+        for documents in ([], ['', '   '], ['the and of', 'it is']):
+            index = RetrievalIndex.fit(documents)
+            self.assertIsNone(index.matrix)
+            self.assertEqual(index.search('interest rates'), [])
+            self.assertEqual(index.build_context('interest rates', 100), '')
+
+
+
+def has_nltk_data():
+    import nltk
+    try:
+        for resource, _ in NLTK_DATA:
+            nltk.data.find(resource)
+    except LookupError:
+        return False
+    return True
+
+
+# WordNet stand-in that drops a plural "s" and records the words it looks up
+class SuffixLemmatizer:
+    def __init__(self):
+        self.lookups = []
+
+    def lemmatize(self, word):
+        self.lookups.append(word)
+        return word[:-1] if len(word) > 3 and word.endswith('s') else word
+
+
+# Preprocess with stand-ins for the NLTK data, which is not always installed: words
+# and punctuation are split by a regular expression and lemmatized by SuffixLemmatizer
+@contextmanager
+def fake_nltk():
+    lemmatizer = SuffixLemmatizer()
+    lemmatize_word.cache_clear()
+    try:
+        with mock.patch('financial_articles.ensure_nltk_data'), \
+                mock.patch('financial_articles.get_lemmatizer', return_value=lemmatizer), \
+                mock.patch('nltk.tokenize.word_tokenize', lambda text: re.findall(r"\w+|[^\w\s]", text)):
+            yield lemmatizer
+    finally:
+        lemmatize_word.cache_clear()
+
+
+# Run on the process pool by the tests: tags each text with the process and the
+# MARKER it sees, which a spawned worker imports afresh
+MARKER = 'imported'
+
+
+def tag_chunk(texts):
+    return [f"{text}|{os.getpid()}|{MARKER}" for text in texts]
+
+
+class PreprocessingTests(unittest.TestCase):
+    def test_word_level_lemmatization(self):
+        with fake_nltk():
+            self.assertEqual(preprocess_text("Tech stocks fell, rates rose."), "Tech stock fell , rate rose .")
+            self.assertEqual(lemma_tokens("Why were the stocks and the rates falling?"), ['stock', 'rate', 'falling'])
+
+    def test_lemmas_are_memoized(self):
+        with fake_nltk() as lemmatizer:
+            preprocess_chunk(["stocks and rates", "stocks, stocks and Stocks"])
+            self.assertEqual(lemmatizer.lookups, ['stocks', 'and', 'rates', ',', 'stocks'])
+            self.assertEqual(lemmatize_word.cache_info().hits, 3)
+
+    @unittest.skipUnless(has_nltk_data(), "the NLTK data is not installed")
+    def test_wordnet_lemmatization(self):
+        lemmatize_word.cache_clear()
+        self.assertEqual(preprocess_text("Stocks, rates and prices"), "stock , rate and price")
+
+    def test_chunked_pool_output_is_in_input_order(self):
+        texts = [f"text {i}" for i in range(23)]
+        results = preprocess_documents(texts, workers=3, chunk_size=4, preprocess=tag_chunk)
+        self.assertEqual([result.split('|')[0] for result in results], texts)
+        self.assertNotIn(str(os.getpid()), {result.split('|')[1] for result in results})
+        with fake_nltk():
+            self.assertEqual(preprocess_documents(["Rates rose", "Stocks fell"], workers=1),
+                             ["rate rose", "stock fell"])
+
+    def test_workers_are_spawned_not_forked(self):
+        # A forked worker would see the MARKER of this process, a spawned one imports it
+        with mock.patch(f'{__name__}.MARKER', 'set in the parent'):
+            pooled = preprocess_documents(['a', 'b', 'c'], workers=2, chunk_size=1, preprocess=tag_chunk)
+            inline = preprocess_documents(['a'], workers=2, preprocess=tag_chunk)
+        self.assertEqual({result.split('|')[2] for result in pooled}, {'imported'})
+        self.assertEqual(inline, [f"a|{os.getpid()}|set in the parent"])  # One chunk runs in this process
+
+
+class RawPassageTests(unittest.TestCase):
+    def setUp(self):
+        self.raw = ['the central bank kept its rates unchanged.it expects inflation to slow',
+                    'tech stocks rallied after strong quarterly earnings.chip makers led the gains']
+
+    def test_passages_come_from_the_raw_articles(self):
+        with fake_nltk():
+            index = RetrievalIndex.fit(preprocess_chunk(self.raw), self.raw)
+            self.assertEqual(index.search(preprocess_text('Which stocks rallied?'), k=1)[0][0], 1)
+            self.assertEqual(index.build_context('Why did the stock rally?', 100), self.raw[1])
+            self.assertEqual(index.build_context('rate decision', 100), self.raw[0])
+        self.assertEqual(index.raw_documents, self.raw)
+        self.assertNotEqual(index.documents, self.raw)
+
+    def test_without_raw_documents_the_documents_are_the_passages(self):
+        index = RetrievalIndex.fit(self.raw)
+        self.assertEqual(index.raw_documents, self.raw)
+        self.assertEqual(index.build_context('stocks', 100), self.raw[1])
+        self.assertEqual(index.build_context('stock', 100), '')  # Not lemmatized
+
+
+if __name__ == '__main__':
+    unittest.main()
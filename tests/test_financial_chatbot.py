@@ -0,0 +1,460 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from Financial_chatbot import (CONTEXT_TOKEN_BUDGET, GENERATION_PARAMS, MODEL_NAME, AnswerCache, BatchStreamer,
+                               InferenceWorker, ModelRegistry, WorkerOverloaded, answer_question, build_prompt,
+                               get_best_article, get_best_context, stream_answer)
+from financial_articles import RetrievalIndex, count_words, preprocess_chunk
+from tests.test_financial_articles import fake_nltk
+
+try:
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast, TextIteratorStreamer
+except ImportError:
+    torch = None
+
+WORDS = ("the central bank kept interest rates unchanged while inflation slowed and stocks rallied on strong "
+         "earnings gold prices climbed as the dollar weakened bond yields fell investors bought tech shares "
+         "what why did how will").split()
+
+
+# Registry of an already loaded (tokenizer, model)
+class LoadedRegistry:
+    def __init__(self, tokenizer, model):
+        self.tokenizer = tokenizer
+        self.model = model
+
+    def get(self):
+        return self.tokenizer, self.model
+
+    def is_ready(self):
+        return True
+
+
+# Registry whose loads take `delay` seconds and count how often they ran; the first
+# `failures` loads raise
+class SlowRegistry(ModelRegistry):
+    def __init__(self, delay=0.1, failures=0):
+        super().__init__()
+        self.delay = delay
+        self.failures = failures
+        self.loads = []
+        self.count_lock = threading.Lock()
+
+    def _load(self, name, device_map, torch_dtype, quantize=""):
+        with self.count_lock:
+            self.loads.append(name)
+            failed = len(self.loads) <= self.failures
+        time.sleep(self.delay)
+        if failed:
+            raise OSError(f"could not load {name}")
+        return f"tokenizer of {name}", f"model {name}"
+
+
+class ModelRegistryTests(unittest.TestCase):
+    def test_concurrent_calls_load_the_model_once(self):
+        registry = SlowRegistry()
+        results = []
+        barrier = threading.Barrier(9)
+
+        def ask():
+            barrier.wait()
+            results.append(registry.get('tiny'))
+
+        threads = [threading.Thread(target=ask) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        warm_up = registry.warm_up('tiny')
+        for thread in threads:
+            thread.join()
+        self.assertEqual(warm_up.result(timeout=5), ('tokenizer of tiny', 'model tiny'))
+        self.assertEqual(results, [('tokenizer of tiny', 'model tiny')] * 8)
+        self.assertEqual(registry.loads, ['tiny'])
+        self.assertTrue(registry.is_ready('tiny'))
+        # Other settings are another model
+        registry.get('tiny', device_map='cpu')
+        self.assertEqual(registry.loads, ['tiny', 'tiny'])
+
+    def test_warm_up_loads_in_the_background(self):
+        registry = SlowRegistry(delay=0.3)
+        start = time.monotonic()
+        future = registry.warm_up('tiny')
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertFalse(registry.is_ready('tiny'))
+        self.assertEqual(registry.get('tiny'), ('tokenizer of tiny', 'model tiny'))
+        self.assertTrue(future.done())
+        self.assertIs(registry.warm_up('tiny'), future)
+        self.assertEqual(registry.loads, ['tiny'])
+
+    def test_failed_load_is_retried(self):
+        registry = SlowRegistry(delay=0.01, failures=1)
+        future = registry.warm_up('tiny')
+        with self.assertRaises(OSError):
+            future.result(timeout=5)
+        self.assertFalse(registry.is_ready('tiny'))
+        self.assertEqual(registry.get('tiny'), ('tokenizer of tiny', 'model tiny'))
+        self.assertEqual(len(registry.loads), 2)
+        self.assertTrue(registry.is_ready('tiny'))
+
+
+class AnswerCacheTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache', 'answers.sqlite3')
+
+    def test_key_normalizes_the_question(self):
+        key = AnswerCache.key("What did the bank do?", "context", "model", {'max_new_tokens': 4})
+        self.assertEqual(AnswerCache.key("  what did   the BANK do ", "context", "model", {'max_new_tokens': 4}), key)
+        for other in (("what did the bank say", "context", "model", {'max_new_tokens': 4}),
+                      ("what did the bank do", "other context", "model", {'max_new_tokens': 4}),
+                      ("what did the bank do", "context", "other model", {'max_new_tokens': 4}),
+                      ("what did the bank do", "context", "model", {'max_new_tokens': 8})):
+            self.assertNotEqual(AnswerCache.key(*other), key)
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = AnswerCache(ttl=0.2, path=self.path)
+        cache.put('a', "rates were kept")
+        self.assertEqual(cache.get('a'), "rates were kept")
+        time.sleep(0.3)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(AnswerCache(ttl=0.2, path=self.path).get('a'))
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 1})
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = AnswerCache(max_entries=2)
+        cache.put('a', "A")
+        cache.put('b', "B")
+        self.assertEqual(cache.get('a'), "A")  # Now more recently used than b
+        cache.put('c', "C")
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ("A", "C"))
+        self.assertEqual(list(cache._memory), ['a', 'c'])
+
+    def test_disk_tier_survives_a_new_instance(self):
+        AnswerCache(path=self.path).put('a', "rates were kept")
+        cache = AnswerCache(path=self.path)
+        self.assertEqual(cache.get('a'), "rates were kept")
+        self.assertIn('a', cache._memory)  # Promoted to the memory tier
+        self.assertIsNone(cache.get('b'))
+
+        # An entry evicted from memory is still served from disk
+        small = AnswerCache(max_entries=1, path=self.path)
+        small.put('b', "B")
+        small.put('c', "C")
+        self.assertNotIn('b', small._memory)
+        self.assertEqual(small.get('b'), "B")
+
+    def test_disk_tier_is_bounded(self):
+        cache = AnswerCache(path=self.path, max_disk_entries=2)
+        for key in 'abc':
+            cache.put(key, key.upper())
+            time.sleep(0.01)
+        conn = sqlite3.connect(self.path)
+        try:
+            self.assertEqual(sorted(row[0] for row in conn.execute("SELECT key FROM answers")), ['b', 'c'])
+        finally:
+            conn.close()
+
+    def test_hit_rate(self):
+        cache = AnswerCache(path=self.path)
+        self.assertEqual(cache.hit_rate(), 0.0)
+        cache.put('a', "A")
+        for key in ('a', 'a', 'b', 'a'):
+            cache.get(key)
+        self.assertEqual(cache.stats, {'hits': 3, 'misses': 1})
+        self.assertEqual(cache.hit_rate(), 0.75)
+
+
+# Registry whose get() waits for `released`, to hold the worker on its current batch
+class BlockingRegistry(LoadedRegistry):
+    def __init__(self, tokenizer, model):
+        super().__init__(tokenizer, model)
+        self.released = threading.Event()
+
+    def get(self):
+        self.released.wait(10)
+        return super().get()
+
+
+# Tiny randomly initialised GPT-2 with a word level tokenizer, nothing is downloaded
+def make_tiny_model():
+    vocab = {word: i for i, word in enumerate(['<eos>', '<unk>'] + sorted(set(WORDS)))}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token='<unk>'))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token='<eos>', unk_token='<unk>')
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=len(vocab), n_positions=1024, n_embd=32, n_layer=2, n_head=2,
+                        bos_token_id=0, eos_token_id=0)
+    return tokenizer, GPT2LMHeadModel(config).eval()
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class GenerationBudgetTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer, cls.model = make_tiny_model()
+        cls.eos = cls.tokenizer.eos_token_id
+        cls.not_eos = [i for i in range(len(cls.tokenizer)) if i != cls.eos]
+        cls.special = [cls.eos, cls.tokenizer.unk_token_id]  # Decoded as nothing
+
+    def setUp(self):
+        self.registry = LoadedRegistry(self.tokenizer, self.model)
+        self.worker = InferenceWorker(self.registry, max_wait=0.2)
+        self.cache = AnswerCache()
+
+    def answer(self, question, generation_params, context="the central bank kept interest rates unchanged"):
+        return answer_question(question, context, self.registry, cache=self.cache,
+                               generation_params=generation_params, worker=self.worker)
+
+    # Cached answer of a question, None when it was not kept
+    def cached(self, question, generation_params, context="the central bank kept interest rates unchanged"):
+        params = dict(GENERATION_PARAMS, **generation_params, token_budget=CONTEXT_TOKEN_BUDGET)
+        return self.cache._memory.get(AnswerCache.key(question, context, MODEL_NAME, params))
+
+    def test_answer_at_the_token_budget_is_cached(self):
+        params = {'max_new_tokens': 4, 'suppress_tokens': self.special}
+        answer = self.answer("what did the bank do", params)
+        self.assertEqual(len(answer.split()), 4)
+        self.assertEqual(self.cached("what did the bank do", params)[0], answer)
+
+    def test_answer_cut_by_the_time_budget_is_not_cached(self):
+        params = {'max_new_tokens': 50, 'max_time': 1e-6, 'suppress_tokens': self.special}
+        answer = self.answer("what did the bank do", params)
+        self.assertTrue(answer)
+        self.assertIsNone(self.cached("what did the bank do", params))
+
+    def test_empty_answer_is_not_cached(self):
+        params = {'max_new_tokens': 4, 'suppress_tokens': self.not_eos}
+        answer = self.answer("what did the bank do", params)
+        self.assertEqual(answer, "")
+        self.assertIsNone(self.cached("what did the bank do", params))
+
+    def test_stop_reasons(self):
+        prompt = "the central bank kept interest rates"
+        for params, reason in (({'max_new_tokens': 3, 'suppress_tokens': self.special}, 'max_new_tokens'),
+                               ({'max_new_tokens': 30, 'max_time': 1e-6, 'suppress_tokens': self.special}, 'max_time'),
+                               ({'max_new_tokens': 3, 'suppress_tokens': self.not_eos}, 'eos')):
+            generation = self.worker.submit(prompt, params).result()
+            self.assertEqual(generation.stop_reason, reason)
+            self.assertEqual(generation.complete, reason != 'max_time')
+
+    def test_batched_prompts_report_their_own_stop_reason(self):
+        params = {'max_new_tokens': 3, 'suppress_tokens': self.special}
+        futures = [self.worker.submit(prompt, params) for prompt in ("gold prices", "bond yields fell and")]
+        generations = [future.result() for future in futures]
+        self.assertEqual(self.worker.stats['batches'], 1)
+        self.assertEqual([generation.stop_reason for generation in generations], ['max_new_tokens'] * 2)
+        self.assertEqual([generation.tokens for generation in generations], [3, 3])
+
+    def test_stream_without_text_has_no_first_token(self):
+        metrics = {}
+        params = {'max_new_tokens': 4, 'suppress_tokens': self.not_eos}
+        pieces = list(stream_answer("what did the bank do", "the central bank kept interest rates unchanged",
+                                    self.registry, cache=self.cache, generation_params=params, worker=self.worker,
+                                    metrics=metrics))
+        self.assertEqual("".join(pieces).strip(), "")
+        self.assertIsNone(metrics['time_to_first_token'])
+        self.assertEqual(metrics['stop_reason'], 'eos')
+        self.assertIsNone(self.cached("what did the bank do", params))
+
+    def test_streamed_answer_is_cached_when_complete(self):
+        metrics = {}
+        params = {'max_new_tokens': 4, 'suppress_tokens': self.special}
+        answer = "".join(stream_answer("what did the bank do", "the central bank kept interest rates unchanged",
+                                       self.registry, cache=self.cache, generation_params=params,
+                                       worker=self.worker, metrics=metrics)).strip()
+        self.assertIsNotNone(metrics['time_to_first_token'])
+        self.assertEqual(metrics['tokens'], 4)
+        self.assertEqual(self.cached("what did the bank do", params)[0], answer)
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class InferenceWorkerTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer, cls.model = make_tiny_model()
+        cls.special = [cls.tokenizer.eos_token_id, cls.tokenizer.unk_token_id]
+
+    def params(self, max_new_tokens):
+        return {'max_new_tokens': max_new_tokens, 'suppress_tokens': self.special}
+
+    def test_full_queue_refuses_new_prompts(self):
+        registry = BlockingRegistry(self.tokenizer, self.model)
+        worker = InferenceWorker(registry, max_batch_size=1, max_wait=0, max_queue_size=2)
+        futures = [worker.submit("gold prices", self.params(2))]
+        for _ in range(100):  # The worker takes the first prompt and waits for the model
+            if worker.queue_depth() == 0:
+                break
+            time.sleep(0.01)
+        futures += [worker.submit("bond yields", self.params(2)) for _ in range(2)]
+        with self.assertRaises(WorkerOverloaded):
+            worker.submit("tech shares", self.params(2))
+        self.assertEqual((worker.stats['rejected'], worker.stats['max_queue_depth']), (1, 2))
+
+        registry.released.set()
+        self.assertEqual([future.result(timeout=10).tokens for future in futures], [2, 2, 2])
+        self.assertEqual(worker.stats['submitted'], 3)
+        worker.submit("tech shares", self.params(2)).result(timeout=10)  # Room again once drained
+
+    def test_only_prompts_with_the_same_parameters_are_batched(self):
+        registry = BlockingRegistry(self.tokenizer, self.model)
+        worker = InferenceWorker(registry, max_wait=0.3)
+        futures = [worker.submit(prompt, self.params(2)) for prompt in ("gold prices", "bond yields fell", "stocks")]
+        futures.append(worker.submit("gold prices", self.params(3)))
+        futures.append(worker.submit("the dollar", self.params(2)))
+        registry.released.set()
+        self.assertEqual([future.result(timeout=10).tokens for future in futures], [2, 2, 2, 3, 2])
+        self.assertEqual(worker.stats['batches'], 2)
+        self.assertEqual(worker.stats['max_batch_size'], 4)
+        self.assertEqual(worker.mean_batch_size(), 2.5)
+
+    def test_batch_size_is_bounded(self):
+        registry = BlockingRegistry(self.tokenizer, self.model)
+        worker = InferenceWorker(registry, max_batch_size=2, max_wait=0.3)
+        futures = [worker.submit("gold prices", self.params(1)) for _ in range(5)]
+        registry.released.set()
+        for future in futures:
+            future.result(timeout=10)
+        self.assertEqual((worker.stats['batches'], worker.stats['max_batch_size']), (3, 2))
+
+    def test_first_prompt_waits_at_most_max_wait_for_others(self):
+        worker = InferenceWorker(LoadedRegistry(self.tokenizer, self.model), max_wait=0.3)
+        start = time.monotonic()
+        first = worker.submit("gold prices", self.params(1))
+        time.sleep(0.1)
+        second = worker.submit("bond yields", self.params(1))  # Within the window, same batch
+        first.result(timeout=10)
+        second.result(timeout=10)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(worker.stats['batches'], 1)
+
+        # A prompt arriving after the window goes in the next batch
+        worker = InferenceWorker(LoadedRegistry(self.tokenizer, self.model), max_wait=0.05)
+        first = worker.submit("gold prices", self.params(1))
+        time.sleep(0.3)
+        second = worker.submit("bond yields", self.params(1))
+        first.result(timeout=10)
+        second.result(timeout=10)
+        self.assertEqual(worker.stats['batches'], 2)
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class StreamedBatchTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer, cls.model = make_tiny_model()
+        cls.params = {'max_new_tokens': 3, 'suppress_tokens': [cls.tokenizer.eos_token_id, cls.tokenizer.unk_token_id]}
+
+    def test_streamed_prompts_are_batched_with_the_others(self):
+        prompts = ["gold prices", "bond yields fell while", "tech shares"]
+        worker = InferenceWorker(LoadedRegistry(self.tokenizer, self.model), max_wait=0.3)
+        first, first_future = worker.submit_stream(prompts[0], self.params, timeout=10)
+        second, second_future = worker.submit_stream(prompts[1], self.params, timeout=10)
+        third = worker.submit(prompts[2], self.params)
+        streamed = ["".join(first).strip(), "".join(second).strip()]
+        generations = [first_future.result(), second_future.result(), third.result()]
+        self.assertEqual((worker.stats['batches'], worker.stats['max_batch_size']), (1, 3))
+        self.assertEqual([generation.text is None for generation in generations], [True, True, False])
+        self.assertEqual([generation.tokens for generation in generations], [3, 3, 3])
+
+        # Each stream gets the text of its own row, as the same batch generated without streaming
+        plain = InferenceWorker(LoadedRegistry(self.tokenizer, self.model), max_wait=0.3)
+        futures = [plain.submit(prompt, self.params) for prompt in prompts]
+        texts = [future.result().text.strip() for future in futures]
+        self.assertEqual(plain.stats['batches'], 1)
+        self.assertEqual(streamed, texts[:2])
+        self.assertEqual(generations[2].text.strip(), texts[2])
+
+    def test_each_stream_ends_at_its_own_eos(self):
+        def ids(text):
+            return self.tokenizer(text)['input_ids']
+
+        eos = self.tokenizer.eos_token_id
+        streamers = [TextIteratorStreamer(self.tokenizer, skip_prompt=True, timeout=1, skip_special_tokens=True)
+                     for _ in range(2)]
+        batch = BatchStreamer([streamers[0], None, streamers[1]], {eos})
+        batch.put(torch.tensor([ids("gold prices"), ids("bond yields"), [eos] + ids("stocks")]))
+        for step in (["the", "gold", "bank"], [eos, "rallied", "kept"], [eos, eos, "rates"]):
+            batch.put(torch.tensor([token if token == eos else ids(token)[0] for token in step]))
+        # The first row ended at its EOS, before the end of the batch
+        self.assertEqual("".join(streamers[0]).strip(), "the")
+        batch.end()
+        self.assertEqual("".join(streamers[1]).strip(), "bank kept rates")
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class ContextPrefixTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer, cls.model = make_tiny_model()
+        # Sections on different topics, so each question has its own best passages
+        sections = ["gold prices climbed as the dollar weakened", "the central bank kept interest rates unchanged",
+                    "tech shares rallied on strong earnings", "bond yields fell while inflation slowed"]
+        cls.context = ' '.join(' '.join([section] * 25) for section in sections)
+
+    def test_each_question_gets_its_own_passages(self):
+        _, gold = build_prompt("why did gold prices climb", self.context, self.tokenizer, 60)
+        _, bank = build_prompt("what will the central bank do", self.context, self.tokenizer, 60)
+        self.assertIn("gold prices climbed", gold)
+        self.assertNotIn("central bank", gold)
+        self.assertIn("central bank", bank)
+        self.assertNotIn("gold", bank)
+        self.assertLess(len(gold.split()), len(self.context.split()))
+
+    def test_questions_selecting_the_same_passages_share_the_prefix(self):
+        _, first = build_prompt("why did gold prices climb", self.context, self.tokenizer, 60)
+        _, second = build_prompt("will gold prices keep climbing", self.context, self.tokenizer, 60)
+        self.assertEqual(first, second)
+
+    def test_short_context_is_kept_whole(self):
+        prompt, prefix = build_prompt("why", "gold prices climbed", self.tokenizer, 60)
+        self.assertEqual(prefix, "Context: gold prices climbed\n\n")
+        self.assertEqual(prompt, prefix + "Question: why\nAnswer:")
+
+    def test_follow_up_question_reuses_the_prefix_cache(self):
+        registry = LoadedRegistry(self.tokenizer, self.model)
+        worker = InferenceWorker(registry)
+        params = {'max_new_tokens': 2}
+
+        def ask(question):
+            answer_question(question, self.context, registry, token_budget=60, cache=AnswerCache(),
+                            generation_params=params, worker=worker)
+            return worker.stats['prefix_misses'], worker.stats['prefix_hits']
+
+        self.assertEqual(ask("why did gold prices climb"), (1, 0))
+        self.assertEqual(ask("will gold prices keep climbing"), (1, 1))
+        # Another topic selects other passages, its prefix is encoded
+        self.assertEqual(ask("what will the central bank do"), (2, 1))
+
+    def test_prefix_cache_gives_the_same_answer_as_a_full_prompt(self):
+        registry = LoadedRegistry(self.tokenizer, self.model)
+        params = {'max_new_tokens': 5, 'suppress_tokens': [self.tokenizer.eos_token_id, self.tokenizer.unk_token_id]}
+        prompt, prefix = build_prompt("why did gold prices climb", self.context, self.tokenizer, 60)
+        worker = InferenceWorker(registry)
+        cached = [worker.submit(prompt, params, prefix=prefix).result().text for _ in range(2)]
+        full = InferenceWorker(registry, prefix_cache_size=0).submit(prompt, params, prefix=prefix).result().text
+        self.assertEqual(worker.stats['prefix_hits'], 1)
+        self.assertEqual(cached, [full, full])
+
+
+class ArticleRetrievalTests(unittest.TestCase):
+    def setUp(self):
+        self.raw = ['the central bank kept its rates unchanged.it expects inflation to slow',
+                    'tech stocks rallied after strong quarterly earnings.chip makers led the gains']
+
+    # The question is lemmatized like the corpus, and the answer is the article as written
+    def test_question_matches_the_lemmatized_corpus(self):
+        with fake_nltk():
+            index = RetrievalIndex.fit(preprocess_chunk(self.raw), self.raw)
+            self.assertEqual(get_best_article("What about the rates?", index), self.raw[0])
+            self.assertEqual(get_best_context("Why did chip stocks rally?", index, 100, count_words), self.raw[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import io
+import unittest
+
+import pandas as pd
+
+from personal_finance import (CategoryMatcher, ChartCache, bar_chart, categorize_expenses, detect_date_format,
+                              import_statement, parse_category_rules, pie_chart, render_figure, to_amounts)
+
+
+class CategoryMatcherTests(unittest.TestCase):
+    def categorize(self, descriptions, rules=""):
+        matcher = CategoryMatcher(rules=parse_category_rules(rules))
+        return matcher.categorize(pd.Series(descriptions)).tolist()
+
+    def test_keywords_match_whole_words(self):
+        self.assertEqual(self.categorize(["CURRENT ACCOUNT FEE", "Gift for parents", "TORRENT VPN"]),
+                         ["other", "other", "other"])
+        self.assertEqual(self.categorize(["Monthly RENT", "rent-a-car", "Utilities bill", "dining out"]),
+                         ["fixed", "fixed", "fixed", "outing"])
+
+    def test_prefix_keywords_match_longer_words(self):
+        self.assertEqual(self.categorize(["rental deposit", "team outings", "foodstuff market"]),
+                         ["fixed", "outing", "groceries"])
+        self.assertEqual(self.categorize(["seafood", "netflixandchill"], "netflix* subscriptions"),
+                         ["other", "subscriptions"])
+
+    def test_user_rules_take_precedence(self):
+        self.assertEqual(self.categorize(["food delivery netflix", "netflix food"], "netflix subscriptions"),
+                         ["subscriptions", "subscriptions"])
+        self.assertEqual(self.categorize(["food delivery"], "netflix subscriptions"), ["groceries"])
+
+    def test_longest_rule_wins(self):
+        rules = "uber transport\nuber eats outing"
+        self.assertEqual(self.categorize(["UBER EATS order", "Uber trip"], rules), ["outing", "transport"])
+
+    def test_missing_and_empty_descriptions(self):
+        self.assertEqual(self.categorize([None, ""]), ["other", "other"])
+        self.assertEqual(self.categorize([]), [])
+
+    def test_categorize_expenses_totals(self):
+        totals = categorize_expenses("50 rent\n20.5 Groceries\n10 netflix\n5 current account",
+                                     CategoryMatcher(rules={'netflix': 'subscriptions'}))
+        self.assertEqual(totals, {'fixed': 50.0, 'outing': 0.0, 'shopping': 0.0, 'groceries': 20.5,
+                                  'subscriptions': 10.0, 'other': 5.0})
+
+
+class ImportStatementTests(unittest.TestCase):
+    def import_csv(self, text, **kwargs):
+        stats = {}
+        monthly = import_statement(io.BytesIO(text.encode('utf-8')), kind='csv', stats=stats, **kwargs)
+        return monthly, stats
+
+    def test_european_export(self):
+        monthly, stats = self.import_csv("Date;Amount;Description\n05/01/2024;-10,00;food shop\n"
+                                         "25/01/2024;-20,00;rent\n28/02/2024;-30,00;dining\n")
+        self.assertEqual(list(monthly.index), ['2024-01', '2024-02'])
+        self.assertEqual(monthly.loc['2024-01', 'groceries'], 10.0)
+        self.assertEqual(monthly.loc['2024-01', 'fixed'], 20.0)
+        self.assertEqual(monthly.loc['2024-02', 'outing'], 30.0)
+        self.assertEqual((stats['rows'], stats['dropped'], stats['date_format']), (3, 0, '%d/%m/%Y'))
+
+    def test_date_format_of_the_first_batch_is_used_for_every_batch(self):
+        monthly, stats = self.import_csv("Date,Amount,Description\n13/01/2024,-1,rent\n14/01/2024,-1,rent\n"
+                                         "05/02/2024,-2,rent\n06/02/2024,-2,rent\n", batch_rows=2)
+        self.assertEqual(list(monthly.index), ['2024-01', '2024-02'])
+        self.assertEqual(list(monthly['fixed']), [2.0, 4.0])
+
+    def test_ambiguous_dates_follow_the_dayfirst_option(self):
+        text = "Date,Amount,Description\n05/01/2024,-10,rent\n06/02/2024,-20,rent\n"
+        self.assertEqual(list(self.import_csv(text)[0].index), ['2024-05', '2024-06'])
+        self.assertEqual(list(self.import_csv(text, dayfirst=True)[0].index), ['2024-01', '2024-02'])
+
+    def test_unreadable_rows_are_counted(self):
+        monthly, stats = self.import_csv("Date,Amount,Description\n2024-01-05,-10.00,food\nyesterday,-1,x\n"
+                                         "2024-01-07,n/a,x\n2024-02-01,-5,x\n")
+        self.assertEqual((stats['rows'], stats['dropped']), (4, 2))
+        self.assertEqual(monthly.to_numpy().sum(), 15.0)
+
+    def test_unknown_date_format_is_an_error(self):
+        with self.assertRaises(ValueError):
+            self.import_csv("Date,Amount,Description\nsoon,-10,rent\n")
+
+    def test_parenthesized_amounts_are_debits(self):
+        monthly, _ = self.import_csv('Date,Amount,Description\n2024-03-01,(12.00),rent\n2024-03-02,"($1,000.50)",rent\n'
+                                     '2024-03-03,40.00,salary\n')
+        self.assertEqual(monthly.loc['2024-03', 'fixed'], 1012.5)
+        self.assertEqual(to_amounts(pd.Series(["(12.00)", "(1.234,56)", "12,50", "$4.00"])).tolist(),
+                         [-12.0, -1234.56, 12.5, 4.0])
+
+    def test_detect_date_format(self):
+        self.assertEqual(detect_date_format(pd.Series(["2024-01-31", "2024-02-01T10:00:00"])), 'ISO8601')
+        self.assertEqual(detect_date_format(pd.Series(["01/31/2024", "02/01/2024"]), dayfirst=True), '%m/%d/%Y')
+        self.assertEqual(detect_date_format(pd.Series(["31.01.24"])), '%d.%m.%y')
+
+    def test_ofx_statement(self):
+        ofx = ("<OFX><BANKTRANLIST>"
+               "<STMTTRN><DTPOSTED>20240105120000<TRNAMT>-25.00<NAME>Food market</STMTTRN>"
+               "<STMTTRN><DTPOSTED>20240201<TRNAMT>-700.00<NAME>Rent</STMTTRN>"
+               "<STMTTRN><DTPOSTED>bad<TRNAMT>-1.00<NAME>Rent</STMTTRN>"
+               "</BANKTRANLIST></OFX>")
+        stats = {}
+        monthly = import_statement(io.BytesIO(ofx.encode('utf-8')), kind='ofx', stats=stats)
+        self.assertEqual(list(monthly.index), ['2024-01', '2024-02'])
+        self.assertEqual(monthly.loc['2024-02', 'fixed'], 700.0)
+        self.assertEqual((stats['rows'], stats['dropped']), (3, 1))
+
+
+
+# Render function that records how many times it ran
+class CountingRender:
+    def __init__(self, chart=b'chart'):
+        self.chart = chart
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.chart
+
+
+class ChartCacheTests(unittest.TestCase):
+    def test_hit_skips_the_render(self):
+        cache, render = ChartCache(), CountingRender()
+        self.assertEqual(cache.get_or_render('bar', {'fixed': 700.0}, 'png', render), b'chart')
+        self.assertEqual(cache.get_or_render('bar', {'fixed': 700.004}, 'png', render), b'chart')  # Same cents
+        self.assertEqual(render.calls, 1)
+        self.assertEqual(cache.stats, {'hits': 1, 'renders': 1})
+
+    def test_least_recently_used_chart_is_evicted(self):
+        cache, render = ChartCache(max_entries=2), CountingRender()
+        for category in ('fixed', 'outing', 'fixed', 'shopping'):  # "fixed" is used again before "shopping"
+            cache.get_or_render('bar', {category: 1.0}, 'png', render)
+        self.assertEqual(render.calls, 3)
+        cache.get_or_render('bar', {'fixed': 1.0}, 'png', render)
+        self.assertEqual(render.calls, 3)
+        cache.get_or_render('bar', {'outing': 1.0}, 'png', render)  # Evicted by "shopping"
+        self.assertEqual(render.calls, 4)
+
+    def test_key_changes_with_the_data(self):
+        key = ChartCache.key('bar', {'fixed': 700.0, 'outing': 50.0}, 'png')
+        self.assertEqual(key, ChartCache.key('bar', {'fixed': 700, 'outing': 50.001}, 'png'))
+        for other in (ChartCache.key('bar', {'fixed': 700.0, 'outing': 50.01}, 'png'),
+                      ChartCache.key('bar', {'fixed': 700.0, 'dining': 50.0}, 'png'),
+                      ChartCache.key('bar', {'outing': 50.0, 'fixed': 700.0}, 'png'),
+                      ChartCache.key('pie', {'fixed': 700.0, 'outing': 50.0}, 'png'),
+                      ChartCache.key('bar', {'fixed': 700.0, 'outing': 50.0}, 'svg')):
+            self.assertNotEqual(key, other)
+
+    def test_charts_leave_no_pyplot_figure_open(self):
+        import matplotlib.pyplot as plt
+        cache = ChartCache()
+        expenses = {'fixed': 700.0, 'outing': 50.0, 'shopping': 0.0}
+        self.assertTrue(bar_chart(expenses, cache=cache).startswith(b'\x89PNG'))
+        self.assertTrue(pie_chart(expenses, cache=cache).startswith(b'\x89PNG'))
+        self.assertIn(b'<svg', bar_chart(expenses, fmt='svg', cache=cache))
+        self.assertEqual(plt.get_fignums(), [])
+        # Zero amounts are left out of the pie, so the same pie is reused
+        self.assertIs(pie_chart({'fixed': 700.0, 'outing': 50.0}, cache=cache), pie_chart(expenses, cache=cache))
+        self.assertIsNone(pie_chart({'fixed': 0.0}, cache=cache))
+        self.assertEqual(cache.stats, {'hits': 2, 'renders': 3})
+
+    def test_render_figure_clears_the_figure_on_error(self):
+        import matplotlib.pyplot as plt
+        axes = []
+
+        def draw(ax):
+            axes.append(ax)
+            raise RuntimeError("bad data")
+        with self.assertRaises(RuntimeError):
+            render_figure(draw)
+        self.assertEqual(axes[0].figure.axes, [])
+        self.assertEqual(plt.get_fignums(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,374 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import normalize
+
+import stock_recommendation
+from stock_recommendation import (DATE_FORMAT, FeaturePipeline, RowIndex, SimilarityIndex, append_array,
+                                  append_ticker_history, build_recommendation_data, default_cache_dir,
+                                  ingest_ticker_rows, load_array, load_ticker_history, read_manifest, recommend_batch,
+                                  save_array)
+
+
+# Random walk prices of `tickers` over `days` business days, one row per (ticker, day)
+def make_history(tickers=('aapl', 'msft', 'tsla'), days=30, start='2023-01-02', seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=days)
+    frames = []
+    for ticker in tickers:
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+        spread = rng.uniform(0.005, 0.03, days)
+        frames.append(pd.DataFrame({
+            'date': dates.strftime(DATE_FORMAT),
+            'ticker': ticker,
+            'open': close * (1 + rng.normal(0, 0.01, days)),
+            'high': close * (1 + spread),
+            'low': close * (1 - spread),
+            'close': close,
+            'volume': rng.integers(1_000_000, 5_000_000, days),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_history(path, df):
+    df.to_csv(path, sep=';', index=False)
+
+
+class SimilarityIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.df = make_history()
+        self.matrix = FeaturePipeline().fit_transform(self.df)
+        self.index = SimilarityIndex(self.matrix, RowIndex(self.df).ticker_rows)
+        self.scores = normalize(self.matrix) @ normalize(self.matrix).T
+
+    def test_top_k_are_the_best_scores_best_first(self):
+        for position in (0, 17, 45, 89):
+            positions, scores = self.index.top_k(position, k=5)
+            np.testing.assert_array_equal(positions, np.argsort(-self.scores[position], kind='stable')[:5])
+            np.testing.assert_allclose(scores, self.scores[position][positions], rtol=1e-5)
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            self.assertEqual(positions[0], position)
+
+    def test_top_k_restricted_to_a_ticker(self):
+        rows = RowIndex(self.df).ticker_rows['msft']
+        positions, scores = self.index.top_k(0, k=4, ticker='msft')
+        self.assertTrue(set(positions) <= set(rows))
+        expected = rows[np.argsort(-self.scores[0][rows], kind='stable')[:4]]
+        np.testing.assert_array_equal(positions, expected)
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_k_larger_than_the_candidates_and_unknown_ticker(self):
+        positions, _ = self.index.top_k(0, k=1000, ticker='aapl')
+        self.assertEqual(sorted(positions), list(range(30)))
+        positions, scores = self.index.top_k(0, k=3, ticker='goog')
+        self.assertEqual((len(positions), len(scores)), (0, 0))
+
+
+class FeaturePipelineTests(unittest.TestCase):
+    def test_features_are_standardised(self):
+        df = make_history()
+        matrix = FeaturePipeline().fit_transform(df)
+        self.assertEqual(matrix.shape, (len(df), 6))
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertTrue(np.all(np.isfinite(matrix)))
+        np.testing.assert_allclose(matrix.mean(axis=0), 0, atol=0.05)
+        # The first day of every ticker has no return, it is set to the mean (0) and
+        # the other days have unit variance
+        returns = np.delete(matrix[:, 4], [0, 30, 60])
+        self.assertAlmostEqual(float(returns.std()), 1.0, places=4)
+
+    def test_transform_uses_the_fitted_statistics(self):
+        df = make_history()
+        pipeline = FeaturePipeline()
+        matrix = pipeline.fit_transform(df)
+        np.testing.assert_allclose(pipeline.transform(df), matrix, atol=1e-6)
+        # The first days of a ticker are scaled as they were in the full fit, not refitted
+        np.testing.assert_allclose(pipeline.transform(df.iloc[:5]), matrix[:5], atol=1e-6)
+
+    def test_constant_column_and_missing_volume(self):
+        df = make_history().drop(columns='volume')
+        df['close'], df['high'], df['low'] = 100.0, 101.0, 99.0
+        matrix = FeaturePipeline(('range', 'volume')).fit_transform(df)
+        np.testing.assert_allclose(matrix, np.zeros((len(df), 2)), atol=1e-6)
+
+    def test_unknown_feature_and_transform_before_fit(self):
+        with self.assertRaises(ValueError):
+            FeaturePipeline(('ohlc', 'sentiment'))
+        with self.assertRaises(ValueError):
+            FeaturePipeline().transform(make_history())
+
+
+class ColumnarCacheTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_path = os.path.join(directory.name, 'ticker_history.csv')
+        self.cache_dir = default_cache_dir(self.csv_path)
+        self.history = make_history()
+        write_history(self.csv_path, self.history)
+
+    def load(self, **kwargs):
+        with mock.patch.object(stock_recommendation, 'build_columnar_cache',
+                               wraps=stock_recommendation.build_columnar_cache) as build:
+            result = load_ticker_history(self.csv_path, **kwargs)
+        return result, build.call_count
+
+    def test_cached_columns_match_the_csv(self):
+        (df, pipeline, features), builds = self.load()
+        self.assertEqual(builds, 1)
+        self.assertEqual(df['ticker'].astype(str).tolist(), self.history['ticker'].tolist())
+        self.assertEqual(df['date'].dt.strftime(DATE_FORMAT).tolist(), self.history['date'].tolist())
+        np.testing.assert_allclose(df['close'], self.history['close'])
+        self.assertIsInstance(features, np.memmap)
+        np.testing.assert_allclose(features, normalize(FeaturePipeline().fit_transform(self.history)), atol=1e-6)
+        np.testing.assert_allclose(pipeline.transform(self.history), FeaturePipeline().fit_transform(self.history),
+                                   atol=1e-6)
+
+    def test_unchanged_file_is_not_rebuilt(self):
+        self.load()
+        _, builds = self.load()
+        self.assertEqual(builds, 0)
+
+    def test_touched_file_is_hashed_once(self):
+        self.load()
+        stat = os.stat(self.csv_path)
+        os.utime(self.csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        with mock.patch.object(stock_recommendation, 'file_digest', wraps=stock_recommendation.file_digest) as digest:
+            _, builds = self.load()
+            self.assertEqual((builds, digest.call_count), (0, 1))
+            _, builds = self.load()
+            self.assertEqual((builds, digest.call_count), (0, 1))
+        self.assertEqual(read_manifest(self.cache_dir)['source']['mtime_ns'], stat.st_mtime_ns + 10 ** 9)
+
+    def test_changed_file_is_rebuilt(self):
+        self.load()
+        changed = self.history.copy()
+        changed.loc[0, 'close'] += 1
+        write_history(self.csv_path, changed)
+        stat = os.stat(self.csv_path)
+        os.utime(self.csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        (df, _, _), builds = self.load()
+        self.assertEqual(builds, 1)
+        self.assertAlmostEqual(df['close'][0], changed.loc[0, 'close'])
+
+    def test_other_feature_set_is_rebuilt(self):
+        self.load()
+        (_, _, features), builds = self.load(features=('ohlc',))
+        self.assertEqual(builds, 1)
+        self.assertEqual(features.shape, (len(self.history), 3))
+
+
+class RowIndexTests(unittest.TestCase):
+    def setUp(self):
+        # Rows out of date order, with one duplicated (ticker, date)
+        self.df = pd.DataFrame({
+            'date': ['01/05/2023', '01/03/2023', '01/04/2023', '01/03/2023', '01/04/2023', '01/03/2023'],
+            'ticker': ['aapl', 'aapl', 'aapl', 'msft', 'msft', 'aapl'],
+        })
+        self.index = RowIndex(self.df)
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('aapl', '01/04/2023'), 2)
+        self.assertEqual(self.index.lookup('msft', '01/04/2023'), 4)
+        self.assertEqual(self.index.lookup('aapl', '01/03/2023'), 1)  # First of the duplicates
+        self.assertIsNone(self.index.lookup('msft', '01/05/2023'))
+        self.assertIsNone(self.index.lookup('goog', '01/03/2023'))
+        self.assertIsNone(self.index.lookup('aapl', '2023-01-03'))
+        self.assertEqual(self.index.lookup_many(['msft', 'aapl', 'goog'], ['01/03/2023', '01/05/2023', '01/05/2023']),
+                         [3, 0, None])
+
+    def test_between(self):
+        self.assertEqual(self.index.between('aapl').tolist(), [1, 5, 2, 0])
+        self.assertEqual(self.index.between('aapl', '01/04/2023', '01/05/2023').tolist(), [2, 0])
+        self.assertEqual(self.index.between('aapl', start='01/04/2023').tolist(), [2, 0])
+        self.assertEqual(self.index.between('msft', end='01/03/2023').tolist(), [3])
+        self.assertEqual(self.index.between('msft', '01/06/2023').tolist(), [])
+        self.assertEqual(self.index.between('goog').tolist(), [])
+
+
+class RecommendBatchTests(unittest.TestCase):
+    def setUp(self):
+        history = make_history()
+        self.dates = history['date']
+        # Dates parsed, as in the dataframe loaded from the columnar cache
+        self.df = history.assign(date=pd.to_datetime(history['date'], format=DATE_FORMAT))
+        self.row_index = RowIndex(history)
+        self.index = SimilarityIndex(FeaturePipeline().fit_transform(history), self.row_index.ticker_rows)
+
+    def test_block_matches_top_k_of_the_same_ticker(self):
+        queries = [0, 7, 29, 30, 44, 61, 89]
+        top, scores = self.index.top_k_block(queries, k=4)
+        for position, row_top, row_scores in zip(queries, top, scores):
+            ticker = self.df['ticker'][position]
+            expected_top, expected_scores = self.index.top_k(position, k=4, ticker=ticker)
+            np.testing.assert_array_equal(row_top, expected_top)
+            np.testing.assert_allclose(row_scores, expected_scores, rtol=1e-5)
+
+    def test_other_tickers_are_masked(self):
+        top, scores = self.index.top_k_block([0, 45], k=35)
+        # 30 rows per ticker, the 5 remaining slots are other tickers scored -inf
+        self.assertTrue(np.all(np.isfinite(scores[:, :30])))
+        self.assertTrue(np.all(scores[:, 30:] == -np.inf))
+        self.assertEqual(set(top[0, :30]), set(range(30)))
+        self.assertEqual(set(top[1, :30]), set(range(30, 60)))
+        top, scores = self.index.top_k_block([0], k=35, same_ticker=False)
+        self.assertTrue(np.all(np.isfinite(scores)))
+
+    def test_results_come_back_in_input_order_across_blocks(self):
+        dates = self.dates
+        queries = [(dates[position], self.df['ticker'][position]) for position in (3, 88, 40, 12, 65)]
+        queries.insert(2, ('01/01/1990', 'aapl'))
+        queries.insert(4, (dates[5], 'goog'))
+        results = list(recommend_batch(iter(queries), self.df, self.row_index, self.index, k=3, block_size=2))
+        self.assertEqual([(result['date'], result['ticker']) for result in results], queries)
+        self.assertEqual([('error' in result) for result in results], [False, False, True, False, True, False, False])
+
+        for (date, ticker), result in zip(queries, results):
+            if 'error' in result:
+                self.assertEqual(result['recommendations'], [])
+                continue
+            positions, scores = self.index.top_k(self.row_index.lookup(ticker, date), k=3, ticker=ticker)
+            self.assertEqual([recommendation['date'] for recommendation in result['recommendations']],
+                             dates[positions].tolist())
+            np.testing.assert_allclose([recommendation['score'] for recommendation in result['recommendations']],
+                                       scores, atol=1e-5)
+
+    def test_malformed_date_falls_back_to_single_lookups(self):
+        dates = self.dates
+        queries = [(dates[1], 'aapl'), ('2023-01-03', 'aapl'), ('not a date', 'msft'), (dates[31], 'msft')]
+        results = list(recommend_batch(queries, self.df, self.row_index, self.index, k=2, block_size=128))
+        self.assertEqual([len(result['recommendations']) for result in results], [2, 0, 0, 2])
+        self.assertEqual(results[1]['error'], "no data for this date and ticker")
+        self.assertEqual(results[0]['recommendations'][0]['date'], dates[1])
+        self.assertEqual(results[3]['recommendations'][0]['date'], dates[31])
+
+    def test_padding_of_other_tickers_is_dropped(self):
+        history = make_history().iloc[:32]  # Every aapl row and two msft rows
+        index = SimilarityIndex(FeaturePipeline().fit_transform(history), RowIndex(history).ticker_rows)
+        df = history.assign(date=pd.to_datetime(history['date'], format=DATE_FORMAT))
+        # msft has two rows, so a query for 5 recommendations gets two, not three -inf ones
+        result = next(recommend_batch([(history['date'][30], 'msft')], df, RowIndex(history), index, k=5))
+        self.assertEqual(len(result['recommendations']), 2)
+
+
+class AppendTickerHistoryTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.csv_path = os.path.join(directory.name, 'ticker_history.csv')
+        self.cache_dir = default_cache_dir(self.csv_path)
+        history = make_history(days=40)
+        days = pd.to_datetime(history['date'], format=DATE_FORMAT)
+        cutoff = days.drop_duplicates().iloc[29]
+        self.initial = history[days <= cutoff].reset_index(drop=True)
+        # The last ten days of every ticker and a ticker never seen before
+        self.new_rows = pd.concat([history[days > cutoff], make_history(('goog',), days=3, start='2023-03-01')],
+                                  ignore_index=True)
+        self.combined = pd.concat([self.initial, self.new_rows], ignore_index=True)
+        write_history(self.csv_path, self.initial)
+
+    def test_appended_rows_extend_the_cached_columns_and_features(self):
+        _, pipeline, _ = load_ticker_history(self.csv_path)
+        self.assertEqual(append_ticker_history(self.new_rows, self.csv_path), len(self.new_rows))
+
+        with mock.patch.object(stock_recommendation, 'build_columnar_cache') as build:
+            df, _, features = load_ticker_history(self.csv_path)
+        build.assert_not_called()
+        self.assertEqual(df['ticker'].astype(str).tolist(), self.combined['ticker'].tolist())
+        self.assertEqual(df['date'].dt.strftime(DATE_FORMAT).tolist(), self.combined['date'].tolist())
+        np.testing.assert_allclose(df['close'], self.combined['close'])
+        np.testing.assert_array_equal(df['volume'], self.combined['volume'])
+        # New rows go through the frozen pipeline, with the previous day of their ticker as context
+        np.testing.assert_allclose(features, normalize(pipeline.transform(self.combined)), atol=1e-6)
+        csv = pd.read_csv(self.csv_path, delimiter=';')
+        self.assertEqual(csv['date'].tolist(), self.combined['date'].tolist())
+        np.testing.assert_allclose(csv['close'], self.combined['close'])
+
+    def test_append_then_load_matches_a_full_rebuild(self):
+        load_ticker_history(self.csv_path)
+        append_ticker_history(self.new_rows, self.csv_path)
+        df, _, _ = load_ticker_history(self.csv_path)
+        rebuilt_path = os.path.join(self.directory, 'rebuilt.csv')
+        write_history(rebuilt_path, self.combined)
+        rebuilt, _, _ = load_ticker_history(rebuilt_path)
+
+        pd.testing.assert_frame_equal(df.assign(ticker=df['ticker'].astype(str)),
+                                      rebuilt.assign(ticker=rebuilt['ticker'].astype(str)))
+        appended, full = RowIndex(df), RowIndex(rebuilt)
+        self.assertEqual(appended.positions, full.positions)
+        self.assertEqual(appended.ticker_rows.keys(), full.ticker_rows.keys())
+        for ticker in full.ticker_rows:
+            np.testing.assert_array_equal(appended.ticker_rows[ticker], full.ticker_rows[ticker])
+
+    def test_loaded_indexes_are_extended_in_place(self):
+        data = build_recommendation_data(self.csv_path)
+        df, row_index, similarity_index = ingest_ticker_rows(self.new_rows, data, self.csv_path)
+        self.assertIs(row_index, data[1])
+        self.assertIs(similarity_index, data[2])
+
+        fresh_rows = RowIndex(df)
+        self.assertEqual(row_index.positions, fresh_rows.positions)
+        self.assertEqual(row_index.ticker_codes, fresh_rows.ticker_codes)
+        for ticker in fresh_rows.ticker_rows:
+            np.testing.assert_array_equal(row_index.ticker_rows[ticker], fresh_rows.ticker_rows[ticker])
+            np.testing.assert_array_equal(row_index.ticker_dates[ticker], fresh_rows.ticker_dates[ticker])
+        fresh = SimilarityIndex(load_ticker_history(self.csv_path)[2], fresh_rows.ticker_rows, normalized=True)
+        np.testing.assert_array_equal(similarity_index.row_codes, fresh.row_codes)
+        for position in (0, 35, len(df) - 1):
+            ticker = str(df['ticker'][position])
+            np.testing.assert_array_equal(similarity_index.top_k(position, k=3, ticker=ticker)[0],
+                                          fresh.top_k(position, k=3, ticker=ticker)[0])
+            self.assertEqual(next(recommend_batch([(df['date'][position].strftime(DATE_FORMAT), ticker)], df,
+                                                  row_index, similarity_index))['recommendations'][0]['score'], 1.0)
+
+    def test_rows_left_by_an_interrupted_append_are_cut_off(self):
+        load_ticker_history(self.csv_path)
+        rows = read_manifest(self.cache_dir)['rows']
+        # An append that wrote some columns and crashed before the manifest
+        append_array(self.cache_dir, 'close', np.full(7, -1.0), rows)
+        append_array(self.cache_dir, 'features', np.ones((7, 6)), rows)
+
+        append_ticker_history(self.new_rows, self.csv_path)
+        self.assertEqual(load_array(self.cache_dir, 'close').shape, (len(self.combined),))
+        self.assertEqual(load_array(self.cache_dir, 'features').shape, (len(self.combined), 6))
+        df, _, _ = load_ticker_history(self.csv_path)
+        np.testing.assert_allclose(df['close'], self.combined['close'])
+
+    def test_stale_rows_are_rejected(self):
+        load_ticker_history(self.csv_path)
+        manifest = read_manifest(self.cache_dir)
+        with open(self.csv_path) as f:
+            before = f.read()
+        for date in (self.initial['date'].iloc[29], self.initial['date'].iloc[10]):
+            stale = self.new_rows.iloc[:1].assign(date=date)
+            with self.assertRaisesRegex(ValueError, 'aapl'):
+                append_ticker_history(pd.concat([self.new_rows.iloc[1:], stale]), self.csv_path)
+        self.assertEqual(read_manifest(self.cache_dir), manifest)
+        with open(self.csv_path) as f:
+            self.assertEqual(f.read(), before)
+        self.assertEqual(load_array(self.cache_dir, 'close').shape, (len(self.initial),))
+
+    def test_duplicated_new_rows_are_appended_once(self):
+        load_ticker_history(self.csv_path)
+        self.assertEqual(append_ticker_history(pd.concat([self.new_rows, self.new_rows]), self.csv_path),
+                         len(self.new_rows))
+        self.assertEqual(append_ticker_history(self.new_rows.iloc[:0], self.csv_path), 0)
+
+    def test_file_is_rewritten_when_the_header_does_not_fit(self):
+        path = os.path.join(self.directory, 'wide.npy')
+        with open(path, 'wb') as f:
+            np.lib.format.write_array(f, np.arange(6.0).reshape(3, 2), version=(2, 0))
+        append_array(self.directory, 'wide', [[6.0, 7.0], [8.0, 9.0]], 2)
+        np.testing.assert_array_equal(np.load(path), [[0, 1], [2, 3], [6, 7], [8, 9]])
+        save_array(self.directory, 'narrow', np.arange(3, dtype=np.int32))
+        append_array(self.directory, 'narrow', [3, 4], 3)
+        np.testing.assert_array_equal(np.load(os.path.join(self.directory, 'narrow.npy')), [0, 1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import stocks_consulting
+from stocks_consulting import (CachedFetcher, FixtureFetcher, FundamentalsSnapshot, YahooFetcher, compute_indicators,
+                               request_data)
+
+INCOME = [{'2023-09-30': {'totalRevenue': 1000.0, 'grossProfit': 400.0, 'netIncome': 100.0, 'ebit': 150.0}}]
+CASH = [{'2023-09-30': {'freeCashFlow': 80.0, 'cashDividendsPaid': -20.0}}]
+BALANCE = [{'2023-09-30': {'stockholdersEquity': 500.0, 'totalAssets': 2000.0, 'longTermDebt': 250.0,
+                           'totalCapitalization': 750.0}}]
+PRICES = {'prices': [{'close': 190.5}]}
+
+
+def write_fixtures(directory, ticker, kinds=('income', 'cash', 'balance', 'prices')):
+    data = {'income': INCOME, 'cash': CASH, 'balance': BALANCE, 'prices': PRICES}
+    for kind in kinds:
+        with open(os.path.join(directory, f"{ticker}_{kind}.json"), 'w') as f:
+            json.dump(data[kind], f)
+
+
+# Prices arrive after `delay` seconds, statements at once
+class SlowPricesFetcher(FixtureFetcher):
+    def __init__(self, directory, delay):
+        super().__init__(directory)
+        self.prices_delay = delay
+
+    def fetch_prices(self, ticker, start_date, end_date):
+        time.sleep(self.prices_delay)
+        return super().fetch_prices(ticker, start_date, end_date)
+
+
+# Counts the calls that reach the fixtures, `fail` makes them raise
+class CountingFetcher(FixtureFetcher):
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.calls = 0
+        self.fail = False
+        self.called = threading.Event()
+
+    def _load(self, ticker, kind):
+        self.calls += 1
+        self.called.set()
+        if self.fail:
+            raise ConnectionError("offline")
+        return super()._load(ticker, kind)
+
+
+class RequestDataTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_all_data_fetched(self):
+        write_fixtures(self.directory.name, 'AAPL')
+        snapshot = FundamentalsSnapshot.from_data(*request_data('AAPL', FixtureFetcher(self.directory.name)))
+        self.assertTrue(snapshot.is_complete())
+        self.assertEqual(compute_indicators(snapshot)['Today Stock Price'], "190.5 $")
+
+    def test_failed_statement_only_degrades_its_indicators(self):
+        write_fixtures(self.directory.name, 'AAPL', kinds=('income', 'balance', 'prices'))
+        data = request_data('AAPL', FixtureFetcher(self.directory.name))
+        self.assertIsNone(data[1])
+        self.assertIsNotNone(data[0])
+
+        snapshot = FundamentalsSnapshot.from_data(*data)
+        self.assertFalse(snapshot.is_complete())
+        self.assertFalse(snapshot.is_empty())
+        indicators = compute_indicators(snapshot)
+        self.assertEqual(indicators['Free Cash Flow'], "N/A")
+        self.assertEqual(indicators['Payout Ratio'], "N/A")
+        self.assertEqual(indicators['Turnover'], "1000.0 $")
+        self.assertEqual(indicators['ROE (Return on Equity)'], "20.0 %")
+
+    def test_unknown_ticker_is_empty(self):
+        snapshot = FundamentalsSnapshot.from_data(*request_data('NOPE', FixtureFetcher(self.directory.name)))
+        self.assertTrue(snapshot.is_empty())
+
+    def test_timeout_only_drops_the_slow_call(self):
+        write_fixtures(self.directory.name, 'AAPL')
+        start = time.monotonic()
+        data = request_data('AAPL', SlowPricesFetcher(self.directory.name, delay=2.0), timeout=0.3)
+        elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 1.5)
+        self.assertIsNone(data[3])
+        self.assertEqual(data[:3], (INCOME, CASH, BALANCE))
+
+        indicators = compute_indicators(FundamentalsSnapshot.from_data(*data))
+        self.assertEqual(indicators['Today Stock Price'], "N/A")
+        self.assertEqual(indicators['Net Turnover'], "100.0 $")
+
+    def test_timeout_is_shared_by_all_calls(self):
+        write_fixtures(self.directory.name, 'AAPL')
+        start = time.monotonic()
+        data = request_data('AAPL', FixtureFetcher(self.directory.name, delay=1.0), timeout=0.3)
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(data, (None, None, None, None))
+
+
+class YahooFetcherTests(unittest.TestCase):
+    def test_every_yahoo_call_has_a_network_timeout(self):
+        with mock.patch.object(stocks_consulting, 'YahooFinancials') as client:
+            client.return_value.get_financial_stmts.return_value = {'incomeStatementHistory': {'AAPL': INCOME}}
+            client.return_value.get_historical_price_data.return_value = {'AAPL': PRICES}
+            fetcher = YahooFetcher(timeout=4)
+            self.assertEqual(fetcher.fetch_statement('AAPL', 'income'), INCOME)
+            self.assertEqual(fetcher.fetch_prices('AAPL', '2024-01-01', '2024-01-02'), PRICES)
+        self.assertEqual(client.call_args_list, [mock.call('AAPL', timeout=4)] * 2)
+        self.assertEqual(YahooFetcher().timeout, stocks_consulting.YAHOO_TIMEOUT)
+
+
+class CachedFetcherTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        write_fixtures(self.directory.name, 'AAPL')
+        self.fetcher = CountingFetcher(self.directory.name)
+        self.path = os.path.join(self.directory.name, 'cache', 'fundamentals.sqlite3')
+        self.cache = CachedFetcher(self.fetcher, path=self.path, ttls={'income': 60})
+
+    # Pretend the cached income statement of AAPL was fetched `age` seconds ago
+    def age_entry(self, age):
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("UPDATE cache SET fetched_at = ? WHERE ticker = 'AAPL' AND kind = 'income'",
+                         (time.time() - age,))
+        conn.close()
+
+    def test_fresh_entry_is_served_from_the_cache(self):
+        self.assertEqual(self.cache.fetch_statement('AAPL', 'income'), INCOME)
+        self.assertEqual(self.cache.fetch_statement('aapl', 'income'), INCOME)
+        self.assertEqual(self.fetcher.calls, 1)
+        self.assertEqual(self.cache.cache_stats(), {'hits': 1, 'stale_hits': 0, 'misses': 1})
+
+    def test_stale_entry_is_served_while_refreshed_in_background(self):
+        self.cache.fetch_statement('AAPL', 'income')
+        self.age_entry(90)
+        self.fetcher.called.clear()
+
+        self.assertEqual(self.cache.fetch_statement('AAPL', 'income'), INCOME)
+        self.assertEqual(self.cache.cache_stats()['stale_hits'], 1)
+        self.assertTrue(self.fetcher.called.wait(5))
+        for _ in range(50):  # The refresh stores the new copy after fetching it
+            if not self.cache._refreshing:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.fetcher.calls, 2)
+        self.assertEqual(self.cache.fetch_statement('AAPL', 'income'), INCOME)
+        self.assertEqual(self.cache.cache_stats()['hits'], 1)
+
+    def test_expired_entry_is_fetched_again(self):
+        self.cache.fetch_statement('AAPL', 'income')
+        self.age_entry(150)
+        self.assertEqual(self.cache.fetch_statement('AAPL', 'income'), INCOME)
+        self.assertEqual(self.fetcher.calls, 2)
+        self.assertEqual(self.cache.cache_stats()['misses'], 2)
+
+    def test_expired_entry_is_served_when_the_fetch_fails(self):
+        self.cache.fetch_statement('AAPL', 'income')
+        self.age_entry(150)
+        self.fetcher.fail = True
+        self.assertEqual(self.cache.fetch_statement('AAPL', 'income'), INCOME)
+        with self.assertRaises(ConnectionError):
+            self.cache.fetch_statement('AAPL', 'cash')
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = CachedFetcher(self.fetcher, path=self.path, max_entries=2)
+        cache.fetch_statement('AAPL', 'income')
+        time.sleep(0.01)
+        cache.fetch_statement('AAPL', 'cash')
+        time.sleep(0.01)
+        cache.fetch_statement('AAPL', 'income')  # Now more recently used than cash
+        time.sleep(0.01)
+        cache.fetch_statement('AAPL', 'balance')
+
+        self.assertEqual(set(cache.cached_statements()), {('AAPL', 'income'), ('AAPL', 'balance')})
+        cache.fetch_statement('AAPL', 'cash')
+        self.assertEqual(self.fetcher.calls, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import json
+import math
+import tempfile
+import unittest
+
+import numpy as np
+
+from stocks_consulting import CachedFetcher, FixtureFetcher, FundamentalsSnapshot, compute_indicators, request_data
+from stocks_screener import compute_ratios, load_statements_table, percent, screen, warm_cache
+
+# Latest report of every statement of each fixture ticker. ZERO has no net income
+# and no equity, NODIV pays no dividends and NOBAL has no balance sheet.
+REPORTS = {
+    'AAPL': ({'totalRevenue': 1000.0, 'grossProfit': 400.0, 'netIncome': 100.0, 'ebit': 150.0},
+             {'freeCashFlow': 80.0, 'cashDividendsPaid': -20.0},
+             {'stockholdersEquity': 500.0, 'totalAssets': 2000.0, 'longTermDebt': 250.0, 'totalCapitalization': 750.0}),
+    'MSFT': ({'totalRevenue': 2000.0, 'grossProfit': 1300.0, 'netIncome': 700.0, 'ebit': 900.0},
+             {'freeCashFlow': 600.0, 'cashDividendsPaid': -210.0},
+             {'stockholdersEquity': 2000.0, 'totalAssets': 4000.0, 'longTermDebt': 400.0, 'totalCapitalization': 9000.0}),
+    'ZERO': ({'totalRevenue': 50.0, 'grossProfit': 10.0, 'netIncome': 0.0, 'ebit': -5.0},
+             {'freeCashFlow': -3.0, 'cashDividendsPaid': 0.0},
+             {'stockholdersEquity': 0.0, 'totalAssets': 100.0, 'longTermDebt': 30.0, 'totalCapitalization': 40.0}),
+    'NODIV': ({'totalRevenue': 300.0, 'grossProfit': 90.0, 'netIncome': 30.0, 'ebit': 45.0},
+              {'freeCashFlow': 25.0},
+              {'stockholdersEquity': 150.0, 'totalAssets': 600.0, 'longTermDebt': 0.0, 'totalCapitalization': 200.0}),
+    'NOBAL': ({'totalRevenue': 400.0, 'grossProfit': 100.0, 'netIncome': 40.0, 'ebit': 60.0},
+              {'freeCashFlow': 35.0, 'cashDividendsPaid': -10.0},
+              None),
+}
+
+# Ratio column of the screener behind every indicator of the Stocks Consulting page
+INDICATOR_COLUMNS = {
+    "Turnover": 'turnover',
+    "Net Turnover": 'net_income',
+    "Gross Margin": 'gross_margin',
+    "Net Margin": 'net_margin',
+    "Operating Margin": 'operating_margin',
+    "ROE (Return on Equity)": 'roe',
+    "ROA (Return on Assets)": 'roa',
+    "Payout Ratio": 'payout_ratio',
+    "PER (Price Earnings Ratio)": 'per',
+    "Free Cash Flow": 'free_cash_flow',
+    "Ratio Debt/Equity": 'debt_equity',
+}
+
+
+# Fixture files of REPORTS, with an older report in front of the latest one
+def write_fixtures(directory):
+    for ticker, reports in REPORTS.items():
+        for kind, report in zip(('income', 'cash', 'balance'), reports):
+            if report is None:
+                continue
+            older = {field: 1.0 for field in report}
+            with open(os.path.join(directory, f"{ticker}_{kind}.json"), 'w') as f:
+                json.dump([{'2022-09-30': older}, {'2023-09-30': report}], f)
+        with open(os.path.join(directory, f"{ticker}_prices.json"), 'w') as f:
+            json.dump({'prices': [{'close': 10.0}]}, f)
+
+
+class ScreenerTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        write_fixtures(directory.name)
+        self.fetcher = CachedFetcher(FixtureFetcher(directory.name), path=os.path.join(directory.name, 'cache.sqlite3'))
+        self.assertEqual(warm_cache(list(REPORTS), self.fetcher), (14, 1))
+        self.table = load_statements_table(fetcher=self.fetcher)
+        self.ratios = compute_ratios(self.table)
+
+    def test_statements_table(self):
+        self.assertEqual(sorted(self.table.index), sorted(REPORTS))
+        self.assertEqual(self.table.loc['MSFT', 'netIncome'], 700.0)  # From the latest report
+        self.assertTrue(math.isnan(self.table.loc['NODIV', 'cashDividendsPaid']))
+        self.assertTrue(self.table.loc['NOBAL', ['stockholdersEquity', 'totalAssets']].isna().all())
+        self.assertEqual(list(load_statements_table(['aapl', 'nobal', 'goog'], self.fetcher).index.sort_values()),
+                         ['AAPL', 'NOBAL'])
+        # Nothing more is fetched when the cache is warm
+        self.assertEqual(warm_cache(['AAPL', 'MSFT'], self.fetcher), (0, 0))
+
+    def test_ratios_match_the_stocks_consulting_indicators(self):
+        for ticker in REPORTS:
+            indicators = compute_indicators(FundamentalsSnapshot.from_data(*request_data(ticker, self.fetcher)))
+            for name, column in INDICATOR_COLUMNS.items():
+                value = self.ratios.loc[ticker, column]
+                with self.subTest(ticker=ticker, indicator=name):
+                    if indicators[name] == "N/A":
+                        self.assertTrue(math.isnan(value))
+                    else:
+                        self.assertAlmostEqual(float(indicators[name].split()[0]), value, places=2)
+
+    def test_zero_and_missing_denominators_give_nan(self):
+        zero = self.ratios.loc['ZERO']
+        self.assertTrue(np.isnan(zero[['roe', 'debt_equity', 'payout_ratio', 'per']]).all())
+        self.assertEqual(zero['gross_margin'], 20.0)
+        self.assertTrue(np.isnan(self.ratios.loc['NOBAL', ['roe', 'roa', 'per', 'debt_equity']]).all())
+        self.assertEqual(self.ratios.loc['NODIV', 'payout_ratio'], 0.0)
+        self.assertTrue(np.isnan(percent([1.0, 1.0, np.nan], [0.0, np.nan, 2.0])).all())
+
+    def test_sort_parsing(self):
+        self.assertEqual(list(screen(self.ratios, sort='-gross_margin').index),
+                         ['MSFT', 'AAPL', 'NODIV', 'NOBAL', 'ZERO'])
+        # AAPL and NODIV have the same ROE, the second key breaks the tie; NaN go last
+        self.assertEqual(list(screen(self.ratios, sort=' roe , -turnover ').index)[:3], ['AAPL', 'NODIV', 'MSFT'])
+        self.assertEqual(list(screen(self.ratios, sort='roe,turnover').index)[:3], ['NODIV', 'AAPL', 'MSFT'])
+        self.assertEqual(set(screen(self.ratios, sort='-roe').index[3:]), {'ZERO', 'NOBAL'})
+        self.assertEqual(list(screen(self.ratios, sort='-net_margin,turnover', top=2).index), ['MSFT', 'NODIV'])
+
+    def test_filter_and_top(self):
+        result = screen(self.ratios, "roe > 15 and debt_equity < 80", sort='-roe,-turnover')
+        self.assertEqual(list(result.index), ['MSFT', 'AAPL', 'NODIV'])
+        self.assertEqual(len(screen(self.ratios, top=3)), 3)
+
+    def test_unknown_sort_column_is_an_error(self):
+        with self.assertRaisesRegex(ValueError, 'price'):
+            screen(self.ratios, sort='-roe,-price')
+
+
+if __name__ == '__main__':
+    unittest.main()